@@ -4,6 +4,7 @@ from backend.models.user import User
 from schemas import UserCreate, UserLogin, UserSchema, UserInDB, ProfileSubmission, BatchProfileSubmission, FeedbackSubmission
 from services import freemium_service, user_service, auth_service, feature_toggle
 from services.rate_limiter import rate_limiter
+from services.upload_handler import upload_handler, RequestBodyLimitMiddleware
 from typing import List
 import os
 from dotenv import load_dotenv
@@ -15,10 +16,16 @@ from firebase_admin import credentials, auth, initialize_app
 from fastapi.responses import JSONResponse
 from exceptions import AppError
 from ml_models import FakeProfileDetector, extract_features, preprocess_data, train_model
+from ml_models.text_feature_extraction import text_feature_extractor
+from ml_models.cascade import cascade_analyzer, ANALYSIS_MODES
+from ml_models.profile_key import get_profile_key
+from ml_models.image_feature_extraction import image_embedding_batcher
+from ml_models.image_executor import image_analysis_executor
+from ml_models.stage_executor import stage_executor
+from fastapi.concurrency import run_in_threadpool
 from data_collection.collector import DataCollector
 from fastapi import UploadFile
 import json
-import shutil
 import pickle
 import hashlib
 from redis import Redis
@@ -225,47 +232,42 @@ async def get_current_user_info(current_user: UserInDB = Depends(get_current_use
 async def analyze_profile(
     profile_data: str = Form(...),
     profile_pictures: List[UploadFile] = File(None),
+    analysis_mode: str = Form('cascade'),
     current_user: User = Depends(get_current_active_user),
     limiter: RateLimiter = Depends(RateLimiter(times=10, minutes=1))  # 10 requests per minute
 ):
     if not freemium_service.check_scan_limit(current_user):
         raise HTTPException(status_code=403, detail="Daily scan limit reached")
+    if analysis_mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail=f"analysis_mode must be one of {', '.join(ANALYSIS_MODES)}")
     
     profile_data = json.loads(profile_data)
     
-    # Save the uploaded images temporarily
-    temp_image_paths = []
-    if profile_pictures:
-        for picture in profile_pictures:
-            temp_image_path = f"temp_{picture.filename}"
-            with open(temp_image_path, "wb") as buffer:
-                shutil.copyfileobj(picture.file, buffer)
-            temp_image_paths.append(temp_image_path)
-        profile_data['profile_pictures'] = temp_image_paths
-    
-    # Add network-related data to profile_data
-    profile_data['id'] = str(current_user.id)
-    profile_data['followers_count'] = current_user.followers_count
-    profile_data['following_count'] = current_user.following_count
-    profile_data['connections'] = current_user.connections
+    # Network features describe the analysed profile: its own counts and connections as
+    # submitted, keyed in the graph by get_profile_key (never the analyst's account)
+    profile_data.setdefault('followers_count', 0)
+    profile_data.setdefault('following_count', 0)
+    profile_data.setdefault('connections', [])
 
     # Add temporal data to profile_data
     profile_data['user'] = current_user
 
-    features = extract_features(profile_data)
-    model = continuous_learner.current_model
-    
-    feature_list = [features[f] for f in model.feature_names_]
-    
-    prediction = model.predict([feature_list])[0]
-    probability = model.predict_proba([feature_list])[0][1]
+    # Uploads are read into bounded buffers (spooled to a private temp dir when large) that
+    # are released once the analysis finishes, including on errors
+    async with upload_handler.receive_images(profile_pictures) as image_sources:
+        if image_sources:
+            profile_data['profile_pictures'] = image_sources
+        cascade_result = await run_in_threadpool(cascade_analyzer.analyze, profile_data, continuous_learner.current_model, analysis_mode)
 
     analysis_result = {
         "user_id": str(current_user.id),
         "profile_url": profile_data.get('profile_url', ''),
-        "result": "fake" if prediction == 1 else "genuine",
-        "confidence": float(probability),
-        "features": features,
+        "profile_key": get_profile_key(profile_data),
+        "result": "fake" if cascade_result['prediction'] == 1 else "genuine",
+        "confidence": cascade_result['probability'],
+        "features": cascade_result['features'].to_document(),
+        "analysis_stage": cascade_result['stage'],
+        "gnn_probability": cascade_result['gnn_probability'],
         "created_at": datetime.utcnow()
     }
 
@@ -282,32 +284,28 @@ async def analyze_profile(
 
     freemium_service.increment_scan_count(current_user)
     
-    # Remove the temporary image files
-    for temp_path in temp_image_paths:
-        os.remove(temp_path)
-    
     return {
         "result": analysis_result["result"],
         "confidence": analysis_result["confidence"],
-        "features": analysis_result["features"]
+        "features": cascade_result['features'].to_dict(),
+        "analysis_stage": analysis_result["analysis_stage"],
+        "gnn_probability": analysis_result["gnn_probability"]
     }
 
 # Asynchronous background task for profile analysis
 async def analyze_profile_background(profile_data: dict, current_user: UserInDB):
-    features = extract_features(profile_data)
-    model = continuous_learner.current_model
-    
-    feature_list = [features[f] for f in model.feature_names_]
-    
-    prediction = model.predict([feature_list])[0]
-    probability = model.predict_proba([feature_list])[0][1]
+    analysis_mode = profile_data.get('analysis_mode', 'cascade')
+    cascade_result = await run_in_threadpool(cascade_analyzer.analyze, profile_data, continuous_learner.current_model, analysis_mode)
     
     analysis_result = {
         "user_id": str(current_user.id),
         "profile_url": profile_data.get('profile_url', ''),
-        "result": "fake" if prediction == 1 else "genuine",
-        "confidence": float(probability),
-        "features": features,
+        "profile_key": get_profile_key(profile_data),
+        "result": "fake" if cascade_result['prediction'] == 1 else "genuine",
+        "confidence": cascade_result['probability'],
+        "features": cascade_result['features'].to_document(),
+        "analysis_stage": cascade_result['stage'],
+        "gnn_probability": cascade_result['gnn_probability'],
         "created_at": datetime.utcnow()
     }
 
@@ -316,7 +314,8 @@ async def analyze_profile_background(profile_data: dict, current_user: UserInDB)
     
     # Update cache
     profile_key = generate_profile_key(profile_data)
-    redis_client.setex(profile_key, 3600, pickle.dumps(analysis_result))  # Cache for 1 hour
+    cached_result = {**analysis_result, "features": cascade_result['features'].to_dict()}
+    redis_client.setex(profile_key, 3600, pickle.dumps(cached_result))  # Cache for 1 hour
     
     freemium_service.increment_scan_count(current_user)
 
@@ -328,6 +327,8 @@ async def analyze_profile_realtime(
 ):
     if not freemium_service.check_scan_limit(current_user):
         raise HTTPException(status_code=403, detail="Daily scan limit reached")
+    if profile_data.get('analysis_mode', 'cascade') not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail=f"analysis_mode must be one of {', '.join(ANALYSIS_MODES)}")
     
     profile_key = generate_profile_key(profile_data)
     
@@ -355,9 +356,7 @@ async def get_user_stats(current_user: dict = Depends(get_current_user_credentia
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Update network features before returning stats
-    user_service.update_user_network_features(user)
-    
+    # Network features are kept current by the background recomputation job
     return user_service.get_user_stats(user)
 
 # Admin routes
@@ -434,6 +433,9 @@ async def collect_profile(profile_data: dict, current_user: UserInDB = Depends(g
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error collecting profile: {str(e)}")
 
+# Bound request bodies before FastAPI parses any form
+app.add_middleware(RequestBodyLimitMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -494,6 +496,18 @@ async def get_daily_analysis_count(days: int = 30, current_user: User = Depends(
         raise HTTPException(status_code=403, detail="Admin access required")
     return monitoring_service.get_daily_analysis_count(days)
 
+@app.get("/api/admin/monitoring/inference-batcher")
+async def get_inference_batcher_metrics(current_user: User = Depends(get_current_active_user)):
+    if not user_service.is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return image_embedding_batcher.metrics()
+
+@app.get("/api/admin/monitoring/feature-stages")
+async def get_feature_stage_metrics(current_user: User = Depends(get_current_active_user)):
+    if not user_service.is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return stage_executor.metrics()
+
 # API versioning
 v1_router = APIRouter(prefix="/api/v1")
 
@@ -530,20 +544,20 @@ async def analyze_profile(
     if not freemium_service.check_scan_limit(current_user):
         raise HTTPException(status_code=403, detail="Daily scan limit reached")
     
-    features = extract_features(profile_data.dict())
-    model = continuous_learner.current_model
-    
-    feature_list = [features[f] for f in model.feature_names_]
-    
-    prediction = model.predict([feature_list])[0]
-    probability = model.predict_proba([feature_list])[0][1]
+    if profile_data.analysis_mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail=f"analysis_mode must be one of {', '.join(ANALYSIS_MODES)}")
+
+    cascade_result = await run_in_threadpool(cascade_analyzer.analyze, profile_data.dict(), continuous_learner.current_model, profile_data.analysis_mode)
 
     analysis_result = {
         "user_id": str(current_user.id),
         "profile_url": profile_data.profile_url,
-        "result": "fake" if prediction == 1 else "genuine",
-        "confidence": float(probability),
-        "features": features,
+        "profile_key": get_profile_key(profile_data.dict()),
+        "result": "fake" if cascade_result['prediction'] == 1 else "genuine",
+        "confidence": cascade_result['probability'],
+        "features": cascade_result['features'].to_document(),
+        "analysis_stage": cascade_result['stage'],
+        "gnn_probability": cascade_result['gnn_probability'],
         "created_at": datetime.utcnow()
     }
 
@@ -551,7 +565,7 @@ async def analyze_profile(
     logging_service.log_prediction(analysis_result["user_id"], analysis_result["profile_url"], analysis_result["result"], analysis_result["confidence"])
     freemium_service.increment_scan_count(current_user)
     
-    return analysis_result
+    return {**analysis_result, "features": cascade_result['features'].to_dict()}
 
 # Batch profile analysis
 @v1_router.post("/analyze/batch")
@@ -563,28 +577,36 @@ async def analyze_batch_profiles(
     if not freemium_service.check_batch_scan_limit(current_user, len(batch_data.profiles)):
         raise HTTPException(status_code=403, detail="Batch scan limit reached")
     
-    results = []
-    for profile in batch_data.profiles:
-        features = extract_features(profile.dict())
-        model = continuous_learner.current_model
-        
-        feature_list = [features[f] for f in model.feature_names_]
-        
-        prediction = model.predict([feature_list])[0]
-        probability = model.predict_proba([feature_list])[0][1]
+    if any(profile.analysis_mode not in ANALYSIS_MODES for profile in batch_data.profiles):
+        raise HTTPException(status_code=400, detail=f"analysis_mode must be one of {', '.join(ANALYSIS_MODES)}")
 
+    # Profiles that explicitly ask for a full analysis skip the cheap stage
+    model = continuous_learner.current_model
+    cascade_results = [None] * len(batch_data.profiles)
+    for mode in ANALYSIS_MODES:
+        indices = [i for i, profile in enumerate(batch_data.profiles) if profile.analysis_mode == mode]
+        if indices:
+            mode_results = await run_in_threadpool(cascade_analyzer.analyze_many, [batch_data.profiles[i].dict() for i in indices], model, mode)
+            for i, cascade_result in zip(indices, mode_results):
+                cascade_results[i] = cascade_result
+
+    results = []
+    for profile, cascade_result in zip(batch_data.profiles, cascade_results):
         analysis_result = {
             "user_id": str(current_user.id),
             "profile_url": profile.profile_url,
-            "result": "fake" if prediction == 1 else "genuine",
-            "confidence": float(probability),
-            "features": features,
+            "profile_key": get_profile_key(profile.dict()),
+            "result": "fake" if cascade_result['prediction'] == 1 else "genuine",
+            "confidence": cascade_result['probability'],
+            "features": cascade_result['features'].to_document(),
+            "analysis_stage": cascade_result['stage'],
+            "gnn_probability": cascade_result['gnn_probability'],
             "created_at": datetime.utcnow()
         }
 
         analyses_collection.insert_one(analysis_result)
         logging_service.log_prediction(analysis_result["user_id"], analysis_result["profile_url"], analysis_result["result"], analysis_result["confidence"])
-        results.append(analysis_result)
+        results.append({**analysis_result, "features": cascade_result['features'].to_dict()})
     
     freemium_service.increment_batch_scan_count(current_user, len(batch_data.profiles))
     
@@ -686,6 +708,8 @@ app.include_router(v1_router)
 
 @app.on_event("startup")
 async def startup_event():
+    text_feature_extractor.warm_up()
+    image_analysis_executor.warm_up()
     start_background_jobs()
 
 if __name__ == "__main__":
@@ -136,6 +136,11 @@ class User(Base):
         )
         user.contributions = data.get('contributions', user.contributions)
         user.rewards = data.get('rewards', user.rewards)
+        # Network inputs and the features the background recomputation stores
+        for field in ('followers_count', 'following_count', 'connections', 'follower_following_ratio',
+                      'degree_centrality', 'betweenness_centrality', 'closeness_centrality',
+                      'clustering_coefficient', 'network_score'):
+            setattr(user, field, data.get(field, getattr(user, field)))
         return user
 
     @staticmethod
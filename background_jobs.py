@@ -4,8 +4,13 @@ from data_collection.collector import DataCollector
 from ml_models.feature_extraction import extract_features
 from ml_models.model import FakeProfileDetector
 from ml_models.model_evaluation import evaluate_model
+from ml_models.near_duplicate_index import near_duplicate_index
+from ml_models.image_hash_index import image_hash_index
+from ml_models.face_index import face_index
+from ml_models.graph_store import graph_store
 from services.logging_service import logging_service
 from services.monitoring_service import monitoring_service
+from services.user_service import recompute_network_features, NETWORK_RECOMPUTE_BATCH
 from datetime import datetime
 import pandas as pd
 
@@ -51,6 +56,47 @@ def retrain_and_evaluate_model():
     except Exception as e:
         logging_service.log_error(f"Error in model retraining and evaluation: {str(e)}")
 
+def save_near_duplicate_index():
+    try:
+        near_duplicate_index.save()
+        logging_service.log_info("Near-duplicate index saved")
+    except Exception as e:
+        logging_service.log_error(f"Error saving near-duplicate index: {str(e)}")
+
+def save_image_hash_index():
+    try:
+        image_hash_index.save()
+        logging_service.log_info("Image hash index saved")
+    except Exception as e:
+        logging_service.log_error(f"Error saving image hash index: {str(e)}")
+
+def save_face_index():
+    try:
+        face_index.save()
+        logging_service.log_info("Face index saved")
+    except Exception as e:
+        logging_service.log_error(f"Error saving face index: {str(e)}")
+
+def save_graph_store():
+    try:
+        graph_store.save()
+        logging_service.log_info("Social graph store saved")
+    except Exception as e:
+        logging_service.log_error(f"Error saving social graph store: {str(e)}")
+
+def recompute_dirty_network_features():
+    try:
+        total = 0
+        while True:
+            count = recompute_network_features()
+            total += count
+            if count < NETWORK_RECOMPUTE_BATCH:
+                break
+        if total:
+            logging_service.log_info(f"Recomputed network features of {total} users")
+    except Exception as e:
+        logging_service.log_error(f"Error recomputing network features: {str(e)}")
+
 def store_features_in_db(profile_id, features):
     # Implement this function to store features in your database
     pass
@@ -74,6 +120,38 @@ def start_background_jobs():
         CronTrigger(hour=2, minute=0)
     )
     
+    # Persist the near-duplicate text index every hour
+    scheduler.add_job(
+        save_near_duplicate_index,
+        CronTrigger(minute=0)
+    )
+    
+    # Persist the perceptual-hash image index every hour
+    scheduler.add_job(
+        save_image_hash_index,
+        CronTrigger(minute=5)
+    )
+    
+    # Persist the face-encoding index every hour
+    scheduler.add_job(
+        save_face_index,
+        CronTrigger(minute=10)
+    )
+    
+    # Compact the social graph's edge log into a new CSR every hour; this process must be
+    # the store's only saver (see GraphStore.save)
+    scheduler.add_job(
+        save_graph_store,
+        CronTrigger(minute=15)
+    )
+    
+    # Recompute network features of users whose neighbourhood changed, every 10 minutes
+    scheduler.add_job(
+        recompute_dirty_network_features,
+        CronTrigger(minute='*/10'),
+        max_instances=1
+    )
+    
     scheduler.start()
     logging_service.log_info("Background jobs scheduled and started")
 
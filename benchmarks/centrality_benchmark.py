@@ -0,0 +1,80 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ml_models import centrality
+from ml_models.graph_store import GraphStore, csr_from_edges, node_hash
+
+EDGE_COUNTS = [10 ** 5, 10 ** 6, 10 ** 7]
+
+def synthetic_graph(edges, avg_degree=16, seed=0):
+    # Random graph with a skewed degree distribution: one endpoint uniform, the other biased
+    # towards low ids, so a few accounts are hubs like on a real follower graph
+    rng = np.random.default_rng(seed)
+    n = max(edges * 2 // avg_degree, 3)
+    src = rng.integers(0, n, edges, dtype=np.int64).astype(np.int32)
+    dst = (n * rng.random(edges) ** 2).astype(np.int32)
+    indptr, indices = csr_from_edges(src, dst, n)
+    node_hashes = np.fromiter((node_hash(str(i)) for i in range(n)), dtype=np.uint64, count=n)
+    return GraphStore.from_csr(indptr, indices, node_hashes, path='unused')
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+def networkx_centrality(ego):
+    import networkx as nx
+    G = ego.to_networkx()
+    return {
+        'betweenness': nx.betweenness_centrality(G)[0],
+        'closeness': nx.closeness_centrality(G)[0],
+        'clustering': nx.clustering(G, 0),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Single-node centrality on ego subgraphs of synthetic graphs')
+    parser.add_argument('--edges', type=int, nargs='+', default=EDGE_COUNTS)
+    parser.add_argument('--radius', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--samples', type=int, default=5, help='nodes measured per graph and radius')
+    parser.add_argument('--pivots', type=int, default=centrality.NETWORK_BETWEENNESS_PIVOTS)
+    parser.add_argument('--max-nodes', type=int, default=50000)
+    parser.add_argument('--networkx-max-edges', type=int, default=100000,
+                        help='also run networkx on egos up to this size for timing and error')
+    args = parser.parse_args()
+
+    for edges in args.edges:
+        store, build_ms = timed(synthetic_graph, edges)
+        print(f"Graph: {store.num_nodes} nodes, {store.num_edges} edges (built in {build_ms / 1000:.1f}s)")
+        rng = np.random.default_rng(1)
+        degrees = np.diff(store.indptr)
+        candidates = np.flatnonzero(degrees >= 2)
+        nodes = rng.choice(candidates, min(args.samples, len(candidates)), replace=False)
+
+        for radius in args.radius:
+            rows = []
+            for node in nodes:
+                ego, ego_ms = timed(store.ego_subgraph, str(node), radius, args.max_nodes)
+                _, closeness_ms = timed(centrality.closeness_centrality, ego.indptr, ego.indices, 0)
+                _, clustering_ms = timed(centrality.clustering_coefficient, ego.indptr, ego.indices, 0)
+                (betweenness, bound), betweenness_ms = timed(
+                    centrality.betweenness_centrality, ego.indptr, ego.indices, 0, args.pivots)
+                row = [ego.num_nodes, ego.num_edges, ego_ms, closeness_ms, clustering_ms, betweenness_ms, bound]
+                if ego.num_edges <= args.networkx_max_edges:
+                    exact, networkx_ms = timed(networkx_centrality, ego)
+                    row += [networkx_ms, abs(betweenness - exact['betweenness'])]
+                else:
+                    row += [float('nan'), float('nan')]
+                rows.append(row)
+
+            r = np.nanmean(np.array(rows, dtype=np.float64), axis=0)
+            print(f"  radius {radius}: ego {r[0]:.0f} nodes / {r[1]:.0f} edges | extract {r[2]:.1f}ms, "
+                  f"closeness {r[3]:.1f}ms, clustering {r[4]:.2f}ms, betweenness {r[5]:.1f}ms "
+                  f"(bound ±{r[6]:.3f}) | networkx {r[7]:.0f}ms, betweenness error {r[8]:.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ml_models.image_inference_backend import load_image_backend, IMAGE_MODEL_DIR
+
+BACKENDS = ['keras', 'onnx', 'onnx-int8']
+BATCH_SIZES = [1, 8, 16]
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def load_images(image_dir, count, seed=0):
+    # Real pictures resized like DecodedImage.cnn_input when a directory is given, otherwise noise
+    if image_dir:
+        from PIL import Image
+        names = sorted(os.listdir(image_dir))[:count]
+        return np.stack([
+            np.asarray(Image.open(os.path.join(image_dir, name)).convert('RGB').resize((224, 224), Image.NEAREST),
+                       dtype=np.float32)
+            for name in names
+        ])
+    return np.random.RandomState(seed).randint(0, 256, (count, 224, 224, 3)).astype(np.float32)
+
+def run_backend(name, model_dir, images, repeats, results):
+    # Each backend runs in its own spawned process so resident memory is measured in isolation
+    baseline_rss = rss_mb()
+    start = time.perf_counter()
+    backend = load_image_backend(name, model_dir)
+    load_time = time.perf_counter() - start
+    backend.embed(images[:1])  # warm up
+
+    latencies = {}
+    for batch_size in BATCH_SIZES:
+        batch = images[:batch_size]
+        if len(batch) < batch_size:
+            batch = np.resize(images, (batch_size,) + images.shape[1:])
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            backend.embed(batch)
+            timings.append(time.perf_counter() - start)
+        latencies[batch_size] = (1000 * np.median(timings), 1000 * np.percentile(timings, 95))
+
+    embeddings = backend.embed(images)
+    results[name] = {
+        'load_time': load_time,
+        'rss_mb': rss_mb() - baseline_rss,
+        'latencies': latencies,
+        'embeddings': embeddings,
+        'scores': backend.classify(embeddings),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency, memory and parity of the image inference backends')
+    parser.add_argument('--backends', nargs='+', default=BACKENDS, choices=BACKENDS)
+    parser.add_argument('--model-dir', default=IMAGE_MODEL_DIR)
+    parser.add_argument('--image-dir', default=None)
+    parser.add_argument('--samples', type=int, default=16)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    images = load_images(args.image_dir, args.samples)
+    context = multiprocessing.get_context('spawn')
+    results = context.Manager().dict()
+    for name in args.backends:
+        process = context.Process(target=run_backend, args=(name, args.model_dir, images, args.repeats, results))
+        process.start()
+        process.join()
+        if name not in results:
+            print(f"{name}: failed (exit code {process.exitcode})")
+
+    print(f"{len(images)} images, {args.repeats} repeats per batch size")
+    for name in args.backends:
+        if name not in results:
+            continue
+        result = results[name]
+        timings = ', '.join(f"bs={bs}: p50 {p50:.1f}ms p95 {p95:.1f}ms ({p50 / bs:.1f}ms/img)"
+                            for bs, (p50, p95) in result['latencies'].items())
+        print(f"{name}: load {result['load_time']:.1f}s, +{result['rss_mb']:.0f}MB RSS, {timings}")
+
+    # Accuracy parity against the Keras reference
+    if 'keras' in results:
+        reference = results['keras']
+        for name in args.backends:
+            if name == 'keras' or name not in results:
+                continue
+            expected, actual = reference['embeddings'], results[name]['embeddings']
+            cosine = (expected * actual).sum(axis=1) / (
+                np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1) + 1e-12)
+            score_diff = np.abs(reference['scores'] - results[name]['scores'])
+            print(f"{name} vs keras: max |diff| {np.abs(expected - actual).max():.4g}, "
+                  f"min cosine {cosine.min():.5f}, max score diff {score_diff.max():.4g}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+import random
+import sys
+import time
+import pandas as pd
+from textblob import TextBlob
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ml_models.spelling import load_word_frequencies, SpellingErrorCounter
+
+ALPHABET = 'abcdefghijklmnopqrstuvwxyz'
+
+def add_typo(word, rng):
+    i = rng.randrange(len(word))
+    op = rng.choice(['delete', 'insert', 'replace', 'swap'])
+    if op == 'delete' and len(word) > 2:
+        return word[:i] + word[i + 1:]
+    if op == 'insert':
+        return word[:i] + rng.choice(ALPHABET) + word[i:]
+    if op == 'swap' and i < len(word) - 1:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word[:i] + rng.choice(ALPHABET) + word[i + 1:]
+
+def synthetic_corpus(frequencies, profiles=50, posts_per_profile=20, words_per_post=25, typo_rate=0.05, seed=42):
+    rng = random.Random(seed)
+    words = list(frequencies)
+    weights = [frequencies[w] for w in words]
+    corpus = []
+    for _ in range(profiles):
+        posts = []
+        for _ in range(posts_per_profile):
+            tokens = rng.choices(words, weights=weights, k=words_per_post)
+            tokens = [add_typo(t, rng) if rng.random() < typo_rate else t for t in tokens]
+            posts.append(' '.join(tokens))
+        corpus.append(' '.join(rng.choices(words, weights=weights, k=15)) + ' ' + ' '.join(posts))
+    return corpus
+
+def load_corpus(frequencies):
+    if os.path.exists('user_data.csv'):
+        data = pd.read_csv('user_data.csv')
+        return [f"{row.get('bio', '')} {row.get('posts', '')}" for row in data.to_dict('records')]
+    return synthetic_corpus(frequencies)
+
+def textblob_errors(text):
+    # Tokens TextBlob.correct() would change
+    blob = TextBlob(text)
+    return sum(1 for a, b in zip(blob.words, blob.correct().words) if a.lower() != b.lower())
+
+def main():
+    frequencies = load_word_frequencies()
+
+    start = time.perf_counter()
+    counter = SpellingErrorCounter(frequencies)
+    build_time = time.perf_counter() - start
+
+    corpus = load_corpus(frequencies)
+    total_tokens = sum(len(text.split()) for text in corpus)
+    print(f"Corpus: {len(corpus)} profiles, {total_tokens} tokens")
+    print(f"Index build: {build_time:.2f}s ({len(counter.words)} words, {len(counter.delete_index)} deletes)")
+
+    start = time.perf_counter()
+    index_counts = [counter.count(text) for text in corpus]
+    index_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    textblob_counts = [textblob_errors(text) for text in corpus]
+    textblob_time = time.perf_counter() - start
+
+    print(f"TextBlob.correct(): {textblob_time:.2f}s total, {1000 * textblob_time / len(corpus):.1f}ms/profile, "
+          f"{sum(textblob_counts)} changed tokens")
+    print(f"SpellingErrorCounter: {index_time:.3f}s total, {1000 * index_time / len(corpus):.2f}ms/profile, "
+          f"{sum(m for m, _ in index_counts)} likely misspelled, {sum(o for _, o in index_counts)} other OOV")
+    print(f"Speedup: {textblob_time / index_time:.0f}x")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 from .scraper import SocialMediaScraper
 from .database import Profile
+from ml_models.near_duplicate_index import near_duplicate_index
+from ml_models.profile_key import get_profile_key
 
 class DataCollector:
     def __init__(self):
@@ -16,6 +18,8 @@ class DataCollector:
             new_profile = Profile(platform, username, profile_data)
             new_profile.save()
 
+        near_duplicate_index.add_profile(get_profile_key(profile_data), profile_data.get('bio', ''), profile_data.get('posts', []))
+
         return profile_data
 
     def collect_multiple_profiles(self, profile_urls):
@@ -19,3 +19,8 @@ class ResourceNotFoundError(AppError):
     """Raised when a requested resource is not found"""
     def __init__(self, message="Requested resource not found"):
         super().__init__(message, status_code=404)
+
+class PayloadTooLargeError(AppError):
+    """Raised when an upload exceeds the configured size or count limits"""
+    def __init__(self, message="Uploaded payload is too large"):
+        super().__init__(message, status_code=413)
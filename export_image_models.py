@@ -0,0 +1,59 @@
+import argparse
+import os
+import numpy as np
+import tensorflow as tf
+import tf2onnx
+from onnxruntime.quantization import quantize_dynamic, QuantType
+from ml_models.image_inference_backend import (
+    KerasImageBackend, OnnxImageBackend, compare_backends,
+    IMAGE_MODEL_DIR, BACKBONE_ONNX, BACKBONE_INT8_ONNX, HEAD_ONNX, EMBEDDING_SIZE
+)
+
+# Exported embeddings must stay this close to the Keras ones to be served
+MIN_EMBEDDING_COSINE = {'onnx': 0.9999, 'onnx-int8': 0.98}
+
+def export_models(model_dir=IMAGE_MODEL_DIR, opset=13):
+    os.makedirs(model_dir, exist_ok=True)
+    keras_backend = KerasImageBackend()
+
+    # Inputs are already preprocessed in numpy (see preprocess_batch), so the graphs start at the backbone
+    tf2onnx.convert.from_keras(
+        keras_backend.backbone,
+        input_signature=[tf.TensorSpec((None, 224, 224, 3), tf.float32, name='input')],
+        opset=opset,
+        output_path=os.path.join(model_dir, BACKBONE_ONNX),
+    )
+    tf2onnx.convert.from_keras(
+        keras_backend.head,
+        input_signature=[tf.TensorSpec((None, EMBEDDING_SIZE), tf.float32, name='embedding')],
+        opset=opset,
+        output_path=os.path.join(model_dir, HEAD_ONNX),
+    )
+    quantize_dynamic(
+        os.path.join(model_dir, BACKBONE_ONNX),
+        os.path.join(model_dir, BACKBONE_INT8_ONNX),
+        weight_type=QuantType.QInt8,
+    )
+    return keras_backend
+
+def check_parity(keras_backend, model_dir=IMAGE_MODEL_DIR, samples=16, seed=0):
+    batch = np.random.RandomState(seed).randint(0, 256, (samples, 224, 224, 3)).astype(np.float32)
+    passed = True
+    for quantized in (False, True):
+        backend = OnnxImageBackend(model_dir, quantized=quantized)
+        parity = compare_backends(keras_backend, backend, batch)
+        ok = parity['min_embedding_cosine'] >= MIN_EMBEDDING_COSINE[backend.name]
+        passed &= ok
+        print(f"{backend.name}: {'OK' if ok else 'FAILED'} {parity}")
+    return passed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export the ResNet50 backbone and profile picture head to ONNX')
+    parser.add_argument('--model-dir', default=IMAGE_MODEL_DIR)
+    parser.add_argument('--opset', type=int, default=13)
+    args = parser.parse_args()
+
+    keras_backend = export_models(args.model_dir, args.opset)
+    if not check_parity(keras_backend, args.model_dir):
+        raise SystemExit("Exported models are outside the parity tolerance; keep IMAGE_INFERENCE_BACKEND=keras")
+    print(f"Exported image models to {args.model_dir}")
@@ -2,6 +2,7 @@ from pymongo import MongoClient
 from dotenv import load_dotenv
 import os
 from datetime import datetime
+from services.user_service import mark_all_network_dirty
 
 load_dotenv()
 
@@ -36,5 +37,8 @@ def migrate_user_features():
 
     print(f"Modified {result.modified_count} documents")
 
+    # Queue every user for the background network-feature recomputation
+    mark_all_network_dirty()
+
 if __name__ == "__main__":
     migrate_user_features()
@@ -0,0 +1,123 @@
+from typing import Dict, List, Any
+import os
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from .feature_extraction import extract_features_many, feature_plan_for, get_profile_key, index_profiles
+from .text_feature_extraction import text_feature_extractor
+from .network_feature_extraction import calculate_follower_following_ratio
+from .temporal_feature_extraction import extract_temporal_features
+from .near_duplicate_index import near_duplicate_index
+from .feature_vector import FeatureVector
+from .schema_adapter import SchemaAdapter, schema_adapter_for
+from .feature_registry import feature_registry
+from .gnn_model import gnn_scorer
+
+CASCADE_MODEL_PATH = os.getenv('CASCADE_MODEL_PATH', 'cascade_model.joblib')
+# Stage-1 probabilities inside [lower, upper] are uncertain and go through the full pipeline
+CASCADE_UNCERTAINTY_LOWER = float(os.getenv('CASCADE_UNCERTAINTY_LOWER', 0.2))
+CASCADE_UNCERTAINTY_UPPER = float(os.getenv('CASCADE_UNCERTAINTY_UPPER', 0.8))
+ANALYSIS_MODES = ('cascade', 'full')
+
+CHEAP_FEATURES = [
+    'followers_count', 'following_count', 'posts_count', 'account_age_days',
+    'neg', 'neu', 'pos', 'compound',
+    'near_duplicate_post_ratio', 'max_bio_similarity',
+    'follower_following_ratio',
+    'account_age', 'posting_frequency', 'activity_variance', 'night_day_ratio',
+]
+CHEAP_TEXT_STEPS = feature_registry.plan(CHEAP_FEATURES).steps_for('text')
+
+def extract_cheap_features_many(user_datas: List[Dict[str, Any]]) -> List[FeatureVector]:
+    results = []
+    for user_data, features in zip(user_datas, text_feature_extractor.extract_many(user_datas, CHEAP_TEXT_STEPS)):
+        profile_key = get_profile_key(user_data)
+        bio, posts = user_data.get('bio', '') or '', user_data.get('posts', []) or []
+        # Only queried: CascadeAnalyzer indexes every profile, whichever stage settles it
+        features.update(near_duplicate_index.query_profile(profile_key, bio, posts))
+        features['follower_following_ratio'] = calculate_follower_following_ratio(
+            user_data.get('followers_count', 0), user_data.get('following_count', 0)
+        )
+        if user_data.get('user') is not None:
+            features.update(extract_temporal_features(user_data['user']))
+        results.append(features)
+    return results
+
+cheap_schema_adapter = SchemaAdapter(CHEAP_FEATURES)
+
+def cheap_feature_matrix(feature_vectors: List[Dict[str, Any]]) -> np.ndarray:
+    return cheap_schema_adapter.transform(feature_vectors)
+
+def train_cascade_model(feature_df: pd.DataFrame, labels, path: str = CASCADE_MODEL_PATH):
+    X = cheap_feature_matrix(feature_df.to_dict('records'))
+    model = CalibratedClassifierCV(make_pipeline(StandardScaler(), LogisticRegression(max_iter=1000)), cv=5)
+    model.fit(X, labels)
+    model.feature_names_ = CHEAP_FEATURES
+    joblib.dump(model, path)
+    return model
+
+class CascadeAnalyzer:
+    # Runs a calibrated model on cheap features first and only falls through to the full
+    # extractor pipeline (images, LDA, NER, grammar, centralities) for uncertain profiles.
+    def __init__(self, model_path: str = CASCADE_MODEL_PATH, lower: float = CASCADE_UNCERTAINTY_LOWER,
+                 upper: float = CASCADE_UNCERTAINTY_UPPER):
+        self.lower = lower
+        self.upper = upper
+        self.model = joblib.load(model_path) if os.path.exists(model_path) else None
+
+    def analyze_many(self, user_datas: List[Dict[str, Any]], full_model: Any, mode: str = 'cascade',
+                     update_indexes: bool = True) -> List[Dict[str, Any]]:
+        if mode not in ANALYSIS_MODES:
+            raise ValueError(f"Unsupported analysis mode: {mode}")
+
+        results: List[Dict[str, Any]] = [None] * len(user_datas)
+        uncertain = list(range(len(user_datas)))
+
+        if mode == 'cascade' and self.model is not None and user_datas:
+            cheap_features = extract_cheap_features_many(user_datas)
+            probabilities = self.model.predict_proba(cheap_feature_matrix(cheap_features))[:, 1]
+            uncertain = []
+            for i, probability in enumerate(probabilities):
+                if self.lower <= probability <= self.upper:
+                    uncertain.append(i)
+                else:
+                    results[i] = {
+                        'features': cheap_features[i],
+                        'prediction': int(probability > 0.5),
+                        'probability': float(probability),
+                        'gnn_probability': None,
+                        'stage': 'cheap',
+                    }
+
+            # Profiles settled here never reach extract_features, so the graph and the
+            # cross-profile indexes are fed with them separately
+            if update_indexes:
+                index_profiles([user_datas[i] for i in range(len(user_datas)) if results[i] is not None])
+
+        if uncertain:
+            all_features = extract_features_many([user_datas[i] for i in uncertain], feature_plan_for(full_model),
+                                                 update_indexes)
+            X = schema_adapter_for(full_model).transform(all_features)
+            predictions = full_model.predict(X)
+            probabilities = full_model.predict_proba(X)[:, 1]
+            for i, features, prediction, probability in zip(uncertain, all_features, predictions, probabilities):
+                results[i] = {
+                    'features': features,
+                    'prediction': int(prediction),
+                    'probability': float(probability),
+                    # Reported alongside the prediction, not blended into it
+                    'gnn_probability': gnn_scorer.score(user_datas[i], features),
+                    'stage': 'full',
+                }
+
+        return results
+
+    def analyze(self, user_data: Dict[str, Any], full_model: Any, mode: str = 'cascade',
+                update_indexes: bool = True) -> Dict[str, Any]:
+        return self.analyze_many([user_data], full_model, mode, update_indexes)[0]
+
+cascade_analyzer = CascadeAnalyzer()
@@ -0,0 +1,108 @@
+from typing import List, Optional, Tuple
+import math
+import os
+import numpy as np
+from .graph_store import gather
+
+# Sources sampled for the betweenness estimate; graphs with at most this many nodes are exact
+NETWORK_BETWEENNESS_PIVOTS = int(os.getenv('NETWORK_BETWEENNESS_PIVOTS', 64))
+# Probability that the sampled estimate lies within the returned error bound
+NETWORK_BETWEENNESS_CONFIDENCE = float(os.getenv('NETWORK_BETWEENNESS_CONFIDENCE', 0.95))
+
+# Single-node centralities on an undirected CSR graph (sorted, de-duplicated rows, both edge
+# directions stored), e.g. an EgoGraph. Values follow the networkx definitions of the same
+# name, so features keep their meaning; none of them touches more than one BFS per source.
+
+def _expand(indptr: np.ndarray, indices: np.ndarray, frontier: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # (parent, child) for every edge leaving the frontier
+    degrees = np.asarray(indptr[frontier + 1] - indptr[frontier], dtype=np.int64)
+    return np.repeat(frontier, degrees), gather(indptr, indices, frontier)
+
+def bfs_distances(indptr: np.ndarray, indices: np.ndarray, source: int) -> np.ndarray:
+    # Hop distance from `source` to every node, -1 where unreachable; one level per step
+    dist = np.full(len(indptr) - 1, -1, dtype=np.int32)
+    dist[source] = 0
+    frontier = np.array([source], dtype=np.int32)
+    depth = 0
+    while len(frontier):
+        depth += 1
+        children = gather(indptr, indices, frontier)
+        frontier = np.unique(children[dist[children] < 0])
+        dist[frontier] = depth
+    return dist
+
+def degree_centrality(indptr: np.ndarray, indices: np.ndarray, node: int) -> float:
+    n = len(indptr) - 1
+    return float(indptr[node + 1] - indptr[node]) / (n - 1) if n > 1 else 0.0
+
+def closeness_centrality(indptr: np.ndarray, indices: np.ndarray, node: int) -> float:
+    # Wasserman-Faust closeness (networkx's default): scaled by the reachable share of the graph
+    n = len(indptr) - 1
+    dist = bfs_distances(indptr, indices, node)
+    reachable = dist[dist >= 0]
+    total = int(reachable.sum())
+    if total == 0 or n <= 1:
+        return 0.0
+    r = len(reachable) - 1
+    return (r / total) * (r / (n - 1))
+
+def clustering_coefficient(indptr: np.ndarray, indices: np.ndarray, node: int) -> float:
+    # Triangles through `node` counted from intersections of its neighbours' rows with its own
+    neighbors = np.asarray(indices[indptr[node]:indptr[node + 1]])
+    d = len(neighbors)
+    if d < 2:
+        return 0.0
+    adjacent = gather(indptr, indices, neighbors)
+    positions = np.minimum(np.searchsorted(neighbors, adjacent), d - 1)
+    links = int(np.count_nonzero(neighbors[positions] == adjacent))  # each triangle twice
+    return links / (d * (d - 1))
+
+def _dependency(indptr: np.ndarray, indices: np.ndarray, source: int, target: int) -> float:
+    # Brandes' dependency of `source` on `target`: the share of shortest paths from `source`
+    # that pass through `target`, summed over all destinations
+    n = len(indptr) - 1
+    dist = np.full(n, -1, dtype=np.int32)
+    dist[source] = 0
+    sigma = np.zeros(n, dtype=np.float64)
+    sigma[source] = 1.0
+    levels: List[Tuple[np.ndarray, np.ndarray]] = []
+    frontier = np.array([source], dtype=np.int32)
+    depth = 0
+    while len(frontier):
+        depth += 1
+        parents, children = _expand(indptr, indices, frontier)
+        frontier = np.unique(children[dist[children] < 0])
+        dist[frontier] = depth
+        on_path = dist[children] == depth
+        parents, children = parents[on_path], children[on_path]
+        sigma += np.bincount(children, weights=sigma[parents], minlength=n)
+        levels.append((parents, children))
+
+    if dist[target] <= 0:
+        return 0.0
+    delta = np.zeros(n, dtype=np.float64)
+    # Levels below the target's are the only ones that feed its dependency
+    for parents, children in reversed(levels[dist[target]:]):
+        delta += np.bincount(parents, weights=sigma[parents] / sigma[children] * (1.0 + delta[children]),
+                             minlength=n)
+    return float(delta[target])
+
+def betweenness_centrality(indptr: np.ndarray, indices: np.ndarray, node: int,
+                           pivots: int = NETWORK_BETWEENNESS_PIVOTS,
+                           confidence: float = NETWORK_BETWEENNESS_CONFIDENCE,
+                           seed: Optional[int] = 0) -> Tuple[float, float]:
+    # Normalized betweenness of `node` estimated from `pivots` sampled BFS sources (Brandes &
+    # Pich), with a Hoeffding bound: the exact value is within `error` of the estimate with
+    # probability `confidence`. Exact, with zero error, when the graph has at most `pivots` nodes.
+    n = len(indptr) - 1
+    if n <= 2 or indptr[node + 1] - indptr[node] < 2:
+        return 0.0, 0.0
+    if n <= pivots:
+        sources, error = np.arange(n), 0.0
+    else:
+        sources = np.random.default_rng(seed).choice(n, pivots, replace=False)
+        # Each sampled term n * dependency / ((n - 1)(n - 2)) lies in [0, n / (n - 1)]
+        error = n / (n - 1) * math.sqrt(math.log(2 / (1 - confidence)) / (2 * pivots))
+    total = sum(_dependency(indptr, indices, int(source), node) for source in sources if source != node)
+    estimate = n / len(sources) * total / ((n - 1) * (n - 2))
+    return min(estimate, 1.0), error
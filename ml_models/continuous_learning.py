@@ -1,22 +1,41 @@
-from typing import Dict, List, Any, Union
+from typing import Dict, List, Any, Tuple, Union
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from .feature_extraction import extract_features
+from .feature_vector import FeatureVector
+from .schema_adapter import FEATURE_SCHEMA_DIR, load_schema_adapter, save_schema, schema_feature_names
 from .preprocessing import preprocess_data
 from .model_comparison import train_and_evaluate_models, train_ensemble
 from .model_evaluation import evaluate_model
 import joblib
+import os
+import re
 import schedule
 import time
 from datetime import datetime
 
+MODEL_FILE = 'best_model_v{version}.joblib'
+_VERSIONED_FILE = re.compile(r'^(?:best_model|feature_schema)_v(\d+)\.(?:joblib|json)$')
+
+def latest_model_version(directories=('.', FEATURE_SCHEMA_DIR)) -> int:
+    # Highest version among the saved models and schemas, 0 when there are none. Versions
+    # come from disk so a restarted process never reuses (and overwrites) an earlier one.
+    versions = [0]
+    for directory in set(directories):
+        if os.path.isdir(directory):
+            versions += [int(match.group(1)) for match in map(_VERSIONED_FILE.match, os.listdir(directory)) if match]
+    return max(versions)
+
 class ContinuousLearning:
     def __init__(self, db: Any, analyses_collection: Any, feedback_collection: Any):
         self.db = db
         self.analyses_collection = analyses_collection
         self.feedback_collection = feedback_collection
-        self.current_model = joblib.load('best_model.joblib')
-        self.model_version = 1
+        # The newest retrained model, or the one train_model.py shipped (schema version 1)
+        self.model_version = latest_model_version() or 1
+        model_path = MODEL_FILE.format(version=self.model_version)
+        self.current_model = joblib.load(model_path if os.path.exists(model_path) else 'best_model.joblib')
+        load_schema_adapter(self.current_model, self.model_version)
 
     def collect_feedback(self, analysis_id: str, user_feedback: str) -> None:
         feedback = {
@@ -36,7 +55,7 @@ class ContinuousLearning:
         training_data = []
         for analysis in analyses:
             if analysis['_id'] in feedback_dict:
-                features = analysis['features']
+                features = FeatureVector.from_document(analysis['features']).to_dict()
                 label = 1 if feedback_dict[analysis['_id']] == 'fake' else 0
                 training_data.append((features, label))
 
@@ -50,7 +69,8 @@ class ContinuousLearning:
 
         features, labels = zip(*new_data)
         feature_df = pd.DataFrame(features)
-        X, y = preprocess_data(feature_df, labels)
+        feature_names = schema_feature_names(feature_df)
+        X, y = preprocess_data(feature_df[feature_names], labels)
 
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
@@ -66,8 +86,11 @@ class ContinuousLearning:
 
         if new_model_score['accuracy'] > current_model_score['accuracy']:
             self.current_model = new_model
-            self.model_version += 1
-            joblib.dump(new_model, f'best_model_v{self.model_version}.joblib')
+            self.model_version = latest_model_version() + 1
+            new_model.feature_names_ = feature_names
+            joblib.dump(new_model, MODEL_FILE.format(version=self.model_version))
+            save_schema(new_model.feature_names_, self.model_version)
+            load_schema_adapter(new_model, self.model_version)
             print(f"Model updated to version {self.model_version}")
         else:
             print("Current model performs better. No update needed.")
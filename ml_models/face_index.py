@@ -0,0 +1,281 @@
+from typing import Dict, List, Optional
+import argparse
+import os
+import shutil
+import threading
+import numpy as np
+from .feature_vector import FeatureVector, FACE_ENCODING_SIZE, ANALYSES_WITH_IMAGES
+from .feature_registry import feature_registry
+from .profile_key import get_profile_key, owner_id
+from .segment_store import ArraySegment, SegmentStore
+
+FACE_INDEX_PATH = os.getenv('FACE_INDEX_PATH', 'face_index')
+FACE_MATCH_TOLERANCE = float(os.getenv('FACE_MATCH_TOLERANCE', 0.6))  # face_recognition's default
+FACE_INDEX_NPROBE = int(os.getenv('FACE_INDEX_NPROBE', 8))
+FACE_INDEX_MAX_SEGMENTS = int(os.getenv('FACE_INDEX_MAX_SEGMENTS', 32))
+# The coarse quantizer is trained once this many faces are indexed; smaller indexes are scanned exhaustively
+FACE_INDEX_MIN_TRAIN = int(os.getenv('FACE_INDEX_MIN_TRAIN', 4096))
+# ...and retrained, with every segment re-bucketed, each time the index grows by this factor
+FACE_INDEX_RETRAIN_GROWTH = float(os.getenv('FACE_INDEX_RETRAIN_GROWTH', 4))
+
+ENCODING_SIZE = FACE_ENCODING_SIZE
+# Reported as min_face_distance when no indexed face from another profile was close enough to be probed
+FACE_NO_MATCH_DISTANCE = 1.0
+# Pending inserts are scanned exhaustively and sealed into an immutable segment in chunks
+PENDING_MERGE_SIZE = 4096
+KMEANS_ITERATIONS = 20
+KMEANS_MAX_SAMPLES = 100000
+
+feature_registry.register('face_reuse', ['face_reuse_count', 'min_face_distance'],
+                          requires=['image.faces'], feeds_index=True)
+
+def squared_distances(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # (n, d), (k, d) -> (n, k) squared L2 distances without an (n, k, d) intermediate
+    return ((vectors ** 2).sum(axis=1)[:, np.newaxis] - 2 * vectors @ centroids.T
+            + (centroids ** 2).sum(axis=1)[np.newaxis, :])
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+    return np.concatenate([
+        squared_distances(vectors[i:i + batch_size], centroids).argmin(axis=1)
+        for i in range(0, len(vectors), batch_size)
+    ]).astype(np.int32) if len(vectors) else np.zeros(0, dtype=np.int32)
+
+def train_centroids(vectors: np.ndarray, num_lists: int, seed: int = 0) -> np.ndarray:
+    # Plain Lloyd's k-means on a sample of the indexed faces
+    rng = np.random.RandomState(seed)
+    if len(vectors) > KMEANS_MAX_SAMPLES:
+        vectors = vectors[rng.choice(len(vectors), KMEANS_MAX_SAMPLES, replace=False)]
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), num_lists, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        labels = assign(vectors, centroids)
+        counts = np.bincount(labels, minlength=num_lists)
+        # Per-list sums via one sort + reduceat instead of an unbuffered np.add.at
+        order = np.argsort(labels, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[nonempty] = np.add.reduceat(vectors[order], starts[nonempty], axis=0)
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, np.newaxis]
+        # Re-seed empty lists from random faces
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    return centroids
+
+def default_num_lists(count: int) -> int:
+    return int(np.clip(4 * np.sqrt(count), 1, 65536))
+
+class _Segment(ArraySegment):
+    # Immutable block of encodings. With a coarse quantizer, ids are grouped by inverted
+    # list (order/offsets) so a query only scans the lists of its nprobe nearest centroids.
+    ARRAYS = ('vectors', 'owners', 'order', 'offsets')
+
+    def __init__(self, vectors, owners, order=None, offsets=None):
+        self.vectors = vectors
+        self.owners = owners
+        self.order = order
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, owners: np.ndarray, centroids: Optional[np.ndarray],
+              labels: Optional[np.ndarray] = None) -> '_Segment':
+        if centroids is None:
+            return cls(vectors, owners)
+        if labels is None:
+            labels = assign(vectors, centroids)
+        order = np.argsort(labels, kind='stable').astype(np.int32)
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=len(centroids)))
+        return cls(vectors, owners, order, offsets)
+
+    def labels(self) -> Optional[np.ndarray]:
+        # Inverted list of each encoding, recovered from order/offsets
+        if self.order is None:
+            return None
+        labels = np.empty(len(self.owners), dtype=np.int32)
+        labels[self.order] = np.repeat(np.arange(len(self.offsets) - 1, dtype=np.int32), np.diff(self.offsets))
+        return labels
+
+    def candidates(self, lists: Optional[np.ndarray]) -> np.ndarray:
+        if self.order is None or lists is None:
+            return np.arange(len(self.owners))
+        starts = self.offsets[lists]
+        lengths = self.offsets[lists + 1] - starts
+        total = int(lengths.sum())
+        if not total:
+            return np.zeros(0, dtype=np.int32)
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        return self.order[positions]
+
+def merge_segments(segments: List[_Segment], centroids: Optional[np.ndarray]) -> _Segment:
+    # Segments built with the current quantizer keep their lists, so merging needs no re-assignment
+    vectors = np.concatenate([np.asarray(s.vectors) for s in segments])
+    owners = np.concatenate([np.asarray(s.owners) for s in segments])
+    if centroids is None:
+        return _Segment(vectors, owners)
+    labels = np.concatenate([
+        s.labels() if s.order is not None else assign(np.asarray(s.vectors), centroids) for s in segments
+    ])
+    return _Segment.build(vectors, owners, centroids, labels)
+
+class FaceIndex:
+    # Approximate nearest-neighbour index over 128-d face encodings: an IVF coarse quantizer
+    # (numpy k-means) over immutable, memory-mapped float32 segments plus a pending buffer.
+    def __init__(self, path: str = FACE_INDEX_PATH, tolerance: float = FACE_MATCH_TOLERANCE,
+                 nprobe: int = FACE_INDEX_NPROBE, max_segments: int = FACE_INDEX_MAX_SEGMENTS,
+                 min_train: int = FACE_INDEX_MIN_TRAIN):
+        self.path = path
+        self.tolerance = tolerance
+        self.nprobe = nprobe
+        self.min_train = min_train
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_size = 0  # faces indexed when the quantizer was last trained
+        self.store = SegmentStore(_Segment, max_segments)
+        self.pending_vectors = np.zeros((PENDING_MERGE_SIZE, ENCODING_SIZE), dtype=np.float32)
+        self.pending_owners = np.zeros(PENDING_MERGE_SIZE, dtype=np.uint64)
+        self.pending_count = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.store) + self.pending_count
+
+    def _matches(self, encoding: np.ndarray, owner: int):
+        # (owners, distances) of probed faces from other profiles
+        with self._lock:
+            lists = None
+            if self.centroids is not None:
+                probe = min(self.nprobe, len(self.centroids))
+                lists = np.argpartition(squared_distances(encoding[np.newaxis], self.centroids)[0], probe - 1)[:probe]
+            sources = [(segment, segment.candidates(lists)) for segment in self.store.values()]
+            n = self.pending_count
+            sources.append((None, (self.pending_vectors[:n].copy(), self.pending_owners[:n].copy())))
+
+        owners, distances = [], []
+        for segment, ids in sources:
+            if segment is None:
+                vectors, segment_owners = ids
+            else:
+                vectors, segment_owners = segment.vectors[ids], segment.owners[ids]
+            if len(segment_owners):
+                owners.append(np.asarray(segment_owners))
+                distances.append(np.linalg.norm(vectors - encoding, axis=1))
+        if not owners:
+            return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.float32)
+        owners = np.concatenate(owners)
+        distances = np.concatenate(distances)
+        mask = owners != np.uint64(owner)
+        return owners[mask], distances[mask]
+
+    def query_profile(self, profile_key: Optional[str], encodings: List[Optional[np.ndarray]]) -> Dict[str, float]:
+        owner = owner_id(profile_key)
+        matched_by = set()
+        min_distance = FACE_NO_MATCH_DISTANCE
+        for encoding in encodings:
+            if encoding is None or not len(encoding):
+                continue
+            owners, distances = self._matches(np.asarray(encoding, dtype=np.float32), owner)
+            matched_by.update(owners[distances <= self.tolerance].tolist())
+            if len(distances):
+                min_distance = min(min_distance, float(distances.min()))
+        return {
+            'face_reuse_count': len(matched_by),
+            'min_face_distance': min_distance,
+        }
+
+    def add_profile(self, profile_key: Optional[str], encodings: List[Optional[np.ndarray]]) -> None:
+        if not profile_key:
+            return
+        owner = owner_id(profile_key)
+        with self._lock:
+            for encoding in encodings:
+                if encoding is None or not len(encoding):
+                    continue
+                self.pending_vectors[self.pending_count] = encoding
+                self.pending_owners[self.pending_count] = owner
+                self.pending_count += 1
+                if self.pending_count == PENDING_MERGE_SIZE:
+                    self._seal()
+
+    def _seal(self) -> None:
+        n = self.pending_count
+        if not n:
+            return
+        self.store.add(_Segment.build(self.pending_vectors[:n].copy(), self.pending_owners[:n].copy(), self.centroids),
+                       lambda segments: merge_segments(segments, self.centroids))
+        self.pending_count = 0
+        if len(self) >= self.min_train and (self.centroids is None or
+                                            len(self) >= FACE_INDEX_RETRAIN_GROWTH * self.trained_size):
+            self._retrain()
+
+    def _retrain(self) -> None:
+        # Trains the coarse quantizer on everything indexed so far and re-buckets every
+        # segment into one; geometric growth keeps the amortized cost per face constant
+        segments = self.store.values()
+        vectors = np.concatenate([np.asarray(s.vectors) for s in segments])
+        owners = np.concatenate([np.asarray(s.owners) for s in segments])
+        self.centroids = train_centroids(vectors, default_num_lists(len(vectors)))
+        self.trained_size = len(vectors)
+        self.store.replace_all(_Segment.build(vectors, owners, self.centroids))
+
+    def save(self, path: str = None) -> None:
+        with self._lock:
+            self._seal()
+            self.store.save(path or self.path, {'centroids': self.centroids}, {'trained_size': self.trained_size})
+
+    @classmethod
+    def load(cls, path: str = FACE_INDEX_PATH, **kwargs) -> 'FaceIndex':
+        index = cls(path, **kwargs)
+        arrays, meta = index.store.load(path)
+        index.centroids = arrays.get('centroids')
+        if index.centroids is not None:
+            index.trained_size = meta.get('trained_size', len(index.store))
+        return index
+
+    @classmethod
+    def rebuild(cls, analyses, path: str = FACE_INDEX_PATH, num_lists: int = None, **kwargs) -> 'FaceIndex':
+        # Builds a single segment and a freshly trained quantizer from stored analyses
+        # ({'profile_key', 'profile_url', 'features': <FeatureVector document>}), keyed like the live path
+        vectors, owners = [], []
+        for analysis in analyses:
+            features = FeatureVector.from_document(analysis.get('features'))
+            profile_key = get_profile_key(analysis)
+            if not profile_key:
+                continue
+            owner = owner_id(profile_key)
+            for i in range(int(features.get('total_images', 0) or 0)):
+                encoding = features.get(f'face_encoding_{i}')
+                if encoding is not None and len(encoding):
+                    vectors.append(encoding)
+                    owners.append(owner)
+
+        index = cls(path, **kwargs)
+        if vectors:
+            vectors = np.array(vectors, dtype=np.float32)
+            if len(vectors) >= index.min_train:
+                index.centroids = train_centroids(vectors, num_lists or default_num_lists(len(vectors)))
+                index.trained_size = len(vectors)
+            index.store.replace_all(_Segment.build(vectors, np.array(owners, dtype=np.uint64), index.centroids))
+        shutil.rmtree(path, ignore_errors=True)
+        index.save(path)
+        return index
+
+face_index = FaceIndex.load()
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Rebuild the face-encoding index from stored analyses')
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--path', default=FACE_INDEX_PATH)
+    parser.add_argument('--num-lists', type=int, default=None)
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv('MONGODB_URI'))
+    analyses = client['fake_profile_detector']['analyses'].find(
+        ANALYSES_WITH_IMAGES, {'profile_key': 1, 'profile_url': 1, 'features': 1}
+    )
+    index = FaceIndex.rebuild(analyses, args.path, args.num_lists)
+    print(f"Indexed {len(index)} face encodings into {args.path}")
@@ -1,34 +1,128 @@
 from typing import Dict, List, Any, Union
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from .text_feature_extraction import extract_profile_features
+from .text_feature_extraction import text_feature_extractor
 from .image_feature_extraction import analyze_multiple_images
-from .network_feature_extraction import extract_network_features
+from .network_feature_extraction import profile_network_features
+from .graph_store import graph_store
 from .temporal_feature_extraction import extract_temporal_features
+from .near_duplicate_index import near_duplicate_index
+from .image_hash_index import image_hash_index
+from .face_index import face_index
+from .feature_vector import FeatureVector
+from .feature_registry import FeaturePlan, feature_registry
+from .profile_key import get_profile_key
+from .stage_executor import Stage, stage_executor
 
-def extract_features(user_data: Dict[str, Any]) -> Dict[str, Any]:
-    features: Dict[str, Any] = {}
+# Reported by extract_features itself rather than by an extractor
+feature_registry.register('stages', ['stage_timed_out'])
+
+def feature_plan_for(model: Any) -> FeaturePlan:
+    # Extraction steps the model's feature_names_ need, derived once per loaded model
+    plan = getattr(model, 'feature_plan_', None)
+    if plan is None:
+        plan = model.feature_plan_ = feature_registry.plan(getattr(model, 'feature_names_', None))
+    return plan
+
+def _text_stage(user_data: Dict[str, Any], plan: FeaturePlan) -> FeatureVector:
+    return text_feature_extractor.extract_many([user_data], plan.steps_for('text'))[0]
+
+def _near_duplicate_stage(profile_key: str, user_data: Dict[str, Any], update_indexes: bool) -> Dict[str, float]:
+    # Near-duplicate bios and posts across profiles, then index this profile's text
+    bio = user_data.get('bio', '') or ''
+    posts = user_data.get('posts', []) or []
+    features = near_duplicate_index.query_profile(profile_key, bio, posts)
+    if update_indexes:
+        near_duplicate_index.add_profile(profile_key, bio, posts)
+    return features
+
+def _image_stage(profile_key: str, pictures: List[Any], plan: FeaturePlan, update_indexes: bool) -> FeatureVector:
+    image_features = analyze_multiple_images(pictures, plan.steps_for('image'))
+    image_count = int(image_features['total_images'])
+    
+    # Reused/stolen pictures across profiles, then index this profile's pictures
+    if 'image_reuse' in plan:
+        phashes = [image_features[f'phash_{i}'] for i in range(image_count)]
+        dhashes = [image_features[f'dhash_{i}'] for i in range(image_count)]
+        image_features.update(image_hash_index.query_profile(profile_key, phashes, dhashes))
+        if update_indexes:
+            image_hash_index.add_profile(profile_key, phashes, dhashes)
+    
+    # Same face seen on other profiles, then index this profile's faces
+    if 'face_reuse' in plan:
+        encodings = [image_features.get(f'face_encoding_{i}') for i in range(image_count)]
+        image_features.update(face_index.query_profile(profile_key, encodings))
+        if update_indexes:
+            face_index.add_profile(profile_key, encodings)
+    return image_features
+
+def extract_features(user_data: Dict[str, Any], profile_features: FeatureVector = None,
+                     plan: FeaturePlan = None, update_indexes: bool = True) -> FeatureVector:
+    # Only steps in `plan` run (everything by default); skipped features get the model's defaults.
+    # With update_indexes=False (offline training) the cross-profile indexes are only queried;
+    # otherwise the steps feeding them run whatever the plan, so every profile is indexed.
+    # The stages are independent and run concurrently, each against its own deadline; a stage
+    # that misses it, or is shed, contributes no features and counts towards `stage_timed_out`;
+    # which stages those were and how long each took are in `diagnostics`.
+    plan = plan or feature_registry.full_plan()
+    if update_indexes:
+        plan = feature_registry.with_index_steps(plan)
+    profile_key = get_profile_key(user_data)
+    stages = []
     
     # Extract profile features
-    profile_features = extract_profile_features(user_data)
-    features.update(profile_features)
+    if profile_features is None:
+        stages.append(Stage('text', _text_stage, (user_data, plan)))
+    if 'near_duplicate' in plan:
+        stages.append(Stage('near_duplicate', _near_duplicate_stage, (profile_key, user_data, update_indexes)))
     
     # Extract image features if profile pictures are available
     if 'profile_pictures' in user_data and user_data['profile_pictures']:
-        image_features = analyze_multiple_images(user_data['profile_pictures'])
-        features.update(image_features)
-    
-    # Add network features
-    network_features = extract_network_features(
-        user_data['id'],
-        user_data['followers_count'],
-        user_data['following_count'],
-        user_data['connections']
-    )
-    features.update(network_features)
+        stages.append(Stage('images', _image_stage, (profile_key, user_data['profile_pictures'], plan, update_indexes)))
+    
+    # The profile's edges join the global graph whatever the plan (appending them is cheap);
+    # cutting its neighbourhood and the centralities on it happen in the stage's worker process
+    connections = [str(connection) for connection in user_data.get('connections') or []]
+    if update_indexes and profile_key and connections:
+        graph_store.add_edges(profile_key, connections)
+    if 'network' in plan:
+        stages.append(Stage('network', profile_network_features, (
+            profile_key,
+            connections,
+            user_data.get('followers_count', 0),
+            user_data.get('following_count', 0)
+        ), kind='process'))
     
     # Add temporal features
-    temporal_features = extract_temporal_features(user_data['user'])
-    features.update(temporal_features)
+    if 'temporal' in plan:
+        stages.append(Stage('temporal', extract_temporal_features, (user_data['user'],)))
+    
+    run = stage_executor.run(stages)
+    
+    features = FeatureVector()
+    if profile_features is not None:
+        features.update(profile_features)
+    for stage in stages:
+        features.update(run.results[stage.name] or {})
+    features['stage_timed_out'] = len(run.timed_out)
+    features.diagnostics = {'timed_out_stages': run.timed_out, 'shed_stages': run.shed,
+                            'stage_timings_ms': run.timings_ms}
     
     return features
+
+# Only the steps that feed the graph and the cross-profile indexes
+INDEX_PLAN = feature_registry.with_index_steps(FeaturePlan(()))
+
+def index_profiles(user_datas: List[Dict[str, Any]]) -> None:
+    # Feeds the graph and every cross-profile index with profiles that skip extract_features,
+    # e.g. the ones the cascade settles on cheap features: the same index-feeding steps run,
+    # nothing else does, and the features they produce are discarded
+    for user_data in user_datas:
+        extract_features(user_data, FeatureVector(), INDEX_PLAN)
+
+def extract_features_many(user_datas: List[Dict[str, Any]], plan: FeaturePlan = None,
+                          update_indexes: bool = True) -> List[FeatureVector]:
+    # Text features for the whole batch come from one batched pass
+    plan = plan or feature_registry.full_plan()
+    profile_features = text_feature_extractor.extract_many(user_datas, plan.steps_for('text'))
+    return [extract_features(user_data, features, plan, update_indexes)
+            for user_data, features in zip(user_datas, profile_features)]
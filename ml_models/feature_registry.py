@@ -0,0 +1,85 @@
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Set
+import fnmatch
+import re
+
+class FeatureProducer:
+    # One skippable extraction step, e.g. 'text.tfidf' or 'image.embedding'. `produces` are
+    # feature names or globs ('tfidf_*'); `requires` are steps whose output it consumes.
+    def __init__(self, step: str, produces: Sequence[str], requires: Sequence[str] = ()):
+        self.step = step
+        self.produces = list(produces)
+        self.requires = list(requires)
+        self.pattern = re.compile('|'.join(fnmatch.translate(name) for name in self.produces))
+
+    def produces_feature(self, name: str) -> bool:
+        return self.pattern.match(name) is not None
+
+class FeaturePlan:
+    # The set of steps a model needs. Extractors ask `plan.steps_for('text')` for their
+    # sub-steps, which plugs into the existing `steps` arguments.
+    def __init__(self, steps: Iterable[str], unmatched: Sequence[str] = ()):
+        self.steps: FrozenSet[str] = frozenset(steps)
+        self.unmatched = list(unmatched)
+
+    def __contains__(self, step: str) -> bool:
+        return step in self.steps
+
+    def steps_for(self, group: str) -> FrozenSet[str]:
+        prefix = f'{group}.'
+        return frozenset(step[len(prefix):] for step in self.steps if step.startswith(prefix))
+
+    def __repr__(self) -> str:
+        return f"FeaturePlan({sorted(self.steps)})"
+
+class FeatureRegistry:
+    def __init__(self):
+        self.producers: Dict[str, FeatureProducer] = {}
+        # Steps that feed a cross-profile index as well as producing features
+        self.index_steps: Set[str] = set()
+
+    def register(self, step: str, produces: Sequence[str], requires: Sequence[str] = (),
+                 feeds_index: bool = False) -> FeatureProducer:
+        producer = self.producers[step] = FeatureProducer(step, produces, requires)
+        if feeds_index:
+            self.index_steps.add(step)
+        return producer
+
+    def producers_of(self, name: str) -> List[str]:
+        return [step for step, producer in self.producers.items() if producer.produces_feature(name)]
+
+    def _with_requirements(self, steps: Iterable[str]) -> FrozenSet[str]:
+        needed = set()
+        pending = list(steps)
+        while pending:
+            step = pending.pop()
+            if step not in needed:
+                needed.add(step)
+                pending.extend(self.producers[step].requires if step in self.producers else ())
+        return frozenset(needed)
+
+    def plan(self, feature_names: Optional[Iterable[str]]) -> FeaturePlan:
+        # Steps producing any of `feature_names` plus their requirements; no names means
+        # everything. Names no step produces are listed in `unmatched` and get defaults.
+        if feature_names is None:
+            return self.full_plan()
+        steps, unmatched = set(), []
+        for name in dict.fromkeys(feature_names):
+            producers = self.producers_of(name)
+            if producers:
+                steps.update(producers)
+            else:
+                unmatched.append(name)
+        return FeaturePlan(self._with_requirements(steps), unmatched)
+
+    def with_index_steps(self, plan: FeaturePlan) -> FeaturePlan:
+        # `plan` plus the index-feeding steps and what they require. Profiles analysed for a
+        # pruned model still reach the indexes and store the hashes and encodings the rebuild
+        # CLIs read, so switching back to a model that uses them needs no re-crawl.
+        if self.index_steps <= plan.steps:
+            return plan
+        return FeaturePlan(plan.steps | self._with_requirements(self.index_steps), plan.unmatched)
+
+    def full_plan(self) -> FeaturePlan:
+        return FeaturePlan(self.producers)
+
+feature_registry = FeatureRegistry()
@@ -0,0 +1,212 @@
+from collections.abc import Mapping, MutableMapping
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import hashlib
+import numpy as np
+from .image_inference_backend import EMBEDDING_SIZE
+
+# Fixed widths of the feature layout; the extractors and indexes import them from here
+MAX_IMAGES = 10
+TFIDF_MAX_FEATURES = 100
+NUM_TOPICS = 5
+FACE_ENCODING_SIZE = 128
+
+SCALAR_FEATURES = [
+    # Profile
+    'followers_count', 'following_count', 'posts_count', 'account_age_days',
+    # Text
+    'neg', 'neu', 'pos', 'compound',
+    'PERSON', 'ORGANIZATION', 'GPE', 'LOCATION', 'FACILITY', 'GSP',
+    'spelling_errors', 'oov_words', 'grammar_errors',
+    'near_duplicate_post_ratio', 'max_bio_similarity',
+    # Images
+    'total_images', 'avg_face_count', 'avg_manipulation_score', 'avg_ela_score', 'avg_profile_pic_score',
+    'image_reuse_count', 'min_hamming_distance', 'face_reuse_count', 'min_face_distance',
+    # Network
+    'follower_following_ratio', 'degree_centrality', 'betweenness_centrality', 'closeness_centrality',
+    'clustering_coefficient',
+    # Temporal
+    'account_age', 'posting_frequency', 'activity_variance', 'night_day_ratio',
+]
+PER_IMAGE_FEATURES = ['image_analysis_failed', 'face_count', 'has_exif', 'manipulation_score', 'ela_score',
+                      'profile_pic_score']
+# Features added after the layout was first deployed. They go after every block so documents
+# written with an earlier layout (a prefix of this one) still decode.
+APPENDED_FEATURES = [
+    'stage_timed_out',
+]
+
+# Mongo filter for analyses with at least one image, stored compactly or as an older plain dict
+ANALYSES_WITH_IMAGES = {'$or': [{'features.metadata.phash_0': {'$exists': True}}, {'features.total_images': {'$gt': 0}}]}
+
+def is_numeric(value: Any) -> bool:
+    return isinstance(value, (bool, int, float, np.number, np.bool_))
+
+def _plain(value: Any) -> Any:
+    # NumPy scalars and arrays in metadata are converted so the document is BSON/JSON encodable
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return value
+
+class FeatureSchema:
+    # Fixed name -> column layout. Blocks are contiguous column ranges named `<block>_<j>`
+    # (tfidf_0.., deep_feature_0_0..) that can also be read and written whole by block name.
+    def __init__(self, scalars: Sequence[str], blocks: Sequence[Tuple[str, int]], appended: Sequence[str] = ()):
+        names = list(scalars)
+        self.blocks: Dict[str, slice] = {}
+        for block, width in blocks:
+            self.blocks[block] = slice(len(names), len(names) + width)
+            names.extend(f'{block}_{j}' for j in range(width))
+        names.extend(appended)
+        self.names = names
+        self.index = {name: i for i, name in enumerate(names)}
+        self.size = len(names)
+        self._versions: Dict[int, str] = {}
+        self.version = self.version_of(self.size)
+
+    def version_of(self, size: int) -> str:
+        # Version of the layout made of the first `size` columns, hashed once per size
+        version = self._versions.get(size)
+        if version is None:
+            version = self._versions[size] = hashlib.blake2b('\n'.join(self.names[:size]).encode('utf-8'),
+                                                             digest_size=6).hexdigest()
+        return version
+
+    def prefix_size(self, version: str, mask_bytes: int) -> Optional[int]:
+        # Column count of an earlier layout that is a prefix of this one, from its version and
+        # the length of its packed mask
+        for size in range(min(mask_bytes * 8, self.size), max(mask_bytes * 8 - 8, 0), -1):
+            if self.version_of(size) == version:
+                return size
+        return None
+
+    def columns(self, names: Iterable[str]) -> np.ndarray:
+        # Column of each name, -1 for names outside the schema
+        return np.array([self.index.get(name, -1) for name in names], dtype=np.int64)
+
+def default_schema() -> FeatureSchema:
+    scalars = SCALAR_FEATURES + [f'{name}_{i}' for i in range(MAX_IMAGES) for name in PER_IMAGE_FEATURES]
+    blocks = [('topic', NUM_TOPICS), ('tfidf', TFIDF_MAX_FEATURES)]
+    blocks += [(f'deep_feature_{i}', EMBEDDING_SIZE) for i in range(MAX_IMAGES)]
+    blocks += [(f'face_encoding_{i}', FACE_ENCODING_SIZE) for i in range(MAX_IMAGES)]
+    return FeatureSchema(scalars, blocks, APPENDED_FEATURES)
+
+FEATURE_SCHEMA = default_schema()
+
+class FeatureVector(MutableMapping):
+    # Features of one profile in a float32 array laid out by FEATURE_SCHEMA plus a mask of
+    # the columns that were set. It reads like the old per-key dict; values that are not
+    # numeric or have no column (camera make, hashes, unknown NER labels) live in `metadata`.
+    def __init__(self, schema: FeatureSchema = FEATURE_SCHEMA):
+        self.schema = schema
+        self.values = np.zeros(schema.size, dtype=np.float32)
+        self.present = np.zeros(schema.size, dtype=bool)
+        self.metadata: Dict[str, Any] = {}
+        # How the features were extracted (e.g. stage timings); never stored or fed to a model
+        self.diagnostics: Dict[str, Any] = {}
+
+    def __getitem__(self, key: str) -> Any:
+        column = self.schema.index.get(key)
+        if column is not None and self.present[column]:
+            return float(self.values[column])
+        block = self.schema.blocks.get(key)
+        if block is not None and self.present[block].all():
+            return self.values[block]
+        return self.metadata[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        column = self.schema.index.get(key)
+        if column is not None and is_numeric(value):
+            self.values[column] = value
+            self.present[column] = True
+            self.metadata.pop(key, None)
+        elif key in self.schema.blocks and not isinstance(value, (str, bytes, Mapping)):
+            self.set_block(key, value)
+        else:
+            self.metadata[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        column = self.schema.index.get(key)
+        if column is not None and self.present[column]:
+            self.present[column] = False
+        elif key in self.schema.blocks and self.present[self.schema.blocks[key]].all():
+            self.present[self.schema.blocks[key]] = False
+        else:
+            del self.metadata[key]
+
+    def __iter__(self):
+        for column in np.flatnonzero(self.present):
+            yield self.schema.names[column]
+        yield from self.metadata
+
+    def __len__(self) -> int:
+        return int(self.present.sum()) + len(self.metadata)
+
+    def set_block(self, block: str, values: Any) -> None:
+        # An empty value (e.g. no face found) leaves the block unset
+        values = np.asarray(values, dtype=np.float32).ravel()
+        if not len(values):
+            return
+        columns = self.schema.blocks[block]
+        if len(values) != columns.stop - columns.start:
+            raise ValueError(f"Block {block} has {columns.stop - columns.start} columns, got {len(values)} values")
+        self.values[columns] = values
+        self.present[columns] = True
+
+    def get_block(self, block: str, default: Any = None) -> Optional[np.ndarray]:
+        columns = self.schema.blocks[block]
+        return self.values[columns] if self.present[columns].all() else default
+
+    def update(self, other=(), **kwargs) -> None:
+        if isinstance(other, FeatureVector) and other.schema is self.schema:
+            self.values[other.present] = other.values[other.present]
+            self.present |= other.present
+            self.metadata.update(other.metadata)
+        else:
+            super().update(other)
+        if kwargs:
+            super().update(kwargs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        columns = np.flatnonzero(self.present)
+        features = dict(zip([self.schema.names[c] for c in columns], self.values[columns].tolist()))
+        features.update({key: _plain(value) for key, value in self.metadata.items()})
+        return features
+
+    def to_document(self) -> Dict[str, Any]:
+        # Compact storage form: a bitmask of set columns, their float32 values and the metadata
+        return {
+            'schema_version': self.schema.version,
+            'present': np.packbits(self.present).tobytes(),
+            'values': self.values[self.present].tobytes(),
+            'metadata': {key: _plain(value) for key, value in self.metadata.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, features: Mapping, schema: FeatureSchema = FEATURE_SCHEMA) -> 'FeatureVector':
+        vector = cls(schema)
+        for key, value in features.items():
+            vector[key] = value
+        return vector
+
+    @classmethod
+    def from_document(cls, document: Optional[Mapping], schema: FeatureSchema = FEATURE_SCHEMA) -> 'FeatureVector':
+        # Also accepts analyses stored before the compact form, which hold the plain feature dict
+        if not document:
+            return cls(schema)
+        if 'present' not in document or 'schema_version' not in document:
+            return cls.from_dict(document, schema)
+        mask = np.frombuffer(document['present'], dtype=np.uint8)
+        size = schema.size if document['schema_version'] == schema.version else \
+            schema.prefix_size(document['schema_version'], len(mask))
+        if size is None:
+            raise ValueError(f"Feature document has schema {document['schema_version']}, expected {schema.version}")
+        vector = cls(schema)
+        vector.present[:size] = np.unpackbits(mask, count=size).astype(bool)
+        vector.values[vector.present] = np.frombuffer(document['values'], dtype=np.float32)
+        vector.metadata = dict(document.get('metadata') or {})
+        return vector
+
+def feature_dicts(vectors: Iterable[Mapping]) -> List[Dict[str, Any]]:
+    return [v.to_dict() if isinstance(v, FeatureVector) else dict(v) for v in vectors]
@@ -1,33 +1,177 @@
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import os
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import dgl
 from dgl.nn import GraphConv
+from .graph_store import GraphStore, graph_store
+from .profile_key import get_profile_key
+from .schema_adapter import SchemaAdapter
+
+# Neighbours sampled per node for each GraphConv layer, first layer first
+GNN_FANOUTS = [int(fanout) for fanout in os.getenv('GNN_FANOUTS', '10,10').split(',')]
+GNN_BATCH_SIZE = int(os.getenv('GNN_BATCH_SIZE', 1024))
+GNN_MODEL_PATH = os.getenv('GNN_MODEL_PATH', 'gnn_model.pt')
+# Node features of the training graph, row i for graph store node id i
+GNN_NODE_FEATURES_PATH = os.getenv('GNN_NODE_FEATURES_PATH', 'gnn_node_features.npy')
 
 class GNNModel(nn.Module):
     def __init__(self, in_feats, hidden_size, num_classes):
         super(GNNModel, self).__init__()
+        self.in_feats = in_feats
+        self.hidden_size = hidden_size
+        self.num_classes = num_classes
         self.conv1 = GraphConv(in_feats, hidden_size)
         self.conv2 = GraphConv(hidden_size, num_classes)
 
     def forward(self, g, features):
-        x = F.relu(self.conv1(g, features))
-        x = self.conv2(g, x)
+        # `g` is a whole graph or one sampled block per layer, outermost first
+        blocks = g if isinstance(g, (list, tuple)) else [g, g]
+        x = F.relu(self.conv1(blocks[0], features))
+        x = self.conv2(blocks[1], x)
         return x
 
-def train_gnn_model(graph, features, labels, epochs=100, lr=0.01):
+def store_graph(store: GraphStore = graph_store) -> dgl.DGLGraph:
+    # The graph store's CSR as a DGL graph whose node ids are the store's node ids
+    store.compact()
+    src = torch.from_numpy(np.repeat(np.arange(store.num_nodes, dtype=np.int64), np.diff(store.indptr)))
+    dst = torch.from_numpy(np.asarray(store.indices, dtype=np.int64))
+    return dgl.graph((src, dst), num_nodes=store.num_nodes)
+
+def train_gnn_model(graph, features, labels, epochs=100, lr=0.01, fanouts: Sequence[int] = GNN_FANOUTS,
+                    batch_size: int = GNN_BATCH_SIZE, train_nids=None):
+    # Mini-batch training: each step runs the layers on blocks sampled around `batch_size`
+    # labelled nodes, so memory depends on the fanouts rather than on the size of the graph
     model = GNNModel(features.shape[1], 16, 2)
+    if len(fanouts) != 2:
+        raise ValueError(f"GNNModel has 2 layers, got {len(fanouts)} fanouts")
     optimizer = torch.optim.Adam(model.parameters(), lr=lr)
-    
+
+    # Self-loops keep a node's own features in its aggregation and give every sampled
+    # destination at least one in-edge
+    graph = dgl.add_self_loop(dgl.remove_self_loop(graph))
+    if train_nids is None:
+        train_nids = torch.arange(graph.num_nodes())
+    sampler = dgl.dataloading.NeighborSampler(list(fanouts))
+    loader = dgl.dataloading.DataLoader(graph, train_nids, sampler, batch_size=batch_size, shuffle=True,
+                                        drop_last=False)
+
     for epoch in range(epochs):
         model.train()
-        logits = model(graph, features)
-        loss = F.cross_entropy(logits, labels)
-        optimizer.zero_grad()
-        loss.backward()
-        optimizer.step()
-        
+        total_loss, batches = 0.0, 0
+        for input_nodes, output_nodes, blocks in loader:
+            logits = model(blocks, features[input_nodes])
+            loss = F.cross_entropy(logits, labels[output_nodes])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item()
+            batches += 1
+
         if epoch % 10 == 0:
-            print(f'Epoch {epoch}: Loss {loss.item():.4f}')
-    
+            print(f'Epoch {epoch}: Loss {total_loss / max(batches, 1):.4f}')
+
     return model
+
+def save_gnn_model(model: GNNModel, node_features: np.ndarray, feature_names: Sequence[str],
+                   path: str = GNN_MODEL_PATH, features_path: str = GNN_NODE_FEATURES_PATH) -> None:
+    # `feature_names` name the columns of `node_features`; a new profile's input row is built
+    # from its FeatureVector with the same names
+    if len(feature_names) != model.in_feats:
+        raise ValueError(f"GNNModel has {model.in_feats} input features, got {len(feature_names)} names")
+    torch.save({
+        'state_dict': model.state_dict(),
+        'in_feats': model.in_feats,
+        'hidden_size': model.hidden_size,
+        'num_classes': model.num_classes,
+        'feature_names': list(feature_names),
+    }, path)
+    np.save(features_path, np.asarray(node_features, dtype=np.float32))
+
+def load_gnn_model(path: str = GNN_MODEL_PATH,
+                   features_path: str = GNN_NODE_FEATURES_PATH) -> Tuple[GNNModel, np.ndarray]:
+    checkpoint = torch.load(path, map_location='cpu')
+    model = GNNModel(checkpoint['in_feats'], checkpoint['hidden_size'], checkpoint['num_classes'])
+    model.load_state_dict(checkpoint['state_dict'])
+    model.feature_names_ = checkpoint['feature_names']
+    model.eval()
+    return model, np.load(features_path, mmap_mode='r')
+
+NEW_NODE = -1
+
+def sample_node_blocks(neighbors: np.ndarray, fanouts: Sequence[int] = GNN_FANOUTS,
+                       store: GraphStore = graph_store, seed: Optional[int] = 0) -> Tuple[List[int], List]:
+    # Blocks for one node that is not (or not only) in the graph: `neighbors` are its store
+    # node ids, further hops are sampled from the store the same way training samples them:
+    # like NeighborSampler on the self-looped training graph, each node draws `fanout` in-edges
+    # from its neighbours and itself together. Returns the input nodes (NEW_NODE first, then
+    # store ids) and the blocks, outermost first.
+    rng = np.random.default_rng(seed)
+    src_nodes = [NEW_NODE]
+    blocks = []
+    for fanout in reversed(fanouts):
+        dst_nodes = src_nodes
+        local = {node: i for i, node in enumerate(dst_nodes)}
+        src_nodes = list(dst_nodes)
+        src, dst = [], []
+        for v, node in enumerate(dst_nodes):
+            candidates = np.append(neighbors if node == NEW_NODE else store.neighbors(node), node)
+            if len(candidates) > fanout:
+                candidates = rng.choice(candidates, fanout, replace=False)
+            for u in candidates.tolist():
+                if u not in local:
+                    local[u] = len(src_nodes)
+                    src_nodes.append(u)
+                src.append(local[u])
+                dst.append(v)
+        blocks.insert(0, dgl.create_block((torch.tensor(src), torch.tensor(dst)),
+                                          num_src_nodes=len(src_nodes), num_dst_nodes=len(dst_nodes)))
+    return src_nodes, blocks
+
+def predict_node(model: GNNModel, node_features: np.ndarray, features: np.ndarray, neighbor_keys: Iterable[str],
+                 store: GraphStore = graph_store, fanouts: Sequence[int] = GNN_FANOUTS,
+                 seed: Optional[int] = 0, key: Optional[str] = None) -> float:
+    # Inductive scoring of one profile from its own features and its sampled k-hop
+    # neighbourhood in the graph store; nothing is added to the store. A profile already
+    # stored under `key` keeps its stored edges as well. Returns the probability of class 1 (fake).
+    nodes = [store.node_id(str(neighbor)) for neighbor in neighbor_keys]
+    stored = store.node_id(key) if key is not None else None
+    if stored is not None:
+        nodes += store.neighbors(stored).tolist()
+    neighbors = np.unique(np.array([node for node in nodes if node is not None and node != stored], dtype=np.int64))
+    input_nodes, blocks = sample_node_blocks(neighbors.astype(np.int64), fanouts, store, seed)
+
+    # Nodes added to the store after training have no stored features and read as zeros
+    x = np.zeros((len(input_nodes), model.in_feats), dtype=np.float32)
+    x[0] = features
+    ids = np.array(input_nodes[1:], dtype=np.int64)
+    known = ids < len(node_features)
+    x[1:][known] = node_features[ids[known]]
+
+    model.eval()
+    with torch.no_grad():
+        logits = model(blocks, torch.from_numpy(x))
+    return float(F.softmax(logits, dim=1)[0, 1])
+
+class GNNScorer:
+    # Inductive GNN score of analysed profiles, next to the tabular model's prediction. Stays
+    # disabled (score returns None) until train_gnn_model's output is saved at GNN_MODEL_PATH.
+    def __init__(self, path: str = GNN_MODEL_PATH, features_path: str = GNN_NODE_FEATURES_PATH,
+                 store: GraphStore = graph_store):
+        self.store = store
+        self.model: Optional[GNNModel] = None
+        if os.path.exists(path) and os.path.exists(features_path):
+            self.model, self.node_features = load_gnn_model(path, features_path)
+            self.adapter = SchemaAdapter(self.model.feature_names_)
+
+    def score(self, user_data: Dict[str, Any], features: Any) -> Optional[float]:
+        # Probability that the profile is fake given its features and its sampled neighbourhood
+        if self.model is None:
+            return None
+        neighbor_keys = [str(connection) for connection in user_data.get('connections') or []]
+        return predict_node(self.model, self.node_features, self.adapter.transform_one(features)[0],
+                            neighbor_keys, self.store, key=get_profile_key(user_data))
+
+gnn_scorer = GNNScorer()
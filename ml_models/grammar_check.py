@@ -0,0 +1,138 @@
+from typing import Dict, List, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+import hashlib
+import os
+import threading
+import language_tool_python
+
+GRAMMAR_CHECK_WORKERS = int(os.getenv('GRAMMAR_CHECK_WORKERS', 2))
+GRAMMAR_CHECK_TIMEOUT = float(os.getenv('GRAMMAR_CHECK_TIMEOUT', 2.0))  # seconds per call
+GRAMMAR_CHECK_MAX_CHARS = int(os.getenv('GRAMMAR_CHECK_MAX_CHARS', 2000))  # per text
+GRAMMAR_CHECK_MAX_TOTAL_CHARS = int(os.getenv('GRAMMAR_CHECK_MAX_TOTAL_CHARS', 20000))  # per profile
+GRAMMAR_CHECK_CACHE_SIZE = int(os.getenv('GRAMMAR_CHECK_CACHE_SIZE', 50000))
+
+# Error count reported for a text that was not checked (timeout, pool saturated or over budget)
+GRAMMAR_CHECK_FALLBACK = 0
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class GrammarChecker:
+    def __init__(self, workers: int = GRAMMAR_CHECK_WORKERS, timeout: float = GRAMMAR_CHECK_TIMEOUT,
+                 max_chars: int = GRAMMAR_CHECK_MAX_CHARS, max_total_chars: int = GRAMMAR_CHECK_MAX_TOTAL_CHARS,
+                 cache_size: int = GRAMMAR_CHECK_CACHE_SIZE, fallback: int = GRAMMAR_CHECK_FALLBACK,
+                 language: str = 'en-US'):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_chars = max_chars
+        self.max_total_chars = max_total_chars
+        self.cache_size = cache_size
+        self.fallback = fallback
+        self.language = language
+
+        # One LanguageTool instance per pool thread, so at most `workers` JVM-backed checkers exist
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='grammar-check')
+        self._local = threading.local()
+        self._tools = []
+        self._tools_lock = threading.Lock()
+
+        # Bounds checks that are queued or running; when exhausted, new texts get the fallback
+        self._slots = threading.BoundedSemaphore(workers * 4)
+
+        self._cache: 'OrderedDict[str, int]' = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _get_tool(self):
+        tool = getattr(self._local, 'tool', None)
+        if tool is None:
+            tool = language_tool_python.LanguageTool(self.language)
+            self._local.tool = tool
+            with self._tools_lock:
+                self._tools.append(tool)
+        return tool
+
+    def _check(self, text: str) -> int:
+        return len(self._get_tool().check(text))
+
+    def _cache_get(self, key: str) -> Optional[int]:
+        with self._cache_lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, key: str, value: int) -> None:
+        with self._cache_lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _on_done(self, key: str, future) -> None:
+        self._slots.release()
+        # Checks that finish after their caller timed out still populate the cache
+        if not future.cancelled() and future.exception() is None:
+            self._cache_put(key, future.result())
+
+    def warm_up(self) -> None:
+        futures = [self._executor.submit(self._get_tool) for _ in range(self.workers)]
+        wait(futures)
+
+    def count_errors_grouped(self, groups: List[List[str]], fill_fallback: bool = True) -> List[List[Optional[int]]]:
+        # Each group (e.g. the bio and posts of one profile) gets its own character budget;
+        # all groups share one wait so a batch costs at most one timeout. Texts that were not
+        # checked get the fallback value, or None when fill_fallback is False.
+        unchecked = self.fallback if fill_fallback else None
+        results: List[List[Optional[int]]] = [[unchecked] * len(texts) for texts in groups]
+        pending: Dict[str, List[tuple]] = {}
+        futures = {}
+
+        for g, texts in enumerate(groups):
+            budget = self.max_total_chars
+            for i, text in enumerate(texts):
+                if not text or not text.strip():
+                    results[g][i] = 0
+                    continue
+                key = content_hash(text)
+                cached = self._cache_get(key)
+                if cached is not None:
+                    results[g][i] = cached
+                    continue
+                if key in pending:
+                    pending[key].append((g, i))
+                    continue
+
+                text = text[:self.max_chars]
+                if len(text) > budget or not self._slots.acquire(blocking=False):
+                    continue
+                budget -= len(text)
+
+                future = self._executor.submit(self._check, text)
+                future.add_done_callback(lambda f, key=key: self._on_done(key, f))
+                pending[key] = [(g, i)]
+                futures[future] = key
+
+        if futures:
+            done, _ = wait(futures, timeout=self.timeout)
+            for future in done:
+                if future.exception() is None:
+                    for g, i in pending[futures[future]]:
+                        results[g][i] = future.result()
+
+        return results
+
+    def count_errors_many(self, texts: List[str]) -> List[int]:
+        return self.count_errors_grouped([texts])[0]
+
+    def count_errors(self, text: str) -> int:
+        return self.count_errors_many([text])[0]
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._tools_lock:
+            for tool in self._tools:
+                tool.close()
+            self._tools = []
+
+grammar_checker = GrammarChecker()
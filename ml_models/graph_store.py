@@ -0,0 +1,418 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import numpy as np
+from .profile_key import get_profile_key
+
+GRAPH_STORE_PATH = os.getenv('GRAPH_STORE_PATH', 'social_graph')
+NETWORK_EGO_RADIUS = int(os.getenv('NETWORK_EGO_RADIUS', 2))
+# The ego subgraph stops growing once it holds this many nodes
+NETWORK_EGO_MAX_NODES = int(os.getenv('NETWORK_EGO_MAX_NODES', 50000))
+
+EDGE_LOG = 'edges.log'
+CSR_ARRAYS = ('indptr', 'indices', 'node_hashes', 'hash_order')
+
+logger = logging.getLogger(__name__)
+
+def node_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest(), 'little')
+
+def gather(indptr: np.ndarray, indices: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+    # Concatenated CSR rows of `nodes` without a Python loop
+    starts = np.asarray(indptr[nodes], dtype=np.int64)
+    lengths = np.asarray(indptr[nodes + 1], dtype=np.int64) - starts
+    total = int(lengths.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int32)
+    positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+    return np.asarray(indices[positions])
+
+class EgoGraph:
+    # Induced subgraph around one node with local ids; node 0 is the centre. Small and
+    # picklable, so it can be handed to a worker process.
+    def __init__(self, nodes: np.ndarray, indptr: np.ndarray, indices: np.ndarray, radius: int):
+        self.nodes = nodes
+        self.indptr = indptr
+        self.indices = indices
+        self.radius = radius
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.indices) // 2
+
+    def neighbors(self, node: int) -> np.ndarray:
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def to_networkx(self):
+        import networkx as nx
+        G = nx.Graph()
+        G.add_nodes_from(range(self.num_nodes))
+        rows = np.repeat(np.arange(self.num_nodes), np.diff(self.indptr))
+        G.add_edges_from(zip(rows.tolist(), self.indices.tolist()))
+        return G
+
+class GraphStore:
+    # Global undirected follower/connection graph. Node keys (user ids, profile keys) are
+    # hashed to 64 bits and given dense int32 ids. Edges live in an immutable, memory-mapped
+    # CSR (int64 indptr, int32 indices) plus an append log of new edges that is kept as an
+    # in-memory adjacency and merged into a fresh CSR on save (the hourly job), never inline.
+    def __init__(self, path: str = GRAPH_STORE_PATH):
+        self.path = path
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.node_hashes = np.zeros(0, dtype=np.uint64)  # by node id
+        self.hash_order = np.zeros(0, dtype=np.int32)  # node ids sorted by hash
+        self._version = 0
+        self.new_nodes: Dict[int, int] = {}  # hash -> id for nodes added since the last compaction
+        self.new_node_hashes: List[int] = []
+        self.pending: Dict[int, set] = {}  # id -> neighbours added since the last compaction
+        self.pending_edges = 0
+        self._log = None
+        self._log_offset = 0  # bytes of the edge log already inserted
+        self._lock = threading.RLock()
+        self._listeners: List[Callable[[List[str]], None]] = []
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_hashes) + len(self.new_node_hashes)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.indices) // 2 + self.pending_edges
+
+    def _lookup(self, h: int) -> Optional[int]:
+        if len(self.hash_order):
+            position = int(np.searchsorted(self.node_hashes, np.uint64(h), sorter=self.hash_order))
+            if position < len(self.hash_order):
+                node = int(self.hash_order[position])
+                if int(self.node_hashes[node]) == h:
+                    return node
+        return self.new_nodes.get(h)
+
+    def node_id(self, key: str) -> Optional[int]:
+        with self._lock:
+            return self._lookup(node_hash(key))
+
+    def _node_for_hash(self, h: int) -> int:
+        node = self._lookup(h)
+        if node is None:
+            node = self.num_nodes
+            self.new_nodes[h] = node
+            self.new_node_hashes.append(h)
+        return node
+
+    def _insert(self, hashes: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        # Returns the pairs that were actually new edges
+        added = []
+        for hu, hv in hashes:
+            u, v = self._node_for_hash(hu), self._node_for_hash(hv)
+            if u == v or v in self.pending.get(u, ()) or self._in_csr(u, v):
+                continue
+            self.pending.setdefault(u, set()).add(v)
+            self.pending.setdefault(v, set()).add(u)
+            self.pending_edges += 1
+            added.append((hu, hv))
+        return added
+
+    def _in_csr(self, u: int, v: int) -> bool:
+        if u >= len(self.indptr) - 1:
+            return False
+        row = self.indices[self.indptr[u]:self.indptr[u + 1]]
+        position = np.searchsorted(row, v)
+        return position < len(row) and row[position] == v
+
+    def add_listener(self, listener: Callable[[List[str]], None]) -> None:
+        # `listener` is called with the keys of both endpoints of every edge add_edges adds,
+        # e.g. to queue their network features for recomputation
+        self._listeners.append(listener)
+
+    def add_edges(self, key: str, neighbor_keys: Iterable[str]) -> int:
+        # Upserts the node and its (undirected) edges; returns how many edges were new
+        keys = {node_hash(neighbor): str(neighbor) for neighbor in neighbor_keys}
+        h = node_hash(key)
+        keys[h] = str(key)
+        pairs = [(h, neighbor) for neighbor in keys if neighbor != h]
+        with self._lock:
+            added = self._insert(pairs)
+            if added:
+                self._append_log(added)
+        if added and self._listeners:
+            endpoints = list(dict.fromkeys(keys[hv] for pair in added for hv in pair))
+            for listener in self._listeners:
+                try:
+                    listener(endpoints)
+                except Exception:
+                    # The edges are stored either way; a failing listener must not fail the caller
+                    logger.exception("Graph store listener failed")
+        return len(added)
+
+    def _append_log(self, pairs: List[Tuple[int, int]]) -> None:
+        if self._log is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._log = open(os.path.join(self.path, EDGE_LOG), 'ab')
+        data = np.array(pairs, dtype=np.uint64).tobytes()
+        self._log.write(data)
+        self._log.flush()
+        self._log_offset += len(data)
+
+    def neighbors(self, node: int) -> np.ndarray:
+        with self._lock:
+            row = self.indices[self.indptr[node]:self.indptr[node + 1]] if node < len(self.indptr) - 1 else ()
+            extra = self.pending.get(node)
+            if not extra:
+                return np.asarray(row, dtype=np.int32)
+            return np.union1d(np.asarray(row, dtype=np.int32), np.fromiter(extra, dtype=np.int32, count=len(extra)))
+
+    def degree(self, node: int) -> int:
+        return len(self.neighbors(node))
+
+    def _expand(self, nodes: np.ndarray, overlay: Dict[int, set]) -> np.ndarray:
+        # All neighbours of `nodes` (with repeats), from the CSR, the pending adjacency and `overlay`
+        in_csr = nodes[nodes < len(self.indptr) - 1]
+        parts = [gather(self.indptr, self.indices, in_csr)]
+        if self.pending or overlay:
+            for node in nodes.tolist():
+                for extra in (self.pending.get(node), overlay.get(node)):
+                    if extra:
+                        parts.append(np.fromiter(extra, dtype=np.int32, count=len(extra)))
+        return np.concatenate(parts).astype(np.int32, copy=False)
+
+    def ego_subgraph(self, key: Optional[str], radius: int = NETWORK_EGO_RADIUS,
+                     max_nodes: int = NETWORK_EGO_MAX_NODES, extra_neighbors: Iterable[str] = ()) -> Optional[EgoGraph]:
+        # Nodes within `radius` hops of `key` (BFS over whole frontiers) and the edges between them.
+        # `extra_neighbors` are joined to the centre for this cut only and nothing is written, so
+        # a profile analysed read-only gets the neighbourhood its connections give it; a centre
+        # that is not stored becomes a virtual node (id num_nodes) that exists only in the ego.
+        with self._lock:
+            center = self._lookup(node_hash(key)) if key is not None else None
+            extra = {self._lookup(node_hash(neighbor)) for neighbor in extra_neighbors} - {None, center}
+            if center is None:
+                if not extra:
+                    return None
+                center = self.num_nodes
+            overlay: Dict[int, set] = {center: extra} if extra else {}
+            for node in extra:
+                overlay[node] = {center}
+
+            nodes = np.array([center], dtype=np.int32)
+            frontier = nodes
+            for _ in range(radius):
+                reached = np.unique(self._expand(frontier, overlay))
+                frontier = np.setdiff1d(reached, nodes, assume_unique=True)
+                if not len(frontier):
+                    break
+                if len(nodes) + len(frontier) > max_nodes:
+                    frontier = frontier[:max_nodes - len(nodes)]
+                nodes = np.concatenate([nodes, frontier])
+                if len(nodes) >= max_nodes:
+                    break
+
+            # Induced edges: every ego node's neighbours, kept when they are ego nodes too
+            in_csr = np.flatnonzero(nodes < len(self.indptr) - 1)
+            csr_nodes = nodes[in_csr]
+            degrees = np.asarray(self.indptr[csr_nodes + 1] - self.indptr[csr_nodes], dtype=np.int64)
+            rows = [np.repeat(in_csr.astype(np.int32), degrees)]
+            cols = [gather(self.indptr, self.indices, csr_nodes)]
+            if self.pending or overlay:
+                for local, node in enumerate(nodes.tolist()):
+                    for extra in (self.pending.get(node), overlay.get(node)):
+                        if extra:
+                            rows.append(np.full(len(extra), local, dtype=np.int32))
+                            cols.append(np.fromiter(extra, dtype=np.int32, count=len(extra)))
+
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        order = np.argsort(nodes)
+        sorted_nodes = nodes[order]
+        positions = np.minimum(np.searchsorted(sorted_nodes, cols), len(nodes) - 1)
+        inside = sorted_nodes[positions] == cols
+        rows, cols = rows[inside], order[positions[inside]]
+        # Sorted, de-duplicated rows: an extra neighbour may also be stored
+        n = len(nodes)
+        keys = np.unique(rows.astype(np.int64) * n + cols)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(keys // n, minlength=n))
+        return EgoGraph(nodes, indptr, (keys % n).astype(np.int32), radius)
+
+    def compact(self) -> None:
+        # Merges the pending adjacency into a new CSR; node ids are stable across compactions
+        with self._lock:
+            n = self.num_nodes
+            old_degrees = np.diff(self.indptr)
+            src = [np.repeat(np.arange(len(old_degrees), dtype=np.int32), old_degrees)]
+            dst = [np.asarray(self.indices, dtype=np.int32)]
+            for node, neighbors in self.pending.items():
+                src.append(np.full(len(neighbors), node, dtype=np.int32))
+                dst.append(np.fromiter(neighbors, dtype=np.int32, count=len(neighbors)))
+            self._set_csr(*csr_from_edges(np.concatenate(src), np.concatenate(dst), n, symmetric=False),
+                          np.concatenate([np.asarray(self.node_hashes),
+                                          np.array(self.new_node_hashes, dtype=np.uint64)]))
+            self.new_nodes = {}
+            self.new_node_hashes = []
+            self.pending = {}
+            self.pending_edges = 0
+
+    def _set_csr(self, indptr: np.ndarray, indices: np.ndarray, node_hashes: np.ndarray) -> None:
+        self.indptr = indptr
+        self.indices = indices
+        self.node_hashes = node_hashes
+        self.hash_order = np.argsort(node_hashes, kind='stable').astype(np.int32)
+        self._version += 1
+
+    def save(self, path: str = None) -> None:
+        # Writes a compacted CSR as a new version directory, then swaps the manifest and
+        # truncates the edge log it has absorbed. Only one process may save a store (the
+        # background_jobs scheduler): the truncation drops edges other processes logged that
+        # this one has not replayed, so API workers only append to the log and refresh().
+        path = path or self.path
+        with self._lock:
+            self.compact()
+            os.makedirs(path, exist_ok=True)
+            name = f'{self._version:08d}'
+            if not os.path.isdir(os.path.join(path, name)):
+                tmp = os.path.join(path, f'{name}.tmp')
+                os.makedirs(tmp, exist_ok=True)
+                for array in CSR_ARRAYS:
+                    np.save(os.path.join(tmp, f'{array}.npy'), getattr(self, array))
+                os.replace(tmp, os.path.join(path, name))
+            manifest = {'csr': name, 'num_nodes': self.num_nodes, 'num_edges': self.num_edges}
+            with open(os.path.join(path, 'manifest.json.tmp'), 'w') as f:
+                json.dump(manifest, f)
+            os.replace(os.path.join(path, 'manifest.json.tmp'), os.path.join(path, 'manifest.json'))
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            open(os.path.join(path, EDGE_LOG), 'wb').close()
+            if path == self.path:
+                self._log_offset = 0
+            for entry in os.listdir(path):
+                if entry not in ('manifest.json', EDGE_LOG, name):
+                    shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str = GRAPH_STORE_PATH, mmap: bool = True, **kwargs) -> 'GraphStore':
+        store = cls(path, **kwargs)
+        manifest_path = os.path.join(path, 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            csr_path = os.path.join(path, manifest['csr'])
+            arrays = {array: np.load(os.path.join(csr_path, f'{array}.npy'), mmap_mode='r' if mmap else None)
+                      for array in CSR_ARRAYS}
+            store.indptr, store.indices = arrays['indptr'], arrays['indices']
+            store.node_hashes, store.hash_order = arrays['node_hashes'], arrays['hash_order']
+            store._version = int(manifest['csr'])
+
+        # Replay edges logged after the last save
+        store._replay_log()
+        return store
+
+    def _replay_log(self) -> None:
+        # Inserts the whole edge pairs logged past `_log_offset`
+        log_path = os.path.join(self.path, EDGE_LOG)
+        if not os.path.exists(log_path):
+            return
+        with open(log_path, 'rb') as f:
+            f.seek(self._log_offset)
+            data = f.read()
+        data = data[:len(data) - len(data) % 16]
+        if data:
+            logged = np.frombuffer(data, dtype=np.uint64).reshape(-1, 2)
+            self._insert([(int(hu), int(hv)) for hu, hv in logged])
+            self._log_offset += len(data)
+
+    def refresh(self) -> None:
+        # Catches up with the files on disk, for processes reading a store that another process
+        # writes: a newer saved CSR is loaded afresh, otherwise only the edges logged since the
+        # last call are inserted
+        with self._lock:
+            manifest_path = os.path.join(self.path, 'manifest.json')
+            if os.path.exists(manifest_path):
+                with open(manifest_path) as f:
+                    version = int(json.load(f)['csr'])
+                if version != self._version:
+                    fresh = type(self).load(self.path)
+                    self._set_csr(fresh.indptr, fresh.indices, fresh.node_hashes)
+                    self.hash_order = fresh.hash_order
+                    self._version = fresh._version
+                    self.new_nodes, self.new_node_hashes = fresh.new_nodes, fresh.new_node_hashes
+                    self.pending, self.pending_edges = fresh.pending, fresh.pending_edges
+                    self._log_offset = fresh._log_offset
+                    return
+            self._replay_log()
+
+    @classmethod
+    def rebuild(cls, adjacency: Iterable[Tuple[str, Iterable[str]]], path: str = GRAPH_STORE_PATH,
+                **kwargs) -> 'GraphStore':
+        # Builds the CSR in one pass from (node key, neighbour keys) pairs
+        hashes: Dict[int, int] = {}
+        src, dst = [], []
+        for key, neighbor_keys in adjacency:
+            u = hashes.setdefault(node_hash(key), len(hashes))
+            for neighbor in neighbor_keys or ():
+                v = hashes.setdefault(node_hash(neighbor), len(hashes))
+                if u != v:
+                    src.append(u)
+                    dst.append(v)
+        store = cls.from_csr(*csr_from_edges(np.array(src, dtype=np.int32), np.array(dst, dtype=np.int32), len(hashes)),
+                             np.fromiter(hashes, dtype=np.uint64, count=len(hashes)), path, **kwargs)
+        shutil.rmtree(path, ignore_errors=True)
+        store.save(path)
+        return store
+
+    @classmethod
+    def from_csr(cls, indptr: np.ndarray, indices: np.ndarray, node_hashes: np.ndarray,
+                 path: str = GRAPH_STORE_PATH, **kwargs) -> 'GraphStore':
+        # In-memory store over an existing symmetric CSR; nothing is written until save()
+        store = cls(path, **kwargs)
+        store._set_csr(indptr, indices, node_hashes)
+        return store
+
+def csr_from_edges(src: np.ndarray, dst: np.ndarray, num_nodes: int, symmetric: bool = True):
+    # (indptr, indices) with sorted, de-duplicated rows; `symmetric` adds the reverse edges
+    if symmetric:
+        src, dst = np.concatenate([src, dst]), np.concatenate([dst, src])
+    keys = np.unique(src.astype(np.int64) * num_nodes + dst)
+    rows = (keys // max(num_nodes, 1)).astype(np.int32)
+    indices = (keys % max(num_nodes, 1)).astype(np.int32)
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(rows, minlength=num_nodes))
+    return indptr, indices
+
+def mongo_adjacency(db):
+    # (node key, neighbour keys) for registered users and collected profiles that list
+    # connections. Users are nodes by account id, as the network recompute job reads them;
+    # profiles by get_profile_key, as extract_features adds analysed profiles.
+    for user in db['users'].find({'connections.0': {'$exists': True}}, {'connections': 1}):
+        yield str(user['_id']), [str(c) for c in user['connections']]
+    for profile in db['profiles'].find({'data.connections.0': {'$exists': True}},
+                                       {'username': 1, 'data.profile_key': 1, 'data.profile_url': 1,
+                                        'data.username': 1, 'data.connections': 1}):
+        data = profile['data']
+        key = get_profile_key({'username': profile.get('username'), **data})
+        if key:
+            yield key, [str(c) for c in data['connections']]
+
+graph_store = GraphStore.load()
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Rebuild the social graph store from users and collected profiles')
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--path', default=GRAPH_STORE_PATH)
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv('MONGODB_URI'))
+    store = GraphStore.rebuild(mongo_adjacency(client['fake_profile_detector']), args.path)
+    print(f"Stored {store.num_nodes} nodes and {store.num_edges} edges in {args.path}")
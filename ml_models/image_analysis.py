@@ -0,0 +1,168 @@
+from typing import Any, Dict
+import io
+import os
+import cv2
+import numpy as np
+from PIL import Image
+from PIL.ExifTags import TAGS
+import face_recognition
+from scipy.fftpack import dct
+
+# CPU-bound per-image analysis. Kept free of the CNN runtime so image analysis worker
+# processes can import it without loading TensorFlow or ONNX models.
+
+CNN_INPUT_SIZE = (224, 224)
+EXIF_TAGS = ('Make', 'Model', 'DateTimeOriginal')
+# Worker-side analysis sub-steps; the CNN embedding ('embedding') runs in the parent
+IMAGE_ANALYSIS_STEPS = ('faces', 'exif', 'manipulation', 'ela', 'hashes')
+PHASH_SIZE = 32  # pHash keeps the 8x8 lowest frequencies of a 32x32 DCT
+
+# Images above this many pixels are rejected from the header, before anything is decoded
+IMAGE_MAX_DECODE_PIXELS = int(os.getenv('IMAGE_MAX_DECODE_PIXELS', 50_000_000))
+# Larger images are downscaled while decoding (JPEG DCT scaling via draft(), then a resize)
+IMAGE_DECODE_MAX_SIDE = int(os.getenv('IMAGE_DECODE_MAX_SIDE', 2048))
+# Manipulation scoring looks at most this many pixels (a centred, 8-aligned crop)
+MANIPULATION_MAX_PIXELS = int(os.getenv('MANIPULATION_MAX_PIXELS', 2_000_000))
+MANIPULATION_STRIP_ROWS = 256  # pixel rows per block-DCT strip, bounds the float32 working set
+ELA_QUALITY = 90
+
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_DECODE_PIXELS
+
+def _dct_matrix(n: int = 8) -> np.ndarray:
+    # Orthonormal DCT-II basis, the transform JPEG applies to each 8x8 block
+    k = np.arange(n)[:, np.newaxis]
+    matrix = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * np.arange(n)[np.newaxis, :] + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+DCT8 = _dct_matrix()
+
+class DecodedImage:
+    # Decodes an image once; the analyzers share the RGB array and the views derived from it
+    def __init__(self, pil_image: Image.Image):
+        info = pil_image._getexif() if hasattr(pil_image, '_getexif') else None
+        self.exif = {TAGS.get(tag_id, tag_id): value for tag_id, value in info.items()} if info else {}
+        self.pil = pil_image.convert('RGB')
+        if max(self.pil.size) > IMAGE_DECODE_MAX_SIDE:
+            self.pil.thumbnail((IMAGE_DECODE_MAX_SIDE, IMAGE_DECODE_MAX_SIDE), Image.LANCZOS)
+        self.rgb = np.asarray(self.pil)
+        self._gray = None
+        self._cnn_pixels = None
+
+    @classmethod
+    def load(cls, source) -> 'DecodedImage':
+        # Accepts raw bytes, a file-like object or a path
+        if isinstance(source, DecodedImage):
+            return source
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        image = Image.open(source)
+        width, height = image.size
+        if width * height > IMAGE_MAX_DECODE_PIXELS:
+            raise ValueError(f"Image of {width}x{height} pixels exceeds IMAGE_MAX_DECODE_PIXELS")
+        if max(width, height) > IMAGE_DECODE_MAX_SIDE:
+            image.draft('RGB', (IMAGE_DECODE_MAX_SIDE, IMAGE_DECODE_MAX_SIDE))
+        return cls(image)
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+        return self._gray
+
+    @property
+    def cnn_pixels(self):
+        # Same as image.load_img(target_size=(224, 224)): nearest-neighbour resize, uint8 RGB
+        if self._cnn_pixels is None:
+            self._cnn_pixels = np.asarray(self.pil.resize(CNN_INPUT_SIZE, Image.NEAREST))
+        return self._cnn_pixels
+
+    @property
+    def cnn_input(self):
+        # Same as img_to_array on the resized image
+        return self.cnn_pixels.astype(np.float32)
+
+def detect_faces(decoded: DecodedImage):
+    face_locations = face_recognition.face_locations(decoded.rgb)
+    face_encodings = face_recognition.face_encodings(decoded.rgb, face_locations)
+    return len(face_locations), face_encodings
+
+def extract_image_metadata(decoded: DecodedImage):
+    return decoded.exif
+
+def _manipulation_region(decoded: DecodedImage):
+    # Centred crop on the 8x8 JPEG grid, no larger than MANIPULATION_MAX_PIXELS
+    height, width = decoded.gray.shape
+    scale = min(1.0, np.sqrt(MANIPULATION_MAX_PIXELS / float(max(1, width * height))))
+    crop_w = int(width * scale) // 8 * 8
+    crop_h = int(height * scale) // 8 * 8
+    top = (height - crop_h) // 2 // 8 * 8
+    left = (width - crop_w) // 2 // 8 * 8
+    return top, left, crop_h, crop_w
+
+def detect_image_manipulation(decoded: DecodedImage) -> float:
+    # Mean absolute AC coefficient of the block-wise 8x8 DCT, per pixel. Computed in strips
+    # with two float32 matrix products per block, so memory stays bounded by the strip size.
+    top, left, height, width = _manipulation_region(decoded)
+    if not height or not width:
+        return 0.0
+    total = 0.0
+    for y in range(top, top + height, MANIPULATION_STRIP_ROWS):
+        rows = min(MANIPULATION_STRIP_ROWS, top + height - y)
+        strip = decoded.gray[y:y + rows, left:left + width].astype(np.float32) - 128.0
+        blocks = strip.reshape(rows // 8, 8, width // 8, 8).transpose(0, 2, 1, 3)
+        coefficients = DCT8 @ blocks @ DCT8.T
+        coefficients[..., 0, 0] = 0.0  # DC carries brightness, not artifacts
+        total += float(np.abs(coefficients).sum(dtype=np.float64))
+    return total / (height * width)
+
+def error_level_score(decoded: DecodedImage) -> float:
+    # Error level analysis: mean absolute change when the region is re-saved as JPEG.
+    # Edited areas recompress differently from the rest of the picture.
+    top, left, height, width = _manipulation_region(decoded)
+    if not height or not width:
+        return 0.0
+    region = decoded.pil.crop((left, top, left + width, top + height))
+    buffer = io.BytesIO()
+    region.save(buffer, 'JPEG', quality=ELA_QUALITY)
+    buffer.seek(0)
+    resaved = np.asarray(Image.open(buffer).convert('RGB'), dtype=np.int16)
+    return float(np.abs(np.asarray(region, dtype=np.int16) - resaved).mean())
+
+def _bits_to_hex(bits: np.ndarray) -> str:
+    return np.packbits(bits.flatten()).tobytes().hex()
+
+def perceptual_hashes(decoded: DecodedImage):
+    # 64-bit pHash and dHash as 16-digit hex strings (Mongo has no unsigned 64-bit ints)
+    gray = decoded.pil.convert('L')
+    small = np.asarray(gray.resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS), dtype=np.float32)
+    low = dct(dct(small.T, norm='ortho').T, norm='ortho')[:8, :8]
+    phash = _bits_to_hex(low > np.median(low.flatten()[1:]))  # DC term excluded from the median
+
+    small = np.asarray(gray.resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    dhash = _bits_to_hex(small[:, 1:] > small[:, :-1])
+    return phash, dhash
+
+def analyze_image(source, steps=IMAGE_ANALYSIS_STEPS, cnn_pixels: bool = True) -> Dict[str, Any]:
+    # Everything except the CNN forward pass; the result is small and picklable so it can
+    # come back from a worker process. cnn_pixels feeds the backbone in the parent.
+    # Only the requested sub-steps are computed and reported.
+    decoded = DecodedImage.load(source)
+    result: Dict[str, Any] = {}
+    if 'faces' in steps:
+        face_count, face_encodings = detect_faces(decoded)
+        result['face_count'] = face_count
+        result['face_encoding'] = face_encodings[0].tolist() if face_encodings else []
+    if 'exif' in steps:
+        metadata = extract_image_metadata(decoded)
+        result['has_exif'] = len(metadata) > 0
+        result['exif'] = {tag: str(metadata[tag]) for tag in EXIF_TAGS if tag in metadata}
+    if 'manipulation' in steps:
+        result['manipulation_score'] = detect_image_manipulation(decoded)
+    if 'ela' in steps:
+        result['ela_score'] = error_level_score(decoded)
+    if 'hashes' in steps:
+        result['phash'], result['dhash'] = perceptual_hashes(decoded)
+    if cnn_pixels:
+        result['cnn_pixels'] = decoded.cnn_pixels
+    return result
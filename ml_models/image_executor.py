@@ -0,0 +1,103 @@
+from typing import Any, Dict, List, Optional, Sequence
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import os
+import threading
+from .process_pool import kill_pool, spawn_pool
+
+IMAGE_ANALYSIS_WORKERS = int(os.getenv('IMAGE_ANALYSIS_WORKERS', 2))
+IMAGE_ANALYSIS_TIMEOUT = float(os.getenv('IMAGE_ANALYSIS_TIMEOUT', 10.0))  # seconds per image
+IMAGE_MAX_CONCURRENT_PER_REQUEST = int(os.getenv('IMAGE_MAX_CONCURRENT_PER_REQUEST', 4))
+
+logger = logging.getLogger(__name__)
+
+def _init_worker() -> None:
+    # Load the dlib face models once per worker instead of on the first request it serves
+    from .image_analysis import detect_faces, DecodedImage
+    from PIL import Image
+    detect_faces(DecodedImage(Image.new('RGB', (64, 64))))
+
+def _analyze(source, steps, cnn_pixels) -> Dict[str, Any]:
+    from .image_analysis import analyze_image, IMAGE_ANALYSIS_STEPS
+    return analyze_image(source, IMAGE_ANALYSIS_STEPS if steps is None else steps, cnn_pixels)
+
+def _ping() -> int:
+    return os.getpid()
+
+class ImageAnalysisExecutor:
+    # Runs face detection, EXIF parsing and the DCT in a pool of worker processes so they
+    # neither hold the GIL of the serving process nor take it down when an image crashes dlib.
+    # Images that time out or whose worker died get None and the caller's fallback.
+    def __init__(self, workers: int = IMAGE_ANALYSIS_WORKERS, timeout: float = IMAGE_ANALYSIS_TIMEOUT,
+                 max_concurrent_per_request: int = IMAGE_MAX_CONCURRENT_PER_REQUEST):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_concurrent_per_request = max_concurrent_per_request
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = spawn_pool(self.workers, initializer=_init_worker)
+            return self._pool
+
+    def _reset_pool(self, broken: ProcessPoolExecutor, kill: bool = False) -> None:
+        with self._lock:
+            if self._pool is broken:
+                self._pool = None
+        if kill:
+            kill_pool(broken)
+        else:
+            broken.shutdown(wait=False, cancel_futures=True)
+
+    def warm_up(self) -> None:
+        pool = self._get_pool()
+        wait([pool.submit(_ping) for _ in range(self.workers)])
+
+    @staticmethod
+    def _payload(source):
+        # Bytes and paths are sent as-is; file-like objects are read here
+        if hasattr(source, 'read'):
+            return source.read()
+        return source
+
+    def analyze_many(self, sources: List[Any], steps: Optional[Sequence[str]] = None,
+                     cnn_pixels: bool = True) -> List[Optional[Dict[str, Any]]]:
+        results: List[Optional[Dict[str, Any]]] = [None] * len(sources)
+        # At most max_concurrent_per_request images of one request are in the pool at a time
+        for start in range(0, len(sources), self.max_concurrent_per_request):
+            chunk = range(start, min(start + self.max_concurrent_per_request, len(sources)))
+            pool = self._get_pool()
+            try:
+                futures = {pool.submit(_analyze, self._payload(sources[i]), None if steps is None else tuple(steps), cnn_pixels): i for i in chunk}
+            except BrokenProcessPool:
+                self._reset_pool(pool)
+                continue
+
+            done, not_done = wait(futures, timeout=self.timeout)
+            if not_done:
+                logger.warning("Image analysis of %d image(s) timed out after %.1fs", len(not_done), self.timeout)
+                # A task that already started cannot be cancelled: its worker is recycled
+                # instead of staying stuck and starving every later request
+                if any(not future.cancel() for future in not_done):
+                    logger.error("Killing image analysis workers stuck past the timeout")
+                    self._reset_pool(pool, kill=True)
+            for future in done:
+                try:
+                    results[futures[future]] = future.result()
+                except BrokenProcessPool:
+                    logger.error("Image analysis worker died; recreating the pool")
+                    self._reset_pool(pool)
+                except Exception as e:
+                    logger.warning("Image analysis failed: %s", e)
+        return results
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+image_analysis_executor = ImageAnalysisExecutor()
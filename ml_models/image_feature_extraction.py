@@ -1,107 +1,142 @@
-import cv2
 import numpy as np
-from PIL import Image
-from PIL.ExifTags import TAGS
-import face_recognition
-from tensorflow.keras.applications.resnet50 import ResNet50, preprocess_input
-from tensorflow.keras.preprocessing import image
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Dense, GlobalAveragePooling2D
-from scipy.fftpack import dct
+from .inference_batcher import InferenceBatcher
+from .image_inference_backend import load_image_backend, EMBEDDING_SIZE
+from .image_analysis import DecodedImage, analyze_image, IMAGE_ANALYSIS_STEPS
+from .image_executor import image_analysis_executor
+from .feature_vector import FeatureVector, MAX_IMAGES
+from .feature_registry import feature_registry
 import os
 
-# Initialize ResNet50 model
-resnet_model = ResNet50(weights='imagenet', include_top=False, pooling='avg')
-
-# Custom CNN for profile picture classification
-def create_custom_cnn():
-    model = Sequential([
-        ResNet50(weights='imagenet', include_top=False, input_shape=(224, 224, 3)),
-        GlobalAveragePooling2D(),
-        Dense(256, activation='relu'),
-        Dense(1, activation='sigmoid')
-    ])
-    model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['accuracy'])
-    return model
-
-custom_cnn = create_custom_cnn()
-# TODO: Train this model with your dataset of real and fake profile pictures
-
-def detect_faces(img_path):
-    image = face_recognition.load_image_file(img_path)
-    face_locations = face_recognition.face_locations(image)
-    face_encodings = face_recognition.face_encodings(image, face_locations)
-    return len(face_locations), face_encodings
-
-def extract_image_metadata(img_path):
-    image = Image.open(img_path)
-    exif_data = {}
-    info = image._getexif()
-    if info:
-        for tag_id, value in info.items():
-            tag = TAGS.get(tag_id, tag_id)
-            exif_data[tag] = value
-    return exif_data
-
-def extract_deep_features(img_path):
-    img = image.load_img(img_path, target_size=(224, 224))
-    x = image.img_to_array(img)
-    x = np.expand_dims(x, axis=0)
-    x = preprocess_input(x)
-    features = resnet_model.predict(x)
-    return features.flatten()
-
-def detect_image_manipulation(img_path):
-    img = cv2.imread(img_path, 0)
-    dct_result = dct(dct(img.T, norm='ortho').T, norm='ortho')
-    return np.sum(np.abs(dct_result))
-
-def classify_profile_picture(img_path):
-    img = image.load_img(img_path, target_size=(224, 224))
-    x = image.img_to_array(img)
-    x = np.expand_dims(x, axis=0)
-    x = preprocess_input(x)
-    prediction = custom_cnn.predict(x)
-    return prediction[0][0]
-
-def extract_image_features(img_paths):
-    features = {}
+IMAGE_BATCH_MAX_SIZE = int(os.getenv('IMAGE_BATCH_MAX_SIZE', 16))
+IMAGE_BATCH_MAX_WAIT_MS = float(os.getenv('IMAGE_BATCH_MAX_WAIT_MS', 5))
+
+IMAGE_STEPS = IMAGE_ANALYSIS_STEPS + ('embedding',)
+
+feature_registry.register('image.count', ['total_images', 'image_analysis_failed_*'])
+feature_registry.register('image.faces', ['face_count_*', 'face_encoding_*', 'avg_face_count'], requires=['image.count'])
+feature_registry.register('image.exif', ['has_exif_*', 'camera_make_*', 'camera_model_*', 'date_taken_*'],
+                          requires=['image.count'])
+feature_registry.register('image.manipulation', ['manipulation_score_*', 'avg_manipulation_score'], requires=['image.count'])
+feature_registry.register('image.ela', ['ela_score_*', 'avg_ela_score'], requires=['image.count'])
+feature_registry.register('image.hashes', ['phash_*', 'dhash_*'], requires=['image.count'])
+feature_registry.register('image.embedding', ['deep_feature_*', 'profile_pic_score_*', 'avg_profile_pic_score'],
+                          requires=['image.count'])
+
+# Features reported for an image whose analysis timed out or failed
+IMAGE_ANALYSIS_FALLBACK = {
+    'face_count': 0,
+    'face_encoding': [],
+    'has_exif': False,
+    'exif': {},
+    'manipulation_score': 0.0,
+    'ela_score': 0.0,
+    'phash': '',
+    'dhash': '',
+    'profile_pic_score': 0.5,
+}
+
+# Shared ResNet50 backbone plus profile picture head, on the runtime chosen by IMAGE_INFERENCE_BACKEND.
+# The pooled 2048-d backbone output is both the deep features and the classifier input.
+image_backend = load_image_backend()
+
+# Backbone forward passes are batched across the images of a request and across concurrent requests
+image_embedding_batcher = InferenceBatcher(image_backend.embed, max_batch_size=IMAGE_BATCH_MAX_SIZE,
+                                           max_wait_ms=IMAGE_BATCH_MAX_WAIT_MS, name='image-embedding')
+
+def submit_deep_features(cnn_pixels):
+    # Returns a future for the backbone embedding so callers can do other work while it is batched
+    return image_embedding_batcher.submit(np.asarray(cnn_pixels, dtype=np.float32))
+
+def extract_deep_features(decoded: DecodedImage):
+    return np.asarray(submit_deep_features(decoded.cnn_pixels).result()).flatten()
+
+def classify_profile_picture(embedding):
+    return float(image_backend.classify(np.asarray(embedding, dtype=np.float32).reshape(1, EMBEDDING_SIZE))[0])
+
+def extract_image_features(images, steps=IMAGE_STEPS):
+    # `images` may hold bytes, file-like objects, paths or DecodedImage instances
+    features = FeatureVector()
+    analysis_steps = tuple(step for step in IMAGE_ANALYSIS_STEPS if step in steps)
+    embed = 'embedding' in steps
+
+    # Face detection, EXIF and the DCT run in worker processes; already decoded images inline
+    analyses = image_analysis_executor.analyze_many([
+        source for source in images if not isinstance(source, DecodedImage)
+    ], analysis_steps, cnn_pixels=embed)
+    analyses = iter(analyses)
+    analyses = [analyze_image(source, analysis_steps, cnn_pixels=embed) if isinstance(source, DecodedImage) else next(analyses)
+                for source in images]
+
+    # Queue every embedding first so the request's images share backbone batches
+    embedding_futures = [
+        submit_deep_features(analysis['cnn_pixels']) if embed and analysis is not None else None for analysis in analyses
+    ]
     
-    for i, img_path in enumerate(img_paths):
+    for i, analysis in enumerate(analyses):
+        # Images that timed out or crashed their worker get neutral defaults
+        features[f'image_analysis_failed_{i}'] = analysis is None
+        analysis = analysis or IMAGE_ANALYSIS_FALLBACK
+
         # Face detection and recognition
-        face_count, face_encodings = detect_faces(img_path)
-        features[f'face_count_{i}'] = face_count
-        features[f'face_encoding_{i}'] = face_encodings[0].tolist() if face_encodings else []
+        if 'faces' in steps:
+            features[f'face_count_{i}'] = analysis['face_count']
+            if i < MAX_IMAGES:
+                features.set_block(f'face_encoding_{i}', analysis['face_encoding'])
+            else:
+                features[f'face_encoding_{i}'] = analysis['face_encoding']
         
         # Image metadata
-        metadata = extract_image_metadata(img_path)
-        features[f'has_exif_{i}'] = len(metadata) > 0
-        features[f'camera_make_{i}'] = metadata.get('Make', 'Unknown')
-        features[f'camera_model_{i}'] = metadata.get('Model', 'Unknown')
-        features[f'date_taken_{i}'] = metadata.get('DateTimeOriginal', 'Unknown')
-        
-        # Deep learning features
-        deep_features = extract_deep_features(img_path)
-        for j, value in enumerate(deep_features):
-            features[f'deep_feature_{i}_{j}'] = value
+        if 'exif' in steps:
+            features[f'has_exif_{i}'] = analysis['has_exif']
+            features[f'camera_make_{i}'] = analysis['exif'].get('Make', 'Unknown')
+            features[f'camera_model_{i}'] = analysis['exif'].get('Model', 'Unknown')
+            features[f'date_taken_{i}'] = analysis['exif'].get('DateTimeOriginal', 'Unknown')
         
         # Image manipulation detection
-        features[f'manipulation_score_{i}'] = detect_image_manipulation(img_path)
+        if 'manipulation' in steps:
+            features[f'manipulation_score_{i}'] = analysis['manipulation_score']
+        if 'ela' in steps:
+            features[f'ela_score_{i}'] = analysis['ela_score']
+
+        # Perceptual hashes for the cross-profile image reuse index
+        if 'hashes' in steps:
+            features[f'phash_{i}'] = analysis['phash']
+            features[f'dhash_{i}'] = analysis['dhash']
+
+    for i, future in enumerate(embedding_futures if embed else []):
+        # Deep learning features: the backbone embedding, shared with the classifier head
+        if future is not None:
+            deep_features = np.asarray(future.result()).flatten()
+            profile_pic_score = classify_profile_picture(deep_features)
+        else:
+            deep_features = np.zeros(EMBEDDING_SIZE, dtype=np.float32)
+            profile_pic_score = IMAGE_ANALYSIS_FALLBACK['profile_pic_score']
+        # Images past the schema's slots keep their scores but not their embedding
+        if i < MAX_IMAGES:
+            features.set_block(f'deep_feature_{i}', deep_features)
         
         # Profile picture classification
-        features[f'profile_pic_score_{i}'] = classify_profile_picture(img_path)
+        features[f'profile_pic_score_{i}'] = profile_pic_score
     
     return features
 
-def analyze_multiple_images(image_paths):
-    all_features = extract_image_features(image_paths)
+def analyze_multiple_images(image_paths, steps=IMAGE_STEPS):
+    # With none of the per-image steps planned only the image count is reported
+    if any(step in steps for step in IMAGE_STEPS):
+        all_features = extract_image_features(image_paths, steps)
+    else:
+        all_features = FeatureVector()
+    count = len(image_paths)
     
     # Aggregate features from multiple images
-    aggregated_features = {
-        'total_images': len(image_paths),
-        'avg_face_count': np.mean([all_features[f'face_count_{i}'] for i in range(len(image_paths))]),
-        'avg_manipulation_score': np.mean([all_features[f'manipulation_score_{i}'] for i in range(len(image_paths))]),
-        'avg_profile_pic_score': np.mean([all_features[f'profile_pic_score_{i}'] for i in range(len(image_paths))]),
-    }
+    all_features['total_images'] = count
+    if 'faces' in steps:
+        all_features['avg_face_count'] = np.mean([all_features[f'face_count_{i}'] for i in range(count)])
+    if 'manipulation' in steps:
+        all_features['avg_manipulation_score'] = np.mean([all_features[f'manipulation_score_{i}'] for i in range(count)])
+    if 'ela' in steps:
+        all_features['avg_ela_score'] = np.mean([all_features[f'ela_score_{i}'] for i in range(count)])
+    if 'embedding' in steps:
+        all_features['avg_profile_pic_score'] = np.mean([all_features[f'profile_pic_score_{i}'] for i in range(count)])
     
-    return {**all_features, **aggregated_features}
+    return all_features
@@ -0,0 +1,225 @@
+from typing import Dict, List, Optional
+import argparse
+import os
+import shutil
+import threading
+import numpy as np
+from .feature_vector import FeatureVector, ANALYSES_WITH_IMAGES
+from .feature_registry import feature_registry
+from .profile_key import get_profile_key, owner_id
+from .segment_store import ArraySegment, SegmentStore
+
+IMAGE_HASH_INDEX_PATH = os.getenv('IMAGE_HASH_INDEX_PATH', 'image_hash_index')
+# Max pHash and dHash Hamming distance. Lookup cost grows with radius // 4 (the per-chunk radius):
+# up to 7 each chunk probes 17 values, 8-11 probes 137.
+IMAGE_HASH_RADIUS = int(os.getenv('IMAGE_HASH_RADIUS', 7))
+# Hard cap on segment count; size-ratio compaction normally keeps it near log2(size / 4096)
+IMAGE_HASH_MAX_SEGMENTS = int(os.getenv('IMAGE_HASH_MAX_SEGMENTS', 32))
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+# Pending inserts are scanned linearly and sealed into an immutable segment in chunks
+PENDING_MERGE_SIZE = 4096
+
+feature_registry.register('image_reuse', ['image_reuse_count', 'min_hamming_distance'],
+                          requires=['image.hashes'], feeds_index=True)
+
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+_CHUNK_POPCOUNT = np.array([bin(i).count('1') for i in range(1 << CHUNK_BITS)], dtype=np.uint8)
+
+def parse_hash(value: str) -> Optional[int]:
+    # Hashes are stored as 16-digit hex strings; '' marks an image that was not analyzed
+    return int(value, 16) if value else None
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    return _POPCOUNT8[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+def hash_chunks(hashes: np.ndarray) -> np.ndarray:
+    # (n,) uint64 -> (CHUNKS, n) uint16 substrings
+    return np.stack([(hashes >> np.uint64(c * CHUNK_BITS)).astype(np.uint16) for c in range(CHUNKS)])
+
+class _Segment(ArraySegment):
+    # Immutable multi-index hashing table: for each 16-bit chunk, document ids sorted by
+    # chunk value plus a 65537-entry offsets array, so one chunk value is one O(1) slice.
+    ARRAYS = ('phashes', 'dhashes', 'owners', 'order', 'offsets')
+
+    def __init__(self, phashes, dhashes, owners, order=None, offsets=None):
+        self.phashes = phashes
+        self.dhashes = dhashes
+        self.owners = owners
+        if order is None:
+            chunks = hash_chunks(phashes)
+            order = np.argsort(chunks, axis=1, kind='stable').astype(np.int32)
+            offsets = np.zeros((CHUNKS, (1 << CHUNK_BITS) + 1), dtype=np.int64)
+            for c in range(CHUNKS):
+                offsets[c, 1:] = np.cumsum(np.bincount(chunks[c], minlength=1 << CHUNK_BITS))
+        self.order = order
+        self.offsets = offsets
+
+    def candidates(self, query_chunks: np.ndarray, masks: np.ndarray) -> np.ndarray:
+        # Ids whose value in some chunk is within the per-chunk radius of the query's;
+        # an id matching several chunks appears several times
+        ids = []
+        for c in range(CHUNKS):
+            values = (query_chunks[c] ^ masks).astype(np.int64)
+            starts = self.offsets[c, values]
+            lengths = self.offsets[c, values + 1] - starts
+            total = int(lengths.sum())
+            if total:
+                # Concatenated ranges [start, start + length) without a Python loop
+                positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+                ids.append(self.order[c, positions])
+        return np.concatenate(ids) if ids else np.zeros(0, dtype=np.int32)
+
+def merge_segments(segments: List[_Segment]) -> _Segment:
+    return _Segment(np.concatenate([np.asarray(s.phashes) for s in segments]),
+                    np.concatenate([np.asarray(s.dhashes) for s in segments]),
+                    np.concatenate([np.asarray(s.owners) for s in segments]))
+
+class ImageHashIndex:
+    # pHash index with exact Hamming-radius search by multi-index hashing: if two 64-bit
+    # hashes are within r, one of their four 16-bit chunks is within r // 4. Sealed segments
+    # are memory-mapped; a candidate must also be within the radius on dHash.
+    def __init__(self, path: str = IMAGE_HASH_INDEX_PATH, radius: int = IMAGE_HASH_RADIUS,
+                 max_segments: int = IMAGE_HASH_MAX_SEGMENTS):
+        self.path = path
+        self.radius = radius
+        self.masks = np.flatnonzero(_CHUNK_POPCOUNT <= radius // CHUNKS).astype(np.uint16)
+        self.store = SegmentStore(_Segment, max_segments)
+        self.pending_phashes = np.zeros(PENDING_MERGE_SIZE, dtype=np.uint64)
+        self.pending_dhashes = np.zeros(PENDING_MERGE_SIZE, dtype=np.uint64)
+        self.pending_owners = np.zeros(PENDING_MERGE_SIZE, dtype=np.uint64)
+        self.pending_count = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.store) + self.pending_count
+
+    def _matches(self, phash: int, dhash: int, owner: int):
+        # (owners, pHash distances) of documents from other profiles within the radius
+        query = np.array([phash], dtype=np.uint64)
+        query_d = np.uint64(dhash)
+        query_chunks = hash_chunks(query)[:, 0]
+        owners, distances = [], []
+        with self._lock:
+            sources = [(segment, segment.candidates(query_chunks, self.masks)) for segment in self.store.values()]
+            n = self.pending_count
+            pending = (self.pending_phashes[:n].copy(), self.pending_dhashes[:n].copy(), self.pending_owners[:n].copy())
+
+        for segment, ids in sources:
+            if len(ids):
+                # Filter on pHash first so dHash and owners are only gathered for real matches
+                p_distances = popcount(segment.phashes[ids] ^ query[0])
+                ids = ids[p_distances <= self.radius]
+                owners.append(segment.owners[ids])
+                distances.append((p_distances[p_distances <= self.radius], popcount(segment.dhashes[ids] ^ query_d)))
+        if len(pending[0]):
+            owners.append(pending[2])
+            distances.append((popcount(pending[0] ^ query[0]), popcount(pending[1] ^ query_d)))
+        if not owners:
+            return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+
+        owners = np.concatenate(owners)
+        p_distances = np.concatenate([p for p, _ in distances]).astype(np.int64)
+        d_distances = np.concatenate([d for _, d in distances]).astype(np.int64)
+        mask = (owners != np.uint64(owner)) & (p_distances <= self.radius) & (d_distances <= self.radius)
+        return owners[mask], p_distances[mask]
+
+    def query_profile(self, profile_key: Optional[str], phashes: List[str], dhashes: List[str]) -> Dict[str, float]:
+        owner = owner_id(profile_key)
+        reused_by = set()
+        min_distance = HASH_BITS
+        for phash, dhash in zip(phashes, dhashes):
+            phash, dhash = parse_hash(phash), parse_hash(dhash)
+            if phash is None or dhash is None:
+                continue
+            owners, distances = self._matches(phash, dhash, owner)
+            reused_by.update(owners.tolist())
+            if len(distances):
+                min_distance = min(min_distance, int(distances.min()))
+        return {
+            'image_reuse_count': len(reused_by),
+            'min_hamming_distance': min_distance,
+        }
+
+    def add_profile(self, profile_key: Optional[str], phashes: List[str], dhashes: List[str]) -> None:
+        if not profile_key:
+            return
+        owner = owner_id(profile_key)
+        with self._lock:
+            for phash, dhash in zip(phashes, dhashes):
+                phash, dhash = parse_hash(phash), parse_hash(dhash)
+                if phash is None or dhash is None:
+                    continue
+                i = self.pending_count
+                self.pending_phashes[i] = phash
+                self.pending_dhashes[i] = dhash
+                self.pending_owners[i] = owner
+                self.pending_count += 1
+                if self.pending_count == PENDING_MERGE_SIZE:
+                    self._seal()
+
+    def _seal(self) -> None:
+        n = self.pending_count
+        if not n:
+            return
+        self.store.add(_Segment(self.pending_phashes[:n].copy(), self.pending_dhashes[:n].copy(),
+                                self.pending_owners[:n].copy()), merge_segments)
+        self.pending_count = 0
+
+    def save(self, path: str = None) -> None:
+        with self._lock:
+            self._seal()
+            self.store.save(path or self.path)
+
+    @classmethod
+    def load(cls, path: str = IMAGE_HASH_INDEX_PATH, **kwargs) -> 'ImageHashIndex':
+        index = cls(path, **kwargs)
+        index.store.load(path)
+        return index
+
+    @classmethod
+    def rebuild(cls, analyses, path: str = IMAGE_HASH_INDEX_PATH, **kwargs) -> 'ImageHashIndex':
+        # Builds a single segment from stored analyses ({'profile_key', 'profile_url', 'features':
+        # <FeatureVector document>}), keyed like the live path
+        phashes, dhashes, owners = [], [], []
+        for analysis in analyses:
+            features = FeatureVector.from_document(analysis.get('features'))
+            profile_key = get_profile_key(analysis)
+            if not profile_key:
+                continue
+            owner = owner_id(profile_key)
+            for i in range(int(features.get('total_images', 0) or 0)):
+                phash = parse_hash(features.get(f'phash_{i}', ''))
+                dhash = parse_hash(features.get(f'dhash_{i}', ''))
+                if phash is not None and dhash is not None:
+                    phashes.append(phash)
+                    dhashes.append(dhash)
+                    owners.append(owner)
+
+        index = cls(path, **kwargs)
+        index.store.replace_all(_Segment(np.array(phashes, dtype=np.uint64), np.array(dhashes, dtype=np.uint64),
+                                         np.array(owners, dtype=np.uint64)))
+        shutil.rmtree(path, ignore_errors=True)
+        index.save(path)
+        return index
+
+image_hash_index = ImageHashIndex.load()
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Rebuild the perceptual-hash image index from stored analyses')
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--path', default=IMAGE_HASH_INDEX_PATH)
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv('MONGODB_URI'))
+    analyses = client['fake_profile_detector']['analyses'].find(
+        ANALYSES_WITH_IMAGES, {'profile_key': 1, 'profile_url': 1, 'features': 1}
+    )
+    index = ImageHashIndex.rebuild(analyses, args.path)
+    print(f"Indexed {len(index)} image hashes into {args.path}")
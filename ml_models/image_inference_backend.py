@@ -0,0 +1,106 @@
+from typing import Dict
+import os
+import numpy as np
+
+IMAGE_INFERENCE_BACKEND = os.getenv('IMAGE_INFERENCE_BACKEND', 'keras')  # keras, onnx or onnx-int8
+IMAGE_MODEL_DIR = os.getenv('IMAGE_MODEL_DIR', 'image_models')
+IMAGE_INFERENCE_THREADS = int(os.getenv('IMAGE_INFERENCE_THREADS', 0))  # 0 lets the runtime decide
+PROFILE_PIC_HEAD_PATH = os.getenv('PROFILE_PIC_HEAD_PATH', 'profile_pic_head.weights.h5')
+
+EMBEDDING_SIZE = 2048
+BACKBONE_ONNX = 'resnet50.onnx'
+BACKBONE_INT8_ONNX = 'resnet50.int8.onnx'
+HEAD_ONNX = 'profile_pic_head.onnx'
+
+# keras.applications.resnet50.preprocess_input ('caffe' mode): RGB -> BGR, subtract ImageNet means
+IMAGENET_BGR_MEAN = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+def preprocess_batch(batch: np.ndarray) -> np.ndarray:
+    # (n, 224, 224, 3) RGB in [0, 255] -> backbone input; never modifies `batch`
+    return np.ascontiguousarray(batch[..., ::-1], dtype=np.float32) - IMAGENET_BGR_MEAN
+
+def create_profile_pic_head():
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Dense, Input
+
+    model = Sequential([
+        Input(shape=(EMBEDDING_SIZE,)),
+        Dense(256, activation='relu'),
+        Dense(1, activation='sigmoid')
+    ])
+    model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['accuracy'])
+    return model
+
+def train_profile_pic_head(embeddings, labels, epochs=10, batch_size=32, path=PROFILE_PIC_HEAD_PATH):
+    # Trains on precomputed backbone embeddings, so the backbone never runs during training
+    model = create_profile_pic_head()
+    model.fit(np.asarray(embeddings, dtype=np.float32), np.asarray(labels), epochs=epochs, batch_size=batch_size)
+    model.save_weights(path)
+    return model
+
+class KerasImageBackend:
+    # TensorFlow is only imported when this backend is selected
+    name = 'keras'
+
+    def __init__(self, head_path: str = PROFILE_PIC_HEAD_PATH):
+        from tensorflow.keras.applications.resnet50 import ResNet50
+
+        self.backbone = ResNet50(weights='imagenet', include_top=False, pooling='avg')
+        self.head = create_profile_pic_head()
+        if os.path.exists(head_path):
+            self.head.load_weights(head_path)
+
+    def embed(self, batch: np.ndarray) -> np.ndarray:
+        return np.asarray(self.backbone.predict_on_batch(preprocess_batch(batch)))
+
+    def classify(self, embeddings: np.ndarray) -> np.ndarray:
+        # The head is tiny, so it is called directly instead of going through predict()
+        return np.asarray(self.head(embeddings, training=False))[:, 0]
+
+class OnnxImageBackend:
+    # ONNX Runtime sessions for the models written by export_image_models.py
+    def __init__(self, model_dir: str = IMAGE_MODEL_DIR, quantized: bool = False,
+                 threads: int = IMAGE_INFERENCE_THREADS):
+        import onnxruntime as ort
+
+        self.name = 'onnx-int8' if quantized else 'onnx'
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+
+        backbone_path = os.path.join(model_dir, BACKBONE_INT8_ONNX if quantized else BACKBONE_ONNX)
+        self.backbone = ort.InferenceSession(backbone_path, options, providers=['CPUExecutionProvider'])
+        self.head = ort.InferenceSession(os.path.join(model_dir, HEAD_ONNX), options,
+                                         providers=['CPUExecutionProvider'])
+        self.backbone_input = self.backbone.get_inputs()[0].name
+        self.head_input = self.head.get_inputs()[0].name
+
+    def embed(self, batch: np.ndarray) -> np.ndarray:
+        return self.backbone.run(None, {self.backbone_input: preprocess_batch(batch)})[0]
+
+    def classify(self, embeddings: np.ndarray) -> np.ndarray:
+        return self.head.run(None, {self.head_input: np.asarray(embeddings, dtype=np.float32)})[0][:, 0]
+
+def load_image_backend(name: str = IMAGE_INFERENCE_BACKEND, model_dir: str = IMAGE_MODEL_DIR):
+    if name == 'keras':
+        return KerasImageBackend()
+    if name == 'onnx':
+        return OnnxImageBackend(model_dir)
+    if name == 'onnx-int8':
+        return OnnxImageBackend(model_dir, quantized=True)
+    raise ValueError(f"Unsupported image inference backend: {name}")
+
+def compare_backends(reference, candidate, batch: np.ndarray) -> Dict[str, float]:
+    # Accuracy parity of `candidate` against `reference` on the same (n, 224, 224, 3) RGB batch
+    expected = reference.embed(batch)
+    actual = candidate.embed(batch)
+    cosine = (expected * actual).sum(axis=1) / (
+        np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1) + 1e-12)
+    score_diff = np.abs(reference.classify(expected) - candidate.classify(actual))
+    return {
+        'max_abs_embedding_diff': float(np.abs(expected - actual).max()),
+        'min_embedding_cosine': float(cosine.min()),
+        'mean_embedding_cosine': float(cosine.mean()),
+        'max_score_diff': float(score_diff.max()),
+    }
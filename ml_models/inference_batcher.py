@@ -0,0 +1,135 @@
+from typing import Any, Callable, Dict, List
+from collections import deque
+from concurrent.futures import Future
+import logging
+import queue
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def _resolve(future: Future, result: Any = None, error: BaseException = None) -> None:
+    # A future can already be resolved (e.g. cancelled by its caller); it is left as it is
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+class InferenceBatcher:
+    # Collects single inputs from any number of threads and runs them through `predict_fn`
+    # as one stacked batch, flushing when max_batch_size inputs are queued or the oldest
+    # input has waited max_wait_ms. Each caller gets its own row of the output back.
+    def __init__(self, predict_fn: Callable[[np.ndarray], np.ndarray], max_batch_size: int = 16,
+                 max_wait_ms: float = 5.0, name: str = 'inference-batcher', metrics_window: int = 1000):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue: 'queue.Queue[tuple]' = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        self._metrics_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._batch_sizes = deque(maxlen=metrics_window)
+        self._queue_waits = deque(maxlen=metrics_window)
+        self._inference_times = deque(maxlen=metrics_window)
+
+    def _ensure_started(self) -> None:
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def submit(self, x: np.ndarray) -> Future:
+        self._ensure_started()
+        future = Future()
+        self._queue.put((x, future, time.perf_counter()))
+        return future
+
+    def infer(self, x: np.ndarray) -> np.ndarray:
+        return self.submit(x).result()
+
+    def infer_many(self, xs: List[np.ndarray]) -> List[np.ndarray]:
+        # Submitting everything before waiting lets one request's inputs share a batch
+        futures = [self.submit(x) for x in xs]
+        return [future.result() for future in futures]
+
+    def _collect(self) -> List[tuple]:
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        # Nothing may end this loop: callers of submit() wait on it for their result
+        while True:
+            try:
+                self._process(self._collect())
+            except Exception:
+                logger.exception("Inference batcher %s failed to process a batch", self.name)
+
+    def _process(self, batch: List[tuple]) -> None:
+        started = time.perf_counter()
+        # Inputs whose caller cancelled while queued are dropped
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        inputs = [x for x, _, _ in batch]
+        futures = [future for _, future, _ in batch]
+        try:
+            outputs = self.predict_fn(np.stack(inputs))
+            if len(outputs) != len(futures):
+                raise ValueError(f"{self.name}: predict_fn returned {len(outputs)} rows for {len(futures)} inputs")
+            failed = False
+        except Exception as e:
+            for future in futures:
+                _resolve(future, error=e)
+            failed = True
+        else:
+            for future, output in zip(futures, outputs):
+                _resolve(future, output)
+        finished = time.perf_counter()
+
+        with self._metrics_lock:
+            self._batches += 1
+            self._items += len(futures)
+            self._errors += int(failed)
+            self._batch_sizes.append(len(futures))
+            self._queue_waits.extend(started - enqueued for _, _, enqueued in batch)
+            self._inference_times.append(finished - started)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._metrics_lock:
+            sizes = np.array(self._batch_sizes, dtype=np.float64)
+            waits = np.array(self._queue_waits, dtype=np.float64) * 1000
+            times = np.array(self._inference_times, dtype=np.float64) * 1000
+            metrics = {
+                'name': self.name,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'queue_depth': self._queue.qsize(),
+                'batches': self._batches,
+                'items': self._items,
+                'errors': self._errors,
+            }
+
+        # Distribution stats cover the most recent `metrics_window` batches / items
+        metrics['avg_batch_size'] = float(sizes.mean()) if len(sizes) else 0.0
+        metrics['avg_batch_fill'] = metrics['avg_batch_size'] / self.max_batch_size
+        metrics['avg_queue_wait_ms'] = float(waits.mean()) if len(waits) else 0.0
+        metrics['p95_queue_wait_ms'] = float(np.percentile(waits, 95)) if len(waits) else 0.0
+        metrics['avg_inference_ms'] = float(times.mean()) if len(times) else 0.0
+        metrics['p95_inference_ms'] = float(np.percentile(times, 95)) if len(times) else 0.0
+        return metrics
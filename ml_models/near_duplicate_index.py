@@ -0,0 +1,271 @@
+from typing import Dict, List, Optional
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import zlib
+import numpy as np
+from .feature_registry import feature_registry
+from .profile_key import owner_id
+
+NEAR_DUPLICATE_INDEX_PATH = os.getenv('NEAR_DUPLICATE_INDEX_PATH', 'near_duplicate_index')
+NEAR_DUPLICATE_WINDOW_SECONDS = int(os.getenv('NEAR_DUPLICATE_WINDOW_SECONDS', 7 * 24 * 3600))
+NEAR_DUPLICATE_MAX_SHARDS = int(os.getenv('NEAR_DUPLICATE_MAX_SHARDS', 8))
+NEAR_DUPLICATE_MAX_DOCS = int(os.getenv('NEAR_DUPLICATE_MAX_DOCS', 500000))
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.7))
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+# Pending inserts are scanned linearly and merged into the sorted band index in chunks
+PENDING_MERGE_SIZE = 4096
+
+feature_registry.register('near_duplicate', ['near_duplicate_post_ratio', 'max_bio_similarity'], feeds_index=True)
+
+KIND_BIO = 0
+KIND_POST = 1
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, 2 ** 32, NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 2 ** 32, NUM_PERM, dtype=np.uint64)
+_BAND_COEFFS = _rng.randint(1, 2 ** 62, ROWS, dtype=np.uint64) | np.uint64(1)
+
+TOKEN_RE = re.compile(r"\w+")
+
+def shingles(text: str) -> List[str]:
+    tokens = TOKEN_RE.findall(text.lower())
+    if len(tokens) < SHINGLE_SIZE:
+        return tokens
+    return [' '.join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)]
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    items = shingles(text)
+    if not items:
+        return None
+    hashes = np.fromiter((zlib.crc32(item.encode('utf-8')) for item in set(items)), dtype=np.uint64)
+    values = (np.outer(hashes, _PERM_A) + _PERM_B) % _MERSENNE_PRIME
+    return values.min(axis=0).astype(np.uint32)
+
+def band_keys(signatures: np.ndarray) -> np.ndarray:
+    # (n, NUM_PERM) uint32 -> (n, BANDS) uint64; multiplication wraps modulo 2**64
+    rows = signatures.reshape(-1, BANDS, ROWS).astype(np.uint64)
+    return (rows * _BAND_COEFFS).sum(axis=2, dtype=np.uint64)
+
+class _Shard:
+    # One time window of the index. Sealed documents live in per-band sorted key arrays
+    # (memory-mapped for past windows); recent inserts sit in a small pending buffer.
+    ARRAYS = ('signatures', 'owners', 'kinds', 'sorted_keys', 'order')
+
+    def __init__(self, window: int):
+        self.window = window
+        self.signatures = np.zeros((0, NUM_PERM), dtype=np.uint32)
+        self.owners = np.zeros(0, dtype=np.uint64)
+        self.kinds = np.zeros(0, dtype=np.uint8)
+        self.sorted_keys = np.zeros((BANDS, 0), dtype=np.uint64)
+        self.order = np.zeros((BANDS, 0), dtype=np.int32)
+        self.pending_signatures = np.zeros((PENDING_MERGE_SIZE, NUM_PERM), dtype=np.uint32)
+        self.pending_keys = np.zeros((PENDING_MERGE_SIZE, BANDS), dtype=np.uint64)
+        self.pending_owners = np.zeros(PENDING_MERGE_SIZE, dtype=np.uint64)
+        self.pending_kinds = np.zeros(PENDING_MERGE_SIZE, dtype=np.uint8)
+        self.pending_count = 0
+        self.seen = set()
+
+    def __len__(self):
+        return len(self.owners) + self.pending_count
+
+    def add(self, signature: np.ndarray, keys: np.ndarray, owner: int, kind: int) -> None:
+        i = self.pending_count
+        self.pending_signatures[i] = signature
+        self.pending_keys[i] = keys
+        self.pending_owners[i] = owner
+        self.pending_kinds[i] = kind
+        self.pending_count += 1
+        if self.pending_count == PENDING_MERGE_SIZE:
+            self.merge()
+
+    def merge(self) -> None:
+        # Only the pending chunk is sorted; it is then spliced into each band's sorted keys
+        n = self.pending_count
+        if not n:
+            return
+        start = len(self.owners)
+        self.signatures = np.concatenate([self.signatures, self.pending_signatures[:n]])
+        self.owners = np.concatenate([self.owners, self.pending_owners[:n]])
+        self.kinds = np.concatenate([self.kinds, self.pending_kinds[:n]])
+        new_keys = self.pending_keys[:n].T
+        new_order = np.argsort(new_keys, axis=1, kind='stable')
+        new_sorted = np.take_along_axis(new_keys, new_order, axis=1)
+        sorted_keys = np.empty((BANDS, start + n), dtype=np.uint64)
+        order = np.empty((BANDS, start + n), dtype=np.int32)
+        for band in range(BANDS):
+            positions = np.searchsorted(self.sorted_keys[band], new_sorted[band], side='right')
+            sorted_keys[band] = np.insert(self.sorted_keys[band], positions, new_sorted[band])
+            order[band] = np.insert(self.order[band], positions, new_order[band] + start)
+        self.sorted_keys = sorted_keys
+        self.order = order
+        self.pending_count = 0
+
+    def candidates(self, keys: np.ndarray):
+        # Returns (signatures, owners, kinds) of documents sharing at least one band with `keys`
+        ids = []
+        for band in range(BANDS):
+            lo = np.searchsorted(self.sorted_keys[band], keys[band], side='left')
+            hi = np.searchsorted(self.sorted_keys[band], keys[band], side='right')
+            if hi > lo:
+                ids.append(self.order[band, lo:hi])
+        results = []
+        if ids:
+            ids = np.unique(np.concatenate(ids))
+            results.append((self.signatures[ids], self.owners[ids], self.kinds[ids]))
+        n = self.pending_count
+        if n:
+            matches = np.flatnonzero((self.pending_keys[:n] == keys).any(axis=1))
+            if len(matches):
+                results.append((self.pending_signatures[matches], self.pending_owners[matches],
+                                self.pending_kinds[matches]))
+        return results
+
+    def save(self, path: str) -> None:
+        self.merge()
+        os.makedirs(path, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+        np.save(os.path.join(path, 'seen.npy'), np.fromiter(self.seen, dtype=np.uint64, count=len(self.seen)))
+
+    @classmethod
+    def load(cls, path: str, window: int, mmap: bool) -> '_Shard':
+        shard = cls(window)
+        for name in cls.ARRAYS:
+            setattr(shard, name, np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r' if mmap else None))
+        seen_path = os.path.join(path, 'seen.npy')
+        if os.path.exists(seen_path):
+            shard.seen = set(np.load(seen_path).tolist())
+        return shard
+
+class NearDuplicateIndex:
+    # MinHash LSH over bios and posts, sharded by time window so memory stays bounded:
+    # the oldest window is dropped once there are too many windows or documents.
+    def __init__(self, path: str = NEAR_DUPLICATE_INDEX_PATH, window_seconds: int = NEAR_DUPLICATE_WINDOW_SECONDS,
+                 max_shards: int = NEAR_DUPLICATE_MAX_SHARDS, max_docs: int = NEAR_DUPLICATE_MAX_DOCS,
+                 threshold: float = NEAR_DUPLICATE_THRESHOLD):
+        self.path = path
+        self.window_seconds = window_seconds
+        self.max_shards = max_shards
+        self.max_docs = max_docs
+        self.threshold = threshold
+        self.shards: Dict[int, _Shard] = {}
+        self._version = 0
+        self._lock = threading.RLock()
+
+    def _similarities(self, signature: np.ndarray, owner: int, kind: Optional[int] = None) -> np.ndarray:
+        keys = band_keys(signature[np.newaxis])[0]
+        similarities = []
+        with self._lock:
+            for shard in self.shards.values():
+                for signatures, owners, kinds in shard.candidates(keys):
+                    mask = owners != owner
+                    if kind is not None:
+                        mask &= kinds == kind
+                    if mask.any():
+                        similarities.append((signatures[mask] == signature).mean(axis=1))
+        return np.concatenate(similarities) if similarities else np.zeros(0)
+
+    def query_profile(self, profile_key: Optional[str], bio: str, posts: List[str]) -> Dict[str, float]:
+        owner = owner_id(profile_key)
+
+        max_bio_similarity = 0.0
+        bio_signature = minhash(bio or '')
+        if bio_signature is not None:
+            similarities = self._similarities(bio_signature, owner, KIND_BIO)
+            if len(similarities):
+                max_bio_similarity = float(similarities.max())
+
+        duplicated_posts = 0
+        for post in posts:
+            signature = minhash(post)
+            if signature is None:
+                continue
+            similarities = self._similarities(signature, owner)
+            if len(similarities) and similarities.max() >= self.threshold:
+                duplicated_posts += 1
+
+        return {
+            'near_duplicate_post_ratio': duplicated_posts / len(posts) if posts else 0.0,
+            'max_bio_similarity': max_bio_similarity,
+        }
+
+    def add_profile(self, profile_key: Optional[str], bio: str, posts: List[str], timestamp: float = None) -> None:
+        # Profiles without a key could never be told apart from each other, so they are not indexed
+        if not profile_key:
+            return
+        owner = owner_id(profile_key)
+        window = int((timestamp or time.time()) // self.window_seconds)
+        with self._lock:
+            shard = self.shards.get(window)
+            if shard is None:
+                shard = self.shards[window] = _Shard(window)
+            for kind, text in [(KIND_BIO, bio or '')] + [(KIND_POST, post) for post in posts]:
+                # Skip documents this profile already contributed to the window
+                seen_key = owner_id(f'{owner}:{kind}:{text}')
+                if seen_key in shard.seen:
+                    continue
+                signature = minhash(text)
+                if signature is not None:
+                    shard.add(signature, band_keys(signature[np.newaxis])[0], owner, kind)
+                    shard.seen.add(seen_key)
+            self._evict()
+
+    def _evict(self) -> None:
+        while len(self.shards) > 1 and (len(self.shards) > self.max_shards or
+                                        sum(len(shard) for shard in self.shards.values()) > self.max_docs):
+            del self.shards[min(self.shards)]
+
+    def save(self, path: str = None) -> None:
+        # Writes the shards to a new version directory, then swaps the manifest to it, so a
+        # crash mid-save leaves the previous version loadable
+        path = path or self.path
+        with self._lock:
+            self._version += 1
+            name = f'v{self._version:08d}'
+            tmp = os.path.join(path, f'{name}.tmp')
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            for window, shard in self.shards.items():
+                shard.save(os.path.join(tmp, str(window)))
+            os.replace(tmp, os.path.join(path, name))
+            manifest = {'version': name, 'windows': sorted(self.shards)}
+            with open(os.path.join(path, 'manifest.json.tmp'), 'w') as f:
+                json.dump(manifest, f)
+            os.replace(os.path.join(path, 'manifest.json.tmp'), os.path.join(path, 'manifest.json'))
+            for entry in os.listdir(path):
+                if entry not in ('manifest.json', name):
+                    shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str = NEAR_DUPLICATE_INDEX_PATH, **kwargs) -> 'NearDuplicateIndex':
+        index = cls(path, **kwargs)
+        manifest_path = os.path.join(path, 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            shard_path = os.path.join(path, manifest['version'])
+            windows = manifest['windows']
+            index._version = int(manifest['version'][1:])
+        elif os.path.isdir(path):
+            # Layout written before versioned saves: one directory per window
+            shard_path = path
+            windows = sorted(int(name) for name in os.listdir(path) if name.isdigit())
+        else:
+            return index
+        current = int(time.time() // index.window_seconds)
+        for window in windows:
+            # Past windows never change, so they are memory-mapped read-only
+            index.shards[window] = _Shard.load(os.path.join(shard_path, str(window)), window, mmap=window < current)
+        index._evict()
+        return index
+
+near_duplicate_index = NearDuplicateIndex.load()
@@ -1,40 +1,83 @@
-from typing import Dict, List, Any, Union
-import networkx as nx
+from typing import Dict, List, Any, Optional, Union
+from . import centrality
+from .feature_registry import feature_registry
+from .graph_store import EgoGraph, graph_store, NETWORK_EGO_RADIUS
+
+feature_registry.register('network', ['follower_following_ratio', 'degree_centrality', 'betweenness_centrality',
+                                      'closeness_centrality', 'clustering_coefficient'])
 
 def calculate_follower_following_ratio(followers: int, following: int) -> float:
     if following == 0:
         return float('inf')  # or a large number like 1000000
     return followers / following
 
-def calculate_network_centrality(G: nx.Graph, node: Any) -> Dict[str, float]:
-    degree_centrality = nx.degree_centrality(G)[node]
-    betweenness_centrality = nx.betweenness_centrality(G)[node]
-    closeness_centrality = nx.closeness_centrality(G)[node]
+def calculate_network_centrality(ego: EgoGraph, node: int = 0) -> Dict[str, float]:
+    # Single-node routines on the ego subgraph; betweenness is a sampled estimate and
+    # `betweenness_error` its Hoeffding bound (0 when computed exactly)
+    degree_centrality = centrality.degree_centrality(ego.indptr, ego.indices, node)
+    betweenness_centrality, betweenness_error = centrality.betweenness_centrality(ego.indptr, ego.indices, node)
+    closeness_centrality = centrality.closeness_centrality(ego.indptr, ego.indices, node)
     
     return {
         'degree_centrality': degree_centrality,
         'betweenness_centrality': betweenness_centrality,
+        'betweenness_error': betweenness_error,
         'closeness_centrality': closeness_centrality
     }
 
-def calculate_clustering_coefficient(G: nx.Graph, node: Any) -> float:
-    return nx.clustering(G, node)
+def calculate_clustering_coefficient(ego: EgoGraph, node: int = 0) -> float:
+    return centrality.clustering_coefficient(ego.indptr, ego.indices, node)
 
-def extract_network_features(user_id: str, followers: int, following: int, connections: List[str]) -> Dict[str, float]:
-    G = nx.Graph()
-    
-    # Add nodes and edges based on the user's connections
-    for connection in connections:
-        G.add_edge(user_id, connection)
-    
+def user_ego_graph(user_id: str, connections: List[str], store=graph_store,
+                   radius: int = NETWORK_EGO_RADIUS) -> Optional[EgoGraph]:
+    # Records the user's connections in the global graph, then cuts out their neighbourhood
+    if connections:
+        store.add_edges(str(user_id), [str(connection) for connection in connections])
+    return store.ego_subgraph(str(user_id), radius)
+
+def ego_network_features(ego: Optional[EgoGraph], followers: int, following: int) -> Dict[str, float]:
+    # Centralities of the ego's centre (local node 0) within its neighbourhood of the global graph
     follower_following_ratio = calculate_follower_following_ratio(followers, following)
-    centrality_measures = calculate_network_centrality(G, user_id)
-    clustering_coeff = calculate_clustering_coefficient(G, user_id)
+    if ego is None or ego.num_nodes < 2:
+        return {
+            'follower_following_ratio': follower_following_ratio,
+            'degree_centrality': 0.0,
+            'betweenness_centrality': 0.0,
+            'betweenness_error': 0.0,
+            'closeness_centrality': 0.0,
+            'clustering_coefficient': 0.0
+        }
+
+    # betweenness_error has no model column; it is kept in the analysis metadata (and on the
+    # user document) so an estimate can be told from an exact value
+    centrality_measures = calculate_network_centrality(ego, 0)
+    clustering_coeff = calculate_clustering_coefficient(ego, 0)
     
     return {
         'follower_following_ratio': follower_following_ratio,
         'degree_centrality': centrality_measures['degree_centrality'],
         'betweenness_centrality': centrality_measures['betweenness_centrality'],
+        'betweenness_error': centrality_measures['betweenness_error'],
         'closeness_centrality': centrality_measures['closeness_centrality'],
         'clustering_coefficient': clustering_coeff
     }
+
+def profile_network_features(profile_key: Optional[str], connections: List[str], followers: int,
+                             following: int) -> Dict[str, float]:
+    # The network stage, run in a worker process: the worker's graph store follows the one the
+    # serving process writes (saved CSR memory-mapped, newer edges replayed from the log) and the
+    # ego is cut there, with the profile's connections joined to it for this cut only
+    graph_store.refresh()
+    ego = graph_store.ego_subgraph(profile_key, extra_neighbors=[str(connection) for connection in connections])
+    return ego_network_features(ego, followers, following)
+
+def extract_network_features(user_id: str, followers: int, following: int, connections: List[str]) -> Dict[str, float]:
+    return ego_network_features(user_ego_graph(user_id, connections), followers, following)
+
+def stored_network_features(items: List[tuple]) -> List[Dict[str, float]]:
+    # (node key, followers, following) per stored node, run a chunk at a time in a long-lived
+    # worker process: its graph store follows the serving one and each ego is cut there and
+    # dropped before the next, so only keys and counts cross the process boundary
+    graph_store.refresh()
+    return [ego_network_features(graph_store.ego_subgraph(key), followers, following)
+            for key, followers, following in items]
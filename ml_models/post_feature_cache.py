@@ -0,0 +1,87 @@
+from typing import Any, Dict, Iterable
+from collections import OrderedDict
+import json
+import logging
+import os
+import threading
+from redis import Redis, RedisError
+
+POST_FEATURE_CACHE_SIZE = int(os.getenv('POST_FEATURE_CACHE_SIZE', 100000))
+POST_FEATURE_CACHE_TTL = int(os.getenv('POST_FEATURE_CACHE_TTL', 7 * 24 * 3600))  # seconds
+# Bump when the per-post feature computation changes so stale Redis entries are ignored
+# (2: entries are JSON; version 1 entries were pickles and are never read)
+POST_FEATURE_CACHE_VERSION = os.getenv('POST_FEATURE_CACHE_VERSION', '2')
+# Seconds a Redis call may take before the cache falls back to its in-process LRU
+POST_FEATURE_CACHE_REDIS_TIMEOUT = float(os.getenv('POST_FEATURE_CACHE_REDIS_TIMEOUT', 0.2))
+
+logger = logging.getLogger(__name__)
+
+class PostFeatureCache:
+    # Two-level cache of per-post text features keyed by content hash:
+    # an in-process LRU in front of a shared Redis store. Entries are plain dicts of counts,
+    # scores and lists stored as JSON, so nothing read back from Redis is ever executed.
+    def __init__(self, redis_client: Redis = None, max_entries: int = POST_FEATURE_CACHE_SIZE,
+                 ttl: int = POST_FEATURE_CACHE_TTL, version: str = POST_FEATURE_CACHE_VERSION):
+        self.redis_client = redis_client
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.prefix = f"post_features:v{version}:"
+        self._lru: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _put_local(self, key: str, entry: Dict[str, Any]) -> None:
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                entry = self._lru.get(key)
+                if entry is None:
+                    missing.append(key)
+                else:
+                    self._lru.move_to_end(key)
+                    found[key] = entry
+
+        if missing and self.redis_client is not None:
+            try:
+                values = self.redis_client.mget([self.prefix + key for key in missing])
+            except RedisError:
+                logger.warning("Post feature cache read failed; using the local cache only", exc_info=True)
+                values = []
+            with self._lock:
+                for key, value in zip(missing, values):
+                    if value is None:
+                        continue
+                    try:
+                        entry = json.loads(value)
+                    except ValueError:
+                        continue  # unreadable entry: recomputed and overwritten as a miss
+                    if isinstance(entry, dict):
+                        self._put_local(key, entry)
+                        found[key] = entry
+        return found
+
+    def put_many(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        if not entries:
+            return
+        with self._lock:
+            for key, entry in entries.items():
+                self._put_local(key, entry)
+
+        if self.redis_client is not None:
+            try:
+                pipeline = self.redis_client.pipeline(transaction=False)
+                for key, entry in entries.items():
+                    pipeline.setex(self.prefix + key, self.ttl, json.dumps(entry))
+                pipeline.execute()
+            except RedisError:
+                logger.warning("Post feature cache write failed; entries kept locally only", exc_info=True)
+
+post_feature_cache = PostFeatureCache(Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'),
+                                                     socket_timeout=POST_FEATURE_CACHE_REDIS_TIMEOUT,
+                                                     socket_connect_timeout=POST_FEATURE_CACHE_REDIS_TIMEOUT))
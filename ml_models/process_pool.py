@@ -0,0 +1,18 @@
+from typing import Callable, Optional
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+def spawn_pool(workers: int, initializer: Optional[Callable[[], None]] = None) -> ProcessPoolExecutor:
+    # spawn: forking a process that already holds TensorFlow/BLAS threads is unsafe
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=initializer)
+
+def kill_pool(pool: ProcessPoolExecutor) -> None:
+    # Cancelling a future cannot stop a task a worker is already running; a hung call (a dlib
+    # or PIL edge case, a runaway graph stage) would hold that worker forever. Terminating
+    # the workers frees them; futures still pending in this pool fail with BrokenProcessPool.
+    processes = list((getattr(pool, '_processes', None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
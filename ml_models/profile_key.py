@@ -0,0 +1,18 @@
+from typing import Any, Dict, Optional
+import hashlib
+
+# Identity of an analysed or collected profile. Every index and the social graph key
+# profiles by this, on the live path and in their rebuild CLIs alike.
+
+def get_profile_key(user_data: Dict[str, Any]) -> Optional[str]:
+    # Stored analyses carry the key they were indexed under; submitted and collected profiles
+    # are keyed by URL, then handle. Profiles with neither are analysed but never indexed, so
+    # anonymous submissions are not merged into one owner.
+    key = user_data.get('profile_key') or user_data.get('profile_url') or user_data.get('username')
+    return str(key) if key else None
+
+def owner_id(profile_key: Optional[str]) -> int:
+    # 64-bit owner id stored in the indexes; 0 (no profile key) matches no stored owner
+    if not profile_key:
+        return 0
+    return int.from_bytes(hashlib.blake2b(profile_key.encode('utf-8'), digest_size=8).digest(), 'little')
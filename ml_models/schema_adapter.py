@@ -0,0 +1,157 @@
+from collections.abc import Mapping
+from typing import Any, Dict, List, Optional, Sequence
+import json
+import os
+import numpy as np
+from .feature_vector import FEATURE_SCHEMA, FeatureSchema, FeatureVector, is_numeric
+
+# Versioned input schemas are stored next to the joblib model artifacts
+FEATURE_SCHEMA_DIR = os.getenv('FEATURE_SCHEMA_DIR', '.')
+FEATURE_SCHEMA_FILE = 'feature_schema_v{version}.json'
+
+# Replaces the infinite follower/following ratio of accounts that follow nobody
+FOLLOWER_RATIO_CAP = 1e6
+
+# Declared values for features a profile does not have (no pictures, no posts, a failed
+# stage); anything not listed defaults to 0. Per-image features are declared by base name.
+FEATURE_DEFAULTS = {
+    'min_hamming_distance': 64.0,  # no reused picture within the hash length
+    'min_face_distance': 1.0,  # face_index.FACE_NO_MATCH_DISTANCE
+    'avg_profile_pic_score': 0.5,
+    'profile_pic_score': 0.5,
+}
+# Values that replace +inf / -inf; by default they are coerced to the feature's default
+FEATURE_POSINF = {
+    'follower_following_ratio': FOLLOWER_RATIO_CAP,
+}
+FEATURE_NEGINF: Dict[str, float] = {}
+
+def _declared(table: Dict[str, float], name: str, fallback: float) -> float:
+    if name in table:
+        return table[name]
+    base, _, suffix = name.rpartition('_')
+    if suffix.isdigit() and base in table:
+        return table[base]
+    return fallback
+
+def schema_path(version: Any, directory: str = FEATURE_SCHEMA_DIR) -> str:
+    return os.path.join(directory, FEATURE_SCHEMA_FILE.format(version=version))
+
+class SchemaAdapter:
+    # Maps FeatureVectors (or plain feature dicts) to a model's float32 input matrix. The
+    # model's feature names are resolved to schema columns once; a batch is then filled row
+    # by row with array gathers, missing features take their declared default and nan/inf
+    # are coerced per feature.
+    def __init__(self, feature_names: Sequence[str], defaults: Optional[Dict[str, float]] = None,
+                 posinf: Optional[Dict[str, float]] = None, neginf: Optional[Dict[str, float]] = None,
+                 version: Any = None, schema: FeatureSchema = FEATURE_SCHEMA):
+        self.feature_names = list(feature_names)
+        self.version = version
+        self.schema = schema
+        defaults = defaults or {}
+        posinf = posinf or {}
+        neginf = neginf or {}
+        self.defaults = np.array([defaults.get(name, _declared(FEATURE_DEFAULTS, name, 0.0))
+                                  for name in self.feature_names], dtype=np.float32)
+        self.posinf = np.array([posinf.get(name, _declared(FEATURE_POSINF, name, default))
+                                for name, default in zip(self.feature_names, self.defaults)], dtype=np.float32)
+        self.neginf = np.array([neginf.get(name, _declared(FEATURE_NEGINF, name, default))
+                                for name, default in zip(self.feature_names, self.defaults)], dtype=np.float32)
+
+        columns = schema.columns(self.feature_names)
+        self._known = np.flatnonzero(columns >= 0)
+        self._known_columns = columns[self._known]
+        # Names outside the schema can only be found in a vector's metadata
+        self._extra = [(j, self.feature_names[j]) for j in np.flatnonzero(columns < 0)]
+
+    def __len__(self) -> int:
+        return len(self.feature_names)
+
+    def transform(self, vectors: Sequence[Mapping], out: Optional[np.ndarray] = None) -> np.ndarray:
+        n = len(vectors)
+        if out is None:
+            out = np.empty((n, len(self.feature_names)), dtype=np.float32)
+        known, known_columns = self._known, self._known_columns
+        for i, vector in enumerate(vectors):
+            if not isinstance(vector, FeatureVector):
+                vector = FeatureVector.from_dict(vector, self.schema)
+            row = out[i]
+            row[known] = vector.values[known_columns]
+            missing = known[~vector.present[known_columns]]
+            row[missing] = self.defaults[missing]
+            for j, name in self._extra:
+                value = vector.metadata.get(name)
+                row[j] = value if is_numeric(value) else self.defaults[j]
+
+        # Per-feature coercion over the whole batch
+        nan, pos, neg = np.isnan(out), np.isposinf(out), np.isneginf(out)
+        if nan.any():
+            out[nan] = np.broadcast_to(self.defaults, out.shape)[nan]
+        if pos.any():
+            out[pos] = np.broadcast_to(self.posinf, out.shape)[pos]
+        if neg.any():
+            out[neg] = np.broadcast_to(self.neginf, out.shape)[neg]
+        return out
+
+    def transform_one(self, vector: Mapping) -> np.ndarray:
+        return self.transform([vector])
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'version': self.version,
+            'feature_schema': self.schema.version,
+            'features': [
+                {'name': name, 'default': float(default), 'posinf': float(pos), 'neginf': float(neg)}
+                for name, default, pos, neg in zip(self.feature_names, self.defaults, self.posinf, self.neginf)
+            ],
+        }
+
+    def save(self, path: str = None) -> str:
+        path = path or schema_path(self.version)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(self.to_json(), f, indent=2)
+        os.replace(f'{path}.tmp', path)
+        return path
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any], schema: FeatureSchema = FEATURE_SCHEMA) -> 'SchemaAdapter':
+        features = data['features']
+        return cls(
+            [feature['name'] for feature in features],
+            defaults={feature['name']: feature['default'] for feature in features},
+            posinf={feature['name']: feature['posinf'] for feature in features},
+            neginf={feature['name']: feature['neginf'] for feature in features},
+            version=data.get('version'),
+            schema=schema,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> 'SchemaAdapter':
+        with open(path) as f:
+            return cls.from_json(json.load(f))
+
+def load_schema_adapter(model: Any, version: Any = None, directory: str = FEATURE_SCHEMA_DIR) -> SchemaAdapter:
+    # Attaches the model's adapter as `schema_adapter_`: the versioned schema file when it
+    # exists, otherwise one compiled from `model.feature_names_` with the declared defaults
+    path = schema_path(version, directory) if version is not None else None
+    if path and os.path.exists(path):
+        adapter = SchemaAdapter.load(path)
+    else:
+        adapter = SchemaAdapter(model.feature_names_, version=version)
+    model.schema_adapter_ = adapter
+    return adapter
+
+def schema_adapter_for(model: Any) -> SchemaAdapter:
+    adapter = getattr(model, 'schema_adapter_', None)
+    return adapter if adapter is not None else load_schema_adapter(model)
+
+def schema_feature_names(feature_df: Any, schema: FeatureSchema = FEATURE_SCHEMA) -> List[str]:
+    # Model input columns of a training frame: numeric features with a schema column. Metadata
+    # (hashes, camera make) and string columns that came along with the feature dicts are left out.
+    return [name for name in feature_df.columns
+            if name in schema.index and np.issubdtype(feature_df[name].dtype, np.number)]
+
+def save_schema(feature_names: Sequence[str], version: Any, directory: str = FEATURE_SCHEMA_DIR) -> SchemaAdapter:
+    adapter = SchemaAdapter(feature_names, version=version)
+    adapter.save(schema_path(version, directory))
+    return adapter
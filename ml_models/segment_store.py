@@ -0,0 +1,119 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type
+import json
+import os
+import shutil
+import numpy as np
+
+# Shared storage for the image hash and face indexes: immutable segments of .npy arrays,
+# memory-mapped once sealed, listed in a manifest that is swapped atomically on save.
+
+def compaction_run(sizes: Sequence[int], max_segments: int) -> int:
+    # How many of the newest segments to merge: the longest run whose older segments are no
+    # larger than everything newer in the run, so equal-sized segments merge like a binary
+    # counter and each entry is rewritten O(log n) times rather than on every compaction
+    total, count = sizes[-1], 1
+    for size in reversed(sizes[:-1]):
+        if size > total:
+            break
+        total += size
+        count += 1
+    return max(count, len(sizes) - max_segments + 1)
+
+class ArraySegment:
+    # Base for immutable segments: the arrays named in ARRAYS are saved as .npy files; an
+    # array that is None is left out and loads back as None
+    ARRAYS: Tuple[str, ...] = ()
+
+    def __len__(self):
+        return len(self.owners)
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        for name in self.ARRAYS:
+            value = getattr(self, name)
+            if value is not None:
+                np.save(os.path.join(path, f'{name}.npy'), value)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        arrays = {}
+        for name in cls.ARRAYS:
+            file_path = os.path.join(path, f'{name}.npy')
+            arrays[name] = np.load(file_path, mmap_mode='r' if mmap else None) if os.path.exists(file_path) else None
+        return cls(**arrays)
+
+class SegmentStore:
+    # Ordered segments (oldest first) under zero-padded names that only ever increase
+    def __init__(self, segment_cls: Type[ArraySegment], max_segments: int):
+        self.segment_cls = segment_cls
+        self.max_segments = max_segments
+        self.segments: Dict[str, ArraySegment] = {}
+        self.next_segment = 0
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments.values())
+
+    def values(self) -> List[ArraySegment]:
+        return list(self.segments.values())
+
+    def _name(self) -> str:
+        name = f'{self.next_segment:08d}'
+        self.next_segment += 1
+        return name
+
+    def add(self, segment: ArraySegment, merge: Callable[[List[ArraySegment]], ArraySegment]) -> None:
+        # Appends a sealed segment, then merges the newest run of comparable sizes
+        self.segments[self._name()] = segment
+        count = compaction_run([len(s) for s in self.segments.values()], self.max_segments)
+        if count > 1:
+            names = list(self.segments)[-count:]
+            merged = merge([self.segments.pop(name) for name in names])
+            self.segments[self._name()] = merged
+
+    def replace_all(self, segment: Optional[ArraySegment]) -> None:
+        self.segments = {}
+        if segment is not None and len(segment):
+            self.segments[self._name()] = segment
+
+    def save(self, path: str, arrays: Optional[Dict[str, np.ndarray]] = None, meta: Optional[Dict[str, Any]] = None) -> None:
+        # Segments are immutable, so only ones missing on disk are written. Side arrays (e.g.
+        # centroids) get a file per save, so the manifest never points at a mix of versions.
+        os.makedirs(path, exist_ok=True)
+        for name, segment in self.segments.items():
+            if not os.path.isdir(os.path.join(path, name)):
+                segment.save(os.path.join(path, f'{name}.tmp'))
+                os.replace(os.path.join(path, f'{name}.tmp'), os.path.join(path, name))
+        files = {}
+        for key, value in (arrays or {}).items():
+            if value is not None:
+                files[key] = f'{key}-{self.next_segment:08d}.npy'
+                np.save(os.path.join(path, files[key]), value)
+        manifest = {'segments': list(self.segments), 'next_segment': self.next_segment,
+                    'arrays': files, 'meta': meta or {}}
+        with open(os.path.join(path, 'manifest.json.tmp'), 'w') as f:
+            json.dump(manifest, f)
+        os.replace(os.path.join(path, 'manifest.json.tmp'), os.path.join(path, 'manifest.json'))
+        keep = {'manifest.json'} | set(self.segments) | set(files.values())
+        for entry in os.listdir(path):
+            if entry not in keep:
+                target = os.path.join(path, entry)
+                if os.path.isdir(target):
+                    shutil.rmtree(target, ignore_errors=True)
+                else:
+                    os.remove(target)
+
+    def load(self, path: str) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+        # Returns the side arrays and metadata saved with the segments
+        manifest_path = os.path.join(path, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            return {}, {}
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        for name in manifest['segments']:
+            self.segments[name] = self.segment_cls.load(os.path.join(path, name))
+        self.next_segment = manifest['next_segment']
+        arrays = {key: np.load(os.path.join(path, file)) for key, file in manifest.get('arrays', {}).items()}
+        # Face indexes saved before side arrays were versioned kept their centroids here
+        if 'centroids' not in arrays and os.path.exists(os.path.join(path, 'centroids.npy')):
+            arrays['centroids'] = np.load(os.path.join(path, 'centroids.npy'))
+        return arrays, manifest.get('meta', {})
@@ -0,0 +1,95 @@
+from typing import Dict, Iterable, Set, Tuple
+import os
+import re
+import joblib
+import textblob
+
+SPELLING_INDEX_PATH = os.getenv('SPELLING_INDEX_PATH', 'spelling_index.joblib')
+SPELLING_MAX_EDIT_DISTANCE = int(os.getenv('SPELLING_MAX_EDIT_DISTANCE', 1))
+
+# Same word-frequency list TextBlob.correct() uses
+DEFAULT_FREQUENCY_PATH = os.path.join(os.path.dirname(textblob.__file__), 'en', 'en-spelling.txt')
+
+URL_MENTION_RE = re.compile(r"https?://\S+|www\.\S+|[@#]\w+")
+WORD_RE = re.compile(r"[a-z]+(?:'[a-z]+)?")
+
+_spelling_counter = None
+
+def load_word_frequencies(path: str = DEFAULT_FREQUENCY_PATH) -> Dict[str, int]:
+    frequencies = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 2 or line.startswith(';;;'):
+                continue
+            frequencies[parts[0].lower()] = frequencies.get(parts[0].lower(), 0) + int(parts[1])
+    return frequencies
+
+def deletes(word: str, max_distance: int) -> Set[str]:
+    results = set()
+    frontier = {word}
+    for _ in range(max_distance):
+        next_frontier = set()
+        for w in frontier:
+            if len(w) > 1:
+                for i in range(len(w)):
+                    next_frontier.add(w[:i] + w[i + 1:])
+        results |= next_frontier
+        frontier = next_frontier
+    return results
+
+def tokenize(text: str) -> Iterable[str]:
+    return WORD_RE.findall(URL_MENTION_RE.sub(' ', text.lower()))
+
+class SpellingErrorCounter:
+    # Symmetric-delete index: a token is within max_edit_distance of a known word when
+    # the token or one of its deletes matches the word or one of the word's deletes.
+    def __init__(self, frequencies: Dict[str, int], max_edit_distance: int = SPELLING_MAX_EDIT_DISTANCE,
+                 min_frequency: int = 1):
+        self.max_edit_distance = max_edit_distance
+        self.words = frozenset(w for w, count in frequencies.items() if count >= min_frequency)
+        delete_index = set()
+        for word in self.words:
+            delete_index |= deletes(word, max_edit_distance)
+        self.delete_index = frozenset(delete_index)
+
+    def is_likely_misspelling(self, token: str) -> bool:
+        if token in self.delete_index:
+            return True
+        for variant in deletes(token, self.max_edit_distance):
+            if variant in self.words or variant in self.delete_index:
+                return True
+        return False
+
+    def count(self, text: str) -> Tuple[int, int]:
+        # Returns (likely misspelled tokens, other out-of-vocabulary tokens)
+        misspelled = 0
+        oov = 0
+        for token in tokenize(text):
+            if token in self.words or len(token) < 2:
+                continue
+            if self.is_likely_misspelling(token):
+                misspelled += 1
+            else:
+                oov += 1
+        return misspelled, oov
+
+def build_spelling_counter(frequency_path: str = DEFAULT_FREQUENCY_PATH, path: str = SPELLING_INDEX_PATH,
+                           max_edit_distance: int = SPELLING_MAX_EDIT_DISTANCE) -> SpellingErrorCounter:
+    global _spelling_counter
+    counter = SpellingErrorCounter(load_word_frequencies(frequency_path), max_edit_distance)
+    joblib.dump(counter, path)
+    _spelling_counter = counter
+    return counter
+
+def load_spelling_counter(path: str = SPELLING_INDEX_PATH) -> SpellingErrorCounter:
+    global _spelling_counter
+    if _spelling_counter is None:
+        if os.path.exists(path):
+            _spelling_counter = joblib.load(path)
+        else:
+            _spelling_counter = build_spelling_counter(path=path)
+    return _spelling_counter
+
+def count_spelling_errors(text: str) -> Tuple[int, int]:
+    return load_spelling_counter().count(text)
@@ -0,0 +1,196 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import os
+import threading
+import time
+import numpy as np
+from .process_pool import kill_pool, spawn_pool
+
+STAGE_THREAD_WORKERS = int(os.getenv('STAGE_THREAD_WORKERS', 16))
+STAGE_PROCESS_WORKERS = int(os.getenv('STAGE_PROCESS_WORKERS', 2))
+# Thread stages of one name that may be running or queued at once, counting ones that
+# missed their deadline and are still finishing in the background; past it the stage is shed
+STAGE_MAX_INFLIGHT = int(os.getenv('STAGE_MAX_INFLIGHT', 4))
+# Seconds each feature stage may take, measured from its submission, so time spent queued
+# for a worker counts; override one with STAGE_DEADLINE_<NAME>, e.g. STAGE_DEADLINE_IMAGES=20
+STAGE_DEADLINES = {
+    'text': 5.0,
+    'near_duplicate': 1.0,
+    'images': 15.0,
+    'network': 2.0,
+    'temporal': 1.0,
+}
+STAGE_DEFAULT_DEADLINE = 5.0
+
+logger = logging.getLogger(__name__)
+
+def stage_deadline(name: str) -> float:
+    return float(os.getenv(f'STAGE_DEADLINE_{name.upper()}', STAGE_DEADLINES.get(name, STAGE_DEFAULT_DEADLINE)))
+
+class Stage:
+    # One independent unit of feature extraction. 'thread' stages suit work that releases
+    # the GIL (native code, I/O, waiting on other pools); 'process' stages suit pure-Python
+    # CPU work and need a picklable, module-level `fn` and arguments.
+    def __init__(self, name: str, fn: Callable[..., Any], args: Sequence[Any] = (), kind: str = 'thread',
+                 deadline: Optional[float] = None, fallback: Any = None):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unsupported stage kind: {kind}")
+        self.name = name
+        self.fn = fn
+        self.args = tuple(args)
+        self.kind = kind
+        self.deadline = stage_deadline(name) if deadline is None else deadline
+        self.fallback = fallback
+
+class StageRun:
+    def __init__(self):
+        self.results: Dict[str, Any] = {}
+        self.timings_ms: Dict[str, float] = {}
+        # Stages that yielded their fallback: missed the deadline, were shed or lost their worker
+        self.timed_out: List[str] = []
+        self.shed: List[str] = []
+
+class StageExecutor:
+    # Starts every stage at once and collects each against its own deadline, so a run takes
+    # about as long as its slowest stage. A stage that misses its deadline yields its fallback
+    # and is reported in `timed_out`. A running process stage is stopped by recycling the
+    # process pool; a thread stage cannot be interrupted and finishes in the background with
+    # its result discarded, so at most `max_inflight` of one name are let into the thread pool
+    # and further ones are shed rather than queued behind them. Exceptions raised by a stage
+    # propagate.
+    def __init__(self, thread_workers: int = STAGE_THREAD_WORKERS, process_workers: int = STAGE_PROCESS_WORKERS,
+                 max_inflight: int = STAGE_MAX_INFLIGHT, metrics_window: int = 1000):
+        self.threads = ThreadPoolExecutor(max_workers=thread_workers, thread_name_prefix='feature-stage')
+        self.process_workers = process_workers
+        self.max_inflight = max_inflight
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, int] = {}
+
+        self._metrics_lock = threading.Lock()
+        self._metrics_window = metrics_window
+        self._runs: Dict[str, int] = {}
+        self._deadlines: Dict[str, float] = {}
+        self._timeouts: Dict[str, int] = {}
+        self._shed: Dict[str, int] = {}
+        self._timings: Dict[str, deque] = {}
+
+    def _get_processes(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._processes is None:
+                self._processes = spawn_pool(self.process_workers)
+            return self._processes
+
+    def _reset_processes(self, broken: ProcessPoolExecutor, kill: bool = False) -> None:
+        # kill: terminate workers still running a stage, whose futures cannot be cancelled
+        with self._lock:
+            if self._processes is broken:
+                self._processes = None
+        if kill:
+            kill_pool(broken)
+        else:
+            broken.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, name: str) -> None:
+        with self._lock:
+            self._inflight[name] -= 1
+
+    def _submit(self, stage: Stage):
+        # (future, process pool or None); (None, None) when the stage is shed
+        if stage.kind == 'thread':
+            with self._lock:
+                if self._inflight.get(stage.name, 0) >= self.max_inflight:
+                    return None, None
+                self._inflight[stage.name] = self._inflight.get(stage.name, 0) + 1
+            try:
+                future = self.threads.submit(stage.fn, *stage.args)
+            except BaseException:
+                self._release(stage.name)
+                raise
+            future.add_done_callback(lambda _, name=stage.name: self._release(name))
+            return future, None
+        pool = self._get_processes()
+        try:
+            return pool.submit(stage.fn, *stage.args), pool
+        except BrokenProcessPool:
+            self._reset_processes(pool)
+            pool = self._get_processes()
+            return pool.submit(stage.fn, *stage.args), pool
+
+    def run(self, stages: Sequence[Stage]) -> StageRun:
+        run = StageRun()
+        finished: Dict[str, float] = {}
+        futures = []
+        for stage in stages:
+            submitted = time.perf_counter()
+            future, pool = self._submit(stage)
+            if future is None:
+                logger.warning("Feature stage %s shed: %d still in flight", stage.name, self.max_inflight)
+                run.results[stage.name] = stage.fallback
+                run.timed_out.append(stage.name)
+                run.shed.append(stage.name)
+                run.timings_ms[stage.name] = 0.0
+                continue
+            future.add_done_callback(lambda _, name=stage.name: finished.setdefault(name, time.perf_counter()))
+            futures.append((stage, future, pool, submitted))
+
+        for stage, future, pool, submitted in sorted(futures, key=lambda item: item[3] + item[0].deadline):
+            remaining = submitted + stage.deadline - time.perf_counter()
+            try:
+                run.results[stage.name] = future.result(timeout=max(remaining, 0))
+            except FutureTimeoutError:
+                logger.warning("Feature stage %s missed its %.1fs deadline", stage.name, stage.deadline)
+                if not future.cancel() and pool is not None:
+                    # Running in a worker: only replacing the pool stops it. Other runs' stages
+                    # still in this pool fail with BrokenProcessPool and take their fallback.
+                    self._reset_processes(pool, kill=True)
+                run.results[stage.name] = stage.fallback
+                run.timed_out.append(stage.name)
+            except BrokenProcessPool:
+                logger.warning("Feature stage %s lost its worker process", stage.name)
+                self._reset_processes(pool)
+                run.results[stage.name] = stage.fallback
+                run.timed_out.append(stage.name)
+            run.timings_ms[stage.name] = ((finished.get(stage.name) or time.perf_counter()) - submitted) * 1000
+
+        self._record(stages, run)
+        return run
+
+    def _record(self, stages: Sequence[Stage], run: StageRun) -> None:
+        with self._metrics_lock:
+            self._deadlines.update((stage.name, stage.deadline) for stage in stages)
+            for name, elapsed in run.timings_ms.items():
+                self._runs[name] = self._runs.get(name, 0) + 1
+                self._timings.setdefault(name, deque(maxlen=self._metrics_window)).append(elapsed)
+            for name in run.timed_out:
+                self._timeouts[name] = self._timeouts.get(name, 0) + 1
+            for name in run.shed:
+                self._shed[name] = self._shed.get(name, 0) + 1
+
+    def metrics(self) -> Dict[str, Any]:
+        # Distribution stats cover each stage's most recent `metrics_window` runs
+        with self._metrics_lock:
+            stages = {}
+            for name, timings in self._timings.items():
+                times = np.array(timings, dtype=np.float64)
+                stages[name] = {
+                    'deadline_ms': self._deadlines[name] * 1000,
+                    'runs': self._runs[name],
+                    'timeouts': self._timeouts.get(name, 0),
+                    'shed': self._shed.get(name, 0),
+                    'avg_ms': float(times.mean()),
+                    'p95_ms': float(np.percentile(times, 95)),
+                }
+        return {'stages': stages}
+
+    def close(self) -> None:
+        self.threads.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            pool, self._processes = self._processes, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+stage_executor = StageExecutor()
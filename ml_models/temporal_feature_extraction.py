@@ -1,5 +1,8 @@
 from typing import Dict, List, Any, Union
 from datetime import datetime
+from .feature_registry import feature_registry
+
+feature_registry.register('temporal', ['account_age', 'posting_frequency', 'activity_variance', 'night_day_ratio'])
 
 def extract_temporal_features(user: Any) -> Dict[str, float]:
     account_age = user.get_account_age()
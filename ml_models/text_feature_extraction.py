@@ -1,16 +1,31 @@
+import hashlib
+import os
+import joblib
 import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
 from nltk.sentiment import SentimentIntensityAnalyzer
+from nltk.tag.perceptron import PerceptronTagger
+from nltk.tokenize import NLTKWordTokenizer
 from gensim import corpora
-from gensim.models import LdaMulticore
+from gensim.models import LdaModel, LdaMulticore
 from gensim.parsing.preprocessing import STOPWORDS
 from gensim.utils import simple_preprocess
 import nltk
-from textblob import TextBlob
-import language_tool_python
+from .grammar_check import grammar_checker, content_hash
+from .post_feature_cache import post_feature_cache
+from .spelling import count_spelling_errors, load_spelling_counter
+from .feature_vector import FeatureVector, TFIDF_MAX_FEATURES, NUM_TOPICS
+from .feature_registry import feature_registry
 
-# Initialize LanguageTool for grammar checking
-language_tool = language_tool_python.LanguageTool('en-US')
+# TF-IDF vocabulary/IDF artifact, fitted once at training time by train_model.py
+TFIDF_VECTORIZER_PATH = os.getenv('TFIDF_VECTORIZER_PATH', 'tfidf_vectorizer.joblib')
+
+_tfidf_vectorizer = None
+
+# LDA topic model artifact, trained offline by train_model.py; serving only runs inference
+TOPIC_MODEL_PATH = os.getenv('TOPIC_MODEL_PATH', 'lda_topic_model.gensim')
+
+_topic_model = None
 
 def preprocess(text):
     result = []
@@ -19,64 +34,279 @@ def preprocess(text):
             result.append(token)
     return result
 
-def extract_text_features(bio, posts):
-    features = {}
-    
-    # Combine bio and posts
-    all_text = bio + ' ' + ' '.join(posts)
-    
-    # TF-IDF Vectorization
-    tfidf = TfidfVectorizer(max_features=100)
-    tfidf_features = tfidf.fit_transform([all_text]).toarray()[0]
-    for i, value in enumerate(tfidf_features):
-        features[f'tfidf_{i}'] = value
-    
-    # Sentiment Analysis
-    sia = SentimentIntensityAnalyzer()
-    sentiment_scores = sia.polarity_scores(all_text)
-    features.update(sentiment_scores)
-    
-    # Topic Modeling
-    processed_posts = [preprocess(post) for post in posts]
+def build_profile_text(bio, posts):
+    return bio + ' ' + ' '.join(posts)
+
+def fit_text_vectorizer(documents, max_features=TFIDF_MAX_FEATURES, path=TFIDF_VECTORIZER_PATH):
+    global _tfidf_vectorizer
+    vectorizer = TfidfVectorizer(max_features=max_features, dtype=np.float32)
+    vectorizer.fit(documents)
+    joblib.dump(vectorizer, path)
+    _tfidf_vectorizer = vectorizer
+    return vectorizer
+
+def load_text_vectorizer(path=TFIDF_VECTORIZER_PATH):
+    global _tfidf_vectorizer
+    if _tfidf_vectorizer is None:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"TF-IDF vectorizer artifact not found at {path}; run train_model.py first")
+        _tfidf_vectorizer = joblib.load(path)
+    return _tfidf_vectorizer
+
+def transform_texts(texts, vectorizer=None):
+    # Transform-only: returns a sparse CSR matrix with one row per text
+    return (vectorizer or load_text_vectorizer()).transform(texts)
+
+def fit_topic_model(posts_per_profile, num_topics=NUM_TOPICS, path=TOPIC_MODEL_PATH, workers=None):
+    global _topic_model
+    processed_posts = [preprocess(post) for posts in posts_per_profile for post in posts]
     dictionary = corpora.Dictionary(processed_posts)
     corpus = [dictionary.doc2bow(text) for text in processed_posts]
-    
-    lda_model = LdaMulticore(corpus=corpus, id2word=dictionary, num_topics=5)
-    topics = lda_model.get_document_topics(corpus)
-    for i in range(5):
-        features[f'topic_{i}'] = max([topic[1] for topic in topics if topic[0] == i], default=0)
-    
-    # Named Entity Recognition
-    tokens = nltk.word_tokenize(all_text)
-    pos_tags = nltk.pos_tag(tokens)
-    named_entities = nltk.ne_chunk(pos_tags)
-    ner_counts = {}
-    for chunk in named_entities:
-        if hasattr(chunk, 'label'):
-            ner_counts[chunk.label()] = ner_counts.get(chunk.label(), 0) + 1
-    features.update(ner_counts)
-    
-    # Spelling and Grammar Check
-    blob = TextBlob(all_text)
-    features['spelling_errors'] = len(blob.correct().split()) - len(blob.split())
-    
-    grammar_errors = language_tool.check(all_text)
-    features['grammar_errors'] = len(grammar_errors)
-    
-    return features
+    lda_model = LdaMulticore(corpus=corpus, id2word=dictionary, num_topics=num_topics, workers=workers)
+    lda_model.save(path)
+    _topic_model = lda_model
+    return lda_model
+
+def load_topic_model(path=TOPIC_MODEL_PATH):
+    global _topic_model
+    if _topic_model is None:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Topic model artifact not found at {path}; run train_model.py first")
+        _topic_model = LdaModel.load(path)
+    return _topic_model
+
+def topic_distributions(texts, lda_model=None):
+    # One row per text; texts with no in-vocabulary tokens get an all-zero row
+    lda_model = lda_model or load_topic_model()
+    distributions = np.zeros((len(texts), lda_model.num_topics), dtype=np.float32)
+
+    bows = []
+    rows = []
+    for idx, text in enumerate(texts):
+        bow = lda_model.id2word.doc2bow(preprocess(text))
+        if bow:
+            bows.append(bow)
+            rows.append(idx)
+
+    if bows:
+        gamma, _ = lda_model.inference(bows)
+        distributions[rows] = gamma / gamma.sum(axis=1, keepdims=True)
+    return distributions
+
+def score_topics(posts_per_profile, lda_model=None):
+    # Inference only, in-process: every post of every profile goes through a single
+    # variational E-step, then each profile keeps its max probability per topic.
+    lda_model = lda_model or load_topic_model()
+    scores = np.zeros((len(posts_per_profile), lda_model.num_topics), dtype=np.float32)
+
+    posts = [post for posts in posts_per_profile for post in posts]
+    owners = [idx for idx, posts in enumerate(posts_per_profile) for _ in posts]
+    if posts:
+        np.maximum.at(scores, np.asarray(owners), topic_distributions(posts, lda_model))
+    return scores
+
+def topic_model_fingerprint(lda_model):
+    return hashlib.sha1(lda_model.get_topics().tobytes()).hexdigest()[:16]
+
+def _load_sentence_tokenizer():
+    try:
+        from nltk.tokenize import PunktTokenizer  # NLTK >= 3.9
+        return PunktTokenizer('english')
+    except ImportError:
+        return nltk.data.load('tokenizers/punkt/english.pickle')
+
+def _load_ne_chunker():
+    try:
+        from nltk.chunk import ne_chunker  # NLTK >= 3.9
+        return ne_chunker()
+    except ImportError:
+        return nltk.data.load('chunkers/maxent_ne_chunker/english_ace_multiclass.pickle')
+
+SENTIMENT_KEYS = ('neg', 'neu', 'pos', 'compound')
+
+# Text sub-steps; callers can request a subset, e.g. the cheap first stage of the cascade
+TEXT_STEPS = ('tfidf', 'sentiment', 'topics', 'ner', 'spelling', 'grammar')
+# Per-segment steps and the cache-entry field that marks them as computed
+SEGMENT_STEPS = {'sentiment': 'sentiment', 'ner': 'ner', 'spelling': 'spelling_errors'}
+NER_LABELS = ('PERSON', 'ORGANIZATION', 'GPE', 'LOCATION', 'FACILITY', 'GSP')
+
+feature_registry.register('text.tfidf', ['tfidf_*'])
+feature_registry.register('text.sentiment', SENTIMENT_KEYS)
+feature_registry.register('text.topics', ['topic_*'])
+feature_registry.register('text.ner', NER_LABELS)
+feature_registry.register('text.spelling', ['spelling_errors', 'oov_words'])
+feature_registry.register('text.grammar', ['grammar_errors'])
+# Always computed by extract_many alongside the text steps
+feature_registry.register('profile', ['followers_count', 'following_count', 'posts_count', 'account_age_days'])
+
+class TextFeatureExtractor:
+    # Holds every text resource warm for the lifetime of the process; nltk.pos_tag and
+    # nltk.ne_chunk would otherwise reload their pickles on each call.
+    def __init__(self, post_cache=post_feature_cache):
+        self.sentiment_analyzer = SentimentIntensityAnalyzer()
+        self.sentence_tokenizer = _load_sentence_tokenizer()
+        self.word_tokenizer = NLTKWordTokenizer()
+        self.tagger = PerceptronTagger()
+        self.chunker = _load_ne_chunker()
+        self.grammar_checker = grammar_checker
+        self.post_cache = post_cache
+        self.vectorizer = None
+        self.topic_model = None
+        self._topic_model_tag = None
+
+    def warm_up(self):
+        self.vectorizer = load_text_vectorizer()
+        self.topic_model = load_topic_model()
+        self._topic_model_tag = topic_model_fingerprint(self.topic_model)
+        load_spelling_counter()
+        self.grammar_checker.warm_up()
+
+    def _resolve_topic_model(self):
+        lda_model = self.topic_model or load_topic_model()
+        if self._topic_model_tag is None or lda_model is not self.topic_model:
+            self.topic_model = lda_model
+            self._topic_model_tag = topic_model_fingerprint(lda_model)
+        return lda_model
+
+    def tokenize(self, text):
+        return [token
+                for sentence in self.sentence_tokenizer.tokenize(text)
+                for token in self.word_tokenizer.tokenize(sentence)]
+
+    def count_named_entities(self, text):
+        ner_counts = {}
+        tokens = self.tokenize(text)
+        if not tokens:
+            return ner_counts
+        for chunk in self.chunker.parse(self.tagger.tag(tokens)):
+            if hasattr(chunk, 'label'):
+                ner_counts[chunk.label()] = ner_counts.get(chunk.label(), 0) + 1
+        return ner_counts
+
+    def _segment_step(self, step, text):
+        if step == 'sentiment':
+            return {'words': len(text.split()), 'sentiment': self.sentiment_analyzer.polarity_scores(text)}
+        if step == 'ner':
+            return {'ner': self.count_named_entities(text)}
+        spelling_errors, oov_words = count_spelling_errors(text)
+        return {'spelling_errors': spelling_errors, 'oov_words': oov_words}
+
+    def _load_segments(self, bios, posts_lists, steps):
+        # Per-segment (bio or post) features are memoized by content hash, so re-analysing a
+        # profile only computes features for segments that have not been seen before.
+        segment_keys = [[content_hash(bio)] + [content_hash(post) for post in posts]
+                        for bio, posts in zip(bios, posts_lists)]
+        texts = {}
+        for keys, bio, posts in zip(segment_keys, bios, posts_lists):
+            texts.update(zip(keys, [bio] + list(posts)))
+
+        entries = self.post_cache.get_many(texts)
+        updated = {}
+
+        for key, text in texts.items():
+            entry = entries.get(key, {})
+            missing = [step for step in SEGMENT_STEPS if step in steps and SEGMENT_STEPS[step] not in entry]
+            if missing:
+                entry = dict(entry)
+                for step in missing:
+                    entry.update(self._segment_step(step, text))
+                updated[key] = entry
+            entries[key] = entry
+
+        # Topic vectors are only needed for posts and depend on the loaded LDA model
+        if 'topics' in steps:
+            lda_model = self._resolve_topic_model()
+            post_keys = {key for keys in segment_keys for key in keys[1:]}
+            stale = [key for key in post_keys if entries[key].get('topic_model') != self._topic_model_tag]
+            if stale:
+                for key, distribution in zip(stale, topic_distributions([texts[key] for key in stale], lda_model)):
+                    entries[key] = updated[key] = {**entries[key], 'topics': distribution.tolist(),
+                                                   'topic_model': self._topic_model_tag}
+
+        # Grammar results are memoized only when the check actually ran
+        if 'grammar' in steps:
+            groups = [[key for key in dict.fromkeys(keys) if 'grammar_errors' not in entries[key]]
+                      for keys in segment_keys]
+            grammar_counts = self.grammar_checker.count_errors_grouped(
+                [[texts[key] for key in group] for group in groups], fill_fallback=False
+            )
+            for group, counts in zip(groups, grammar_counts):
+                for key, count in zip(group, counts):
+                    if count is not None:
+                        entries[key] = updated[key] = {**entries[key], 'grammar_errors': count}
+
+        self.post_cache.put_many(updated)
+        return segment_keys, entries
+
+    def _assemble(self, features, keys, entries, steps):
+        segments = [entries[key] for key in keys]
+
+        # Sentiment Analysis: word-count weighted mean of the bio and post scores
+        if 'sentiment' in steps:
+            weights = np.array([segment['words'] for segment in segments], dtype=np.float64)
+            total_weight = weights.sum()
+            for name in SENTIMENT_KEYS:
+                values = np.array([segment['sentiment'][name] for segment in segments])
+                features[name] = float(np.dot(weights, values) / total_weight) if total_weight else 0.0
+
+        # Topic Modeling: max probability per topic over the posts
+        if 'topics' in steps:
+            topics = np.zeros(self.topic_model.num_topics, dtype=np.float32)
+            for segment in segments[1:]:
+                np.maximum(topics, segment['topics'], out=topics)
+            features.set_block('topic', topics)
+
+        # Named Entity Recognition
+        if 'ner' in steps:
+            for segment in segments:
+                for label, count in segment['ner'].items():
+                    features[label] = features.get(label, 0) + count
+
+        # Spelling and Grammar Check
+        if 'spelling' in steps:
+            features['spelling_errors'] = sum(segment['spelling_errors'] for segment in segments)
+            features['oov_words'] = sum(segment['oov_words'] for segment in segments)
+        if 'grammar' in steps:
+            features['grammar_errors'] = sum(
+                entries[key].get('grammar_errors', self.grammar_checker.fallback) for key in keys
+            )
+
+    def extract_text_many(self, bios, posts_lists, steps=TEXT_STEPS):
+        results = [FeatureVector() for _ in bios]
+
+        # TF-IDF Vectorization runs over the whole profile text, once for the batch; a vocabulary
+        # smaller than the tfidf block leaves the trailing columns at zero
+        if 'tfidf' in steps:
+            texts = [build_profile_text(bio, posts) for bio, posts in zip(bios, posts_lists)]
+            sparse = transform_texts(texts, self.vectorizer)
+            tfidf_matrix = np.zeros((len(texts), TFIDF_MAX_FEATURES), dtype=np.float32)
+            tfidf_matrix[:, :sparse.shape[1]] = sparse.toarray()
+            for features, row in zip(results, tfidf_matrix):
+                features.set_block('tfidf', row)
+
+        segment_keys, entries = self._load_segments(bios, posts_lists, steps)
+        for features, keys in zip(results, segment_keys):
+            self._assemble(features, keys, entries, steps)
+        return results
+
+    def extract_many(self, profiles, steps=TEXT_STEPS):
+        bios = [profile.get('bio', '') or '' for profile in profiles]
+        posts_lists = [profile.get('posts', []) or [] for profile in profiles]
+
+        results = []
+        for profile, posts, text_features in zip(profiles, posts_lists, self.extract_text_many(bios, posts_lists, steps)):
+            # Add other profile features
+            text_features['followers_count'] = profile.get('followers_count', 0)
+            text_features['following_count'] = profile.get('following_count', 0)
+            text_features['posts_count'] = len(posts)
+            text_features['account_age_days'] = profile.get('account_age_days', 0)
+            results.append(text_features)
+        return results
+
+text_feature_extractor = TextFeatureExtractor()
+
+def extract_text_features(bio, posts):
+    return text_feature_extractor.extract_text_many([bio], [posts])[0]
 
 def extract_profile_features(profile_data):
-    bio = profile_data.get('bio', '')
-    posts = profile_data.get('posts', [])
-    
-    text_features = extract_text_features(bio, posts)
-    
-    # Add other profile features
-    additional_features = {
-        'followers_count': profile_data.get('followers_count', 0),
-        'following_count': profile_data.get('following_count', 0),
-        'posts_count': len(posts),
-        'account_age_days': profile_data.get('account_age_days', 0),
-    }
-    
-    return {**text_features, **additional_features}
+    return text_feature_extractor.extract_many([profile_data])[0]
@@ -53,6 +53,7 @@ class ProfileSubmission(BaseModel):
     follower_count: int
     following_count: int
     profile_picture_url: Optional[str]
+    analysis_mode: str = 'cascade'  # 'cascade' or 'full'
 
 class BatchProfileSubmission(BaseModel):
     profiles: List[ProfileSubmission]
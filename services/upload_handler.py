@@ -0,0 +1,164 @@
+from contextlib import asynccontextmanager
+from typing import List, Optional, Union
+from fastapi import UploadFile
+from exceptions import PayloadTooLargeError
+import io
+import json
+import os
+import shutil
+import tempfile
+
+UPLOAD_MAX_IMAGES = int(os.getenv('UPLOAD_MAX_IMAGES', 10))
+UPLOAD_MAX_IMAGE_BYTES = int(os.getenv('UPLOAD_MAX_IMAGE_BYTES', 10 * 1024 * 1024))
+UPLOAD_MAX_REQUEST_BYTES = int(os.getenv('UPLOAD_MAX_REQUEST_BYTES', 30 * 1024 * 1024))
+# Uploads larger than this are spooled to a private temp dir instead of being held in memory
+UPLOAD_SPOOL_THRESHOLD = int(os.getenv('UPLOAD_SPOOL_THRESHOLD', 2 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Allowance on top of UPLOAD_MAX_REQUEST_BYTES for form fields and multipart framing
+UPLOAD_FORM_OVERHEAD_BYTES = int(os.getenv('UPLOAD_FORM_OVERHEAD_BYTES', 1024 * 1024))
+
+class UploadBuffer:
+    # One uploaded file: an in-memory buffer that moves to a file in `spool_dir` once it
+    # grows past the threshold. `source` is what image analysis consumes (bytes or a path).
+    def __init__(self, spool_dir: str, index: int, threshold: int = UPLOAD_SPOOL_THRESHOLD):
+        self.spool_dir = spool_dir
+        self.index = index
+        self.threshold = threshold
+        self.size = 0
+        self._memory: Optional[io.BytesIO] = io.BytesIO()
+        self._file = None
+        self.path: Optional[str] = None
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self._memory is not None and self.size > self.threshold:
+            # Names are our own, never the client's filename, so concurrent uploads cannot collide
+            self.path = os.path.join(self.spool_dir, f'upload_{self.index}')
+            self._file = open(self.path, 'wb')
+            self._file.write(self._memory.getbuffer())
+            self._memory = None
+        if self._memory is not None:
+            self._memory.write(chunk)
+        else:
+            self._file.write(chunk)
+
+    def finish(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @property
+    def source(self) -> Union[bytes, str]:
+        return self._memory.getvalue() if self._memory is not None else self.path
+
+    def close(self) -> None:
+        self.finish()
+        self._memory = None
+
+class UploadHandler:
+    def __init__(self, max_images: int = UPLOAD_MAX_IMAGES, max_image_bytes: int = UPLOAD_MAX_IMAGE_BYTES,
+                 max_request_bytes: int = UPLOAD_MAX_REQUEST_BYTES, spool_threshold: int = UPLOAD_SPOOL_THRESHOLD):
+        self.max_images = max_images
+        self.max_image_bytes = max_image_bytes
+        self.max_request_bytes = max_request_bytes
+        self.spool_threshold = spool_threshold
+
+    @asynccontextmanager
+    async def receive_images(self, uploads: Optional[List[UploadFile]]):
+        # Yields the uploads as image sources and removes any spooled files afterwards,
+        # including when analysis raises. By now the form parser has spooled the whole body
+        # (bounded by RequestBodyLimitMiddleware); these are the per-image and count limits.
+        uploads = uploads or []
+        if len(uploads) > self.max_images:
+            raise PayloadTooLargeError(f"At most {self.max_images} images can be uploaded per request")
+
+        spool_dir = tempfile.mkdtemp(prefix='uploads-')  # created with mode 0700
+        buffers = []
+        try:
+            total = 0
+            for i, upload in enumerate(uploads):
+                buffer = UploadBuffer(spool_dir, i, self.spool_threshold)
+                buffers.append(buffer)
+                while True:
+                    chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    total += len(chunk)
+                    if buffer.size + len(chunk) > self.max_image_bytes:
+                        raise PayloadTooLargeError(f"Each image must be at most {self.max_image_bytes} bytes")
+                    if total > self.max_request_bytes:
+                        raise PayloadTooLargeError(f"Uploads must total at most {self.max_request_bytes} bytes")
+                    buffer.write(chunk)
+                buffer.finish()
+            yield [buffer.source for buffer in buffers if buffer.size]
+        finally:
+            for buffer in buffers:
+                buffer.close()
+            shutil.rmtree(spool_dir, ignore_errors=True)
+
+class RequestBodyLimitMiddleware:
+    # ASGI middleware bounding the request body before any form parsing: a declared
+    # Content-Length over the limit is refused outright, and a body streamed without one
+    # (chunked) is counted as it arrives and cut off once it passes the limit. Checks inside
+    # the handler come too late, after Starlette has spooled every part of the multipart body.
+    def __init__(self, app, max_body_bytes: int = UPLOAD_MAX_REQUEST_BYTES + UPLOAD_FORM_OVERHEAD_BYTES):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope['headers']).get(b'content-length')
+        try:
+            declared = int(content_length) if content_length is not None else None
+        except ValueError:
+            declared = None
+        if declared is not None and declared > self.max_body_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_body_bytes:
+                    exceeded = True
+                    raise PayloadTooLargeError(self._message())
+            return message
+
+        async def guarded_send(message):
+            # Whatever the app makes of the aborted body (FastAPI reports a 400 parse error),
+            # the client gets the 413
+            nonlocal response_started
+            if exceeded and not response_started:
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except PayloadTooLargeError:
+            if not exceeded:
+                raise
+        if exceeded and not response_started:
+            await self._reject(send)
+
+    def _message(self) -> str:
+        return f"Request body must be at most {self.max_body_bytes} bytes"
+
+    async def _reject(self, send) -> None:
+        body = json.dumps({"message": self._message()}).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': PayloadTooLargeError().status_code,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(body)).encode('ascii')),
+                                (b'connection', b'close')]})
+        await send({'type': 'http.response.body', 'body': body})
+
+upload_handler = UploadHandler()
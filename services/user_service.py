@@ -1,9 +1,16 @@
-from backend.models.user import User
-from typing import List
-from ml_models.network_feature_extraction import extract_network_features
+from backend.models.user import User, users_collection
+from typing import Dict, Iterable, List, Optional
+from ml_models.graph_store import graph_store
+from ml_models.network_feature_extraction import stored_network_features
+from ml_models.process_pool import kill_pool, spawn_pool
 from ml_models.temporal_feature_extraction import extract_temporal_features
-from pymongo import MongoClient
+from bson import ObjectId
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pymongo import MongoClient, UpdateOne
 from redis import Redis
+import os
+import threading
 import pickle
 import json
 from passlib.context import CryptContext
@@ -11,6 +18,14 @@ from passlib.context import CryptContext
 # Initialize Redis client
 redis_client = Redis(host='localhost', port=6379, db=1)
 
+# Users whose neighbourhood changed since their network features were last computed
+NETWORK_DIRTY_KEY = 'network_dirty_users'
+NETWORK_RECOMPUTE_BATCH = int(os.getenv('NETWORK_RECOMPUTE_BATCH', 5000))
+NETWORK_RECOMPUTE_CHUNK = int(os.getenv('NETWORK_RECOMPUTE_CHUNK', 250))
+NETWORK_RECOMPUTE_WORKERS = int(os.getenv('NETWORK_RECOMPUTE_WORKERS', 2))
+NETWORK_RECOMPUTE_TIMEOUT = float(os.getenv('NETWORK_RECOMPUTE_TIMEOUT', 600.0))  # seconds per batch
+NETWORK_INPUT_FIELDS = ('connections', 'followers_count', 'following_count')
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def is_admin(user: User) -> bool:
@@ -32,9 +47,18 @@ def get_user_by_id(user_id: str) -> User:
 def update_user(user_id: str, user_data: dict) -> User:
     user = User.find_by_id(user_id)
     if user:
+        # The user and their old connections (which may lose them as a neighbour) are marked
+        # here; edges to new connections are marked as the graph store adds them
+        network_changed = any(field in user_data for field in NETWORK_INPUT_FIELDS)
+        affected = [user_id] + list(user.connections or []) if network_changed else []
         for key, value in user_data.items():
             setattr(user, key, value)
         user.save()
+        if network_changed:
+            # New edges mark both their endpoints dirty through the graph store listener
+            if user.connections:
+                graph_store.add_edges(str(user_id), [str(connection) for connection in user.connections])
+            mark_network_dirty(affected)
     return user
 
 def get_user_from_token(token: str) -> User:
@@ -42,30 +66,98 @@ def get_user_from_token(token: str) -> User:
     # This is a placeholder implementation
     return User.find_by_email(token)  # Replace with proper token validation
 
-def update_user_network_features(user: User):
-    network_features = extract_network_features(
-        user.id,
-        user.followers_count,
-        user.following_count,
-        user.connections
-    )
-    
-    user.follower_following_ratio = network_features['follower_following_ratio']
-    user.degree_centrality = network_features['degree_centrality']
-    user.betweenness_centrality = network_features['betweenness_centrality']
-    user.closeness_centrality = network_features['closeness_centrality']
-    user.clustering_coefficient = network_features['clustering_coefficient']
-    
-    # Calculate a simple network score (you can adjust this calculation as needed)
-    user.network_score = (
-        user.follower_following_ratio +
-        user.degree_centrality +
-        user.betweenness_centrality +
-        user.closeness_centrality +
-        user.clustering_coefficient
-    ) / 5
+def mark_network_dirty(user_ids: Iterable[str]) -> None:
+    user_ids = [str(user_id) for user_id in user_ids]
+    if user_ids:
+        redis_client.sadd(NETWORK_DIRTY_KEY, *user_ids)
 
-    user.save()
+def mark_all_network_dirty() -> None:
+    mark_network_dirty(user['_id'] for user in users_collection.find({}, {'_id': 1}))
+
+# Every edge added to the graph, by any caller, changes both endpoints' neighbourhoods
+graph_store.add_listener(mark_network_dirty)
+
+_network_pool: Optional[ProcessPoolExecutor] = None
+_network_pool_lock = threading.Lock()
+
+def _get_network_pool() -> ProcessPoolExecutor:
+    # Long-lived: each worker keeps its memory-mapped view of the graph store between runs
+    global _network_pool
+    with _network_pool_lock:
+        if _network_pool is None:
+            _network_pool = spawn_pool(NETWORK_RECOMPUTE_WORKERS)
+        return _network_pool
+
+def _reset_network_pool(broken: ProcessPoolExecutor, kill: bool = False) -> None:
+    global _network_pool
+    with _network_pool_lock:
+        if _network_pool is broken:
+            _network_pool = None
+    if kill:
+        kill_pool(broken)
+    else:
+        broken.shutdown(wait=False, cancel_futures=True)
+
+def network_score(network_features: Dict[str, float]) -> float:
+    # A simple network score (you can adjust this calculation as needed)
+    return sum(network_features[name] for name in (
+        'follower_following_ratio',
+        'degree_centrality',
+        'betweenness_centrality',
+        'closeness_centrality',
+        'clustering_coefficient'
+    )) / 5
+
+def recompute_network_features(limit: int = NETWORK_RECOMPUTE_BATCH) -> int:
+    # Recomputes up to `limit` dirty users: chunks of user ids and counts go to the long-lived
+    # network workers, which cut each ego from their own view of the graph store and compute
+    # its centralities, and the results are written with one bulk update. Returns how many
+    # users were popped from the dirty set. Chunks still running after NETWORK_RECOMPUTE_TIMEOUT
+    # have their users marked dirty again, and the batch raises TimeoutError once the finished
+    # chunks are written.
+    user_ids = [user_id.decode() for user_id in redis_client.spop(NETWORK_DIRTY_KEY, limit) or []]
+    if not user_ids:
+        return 0
+    unfinished = []
+    try:
+        # Connections may name profiles that are not registered users; those are skipped.
+        # User ids are stored as ObjectIds, or as strings by User.save's insert path.
+        object_ids = [ObjectId(user_id) for user_id in user_ids if ObjectId.is_valid(user_id)]
+        users = list(users_collection.find({'_id': {'$in': object_ids + user_ids}},
+                                           {'followers_count': 1, 'following_count': 1}))
+        items = [(str(user['_id']), user.get('followers_count') or 0, user.get('following_count') or 0)
+                 for user in users]
+        chunks = [items[i:i + NETWORK_RECOMPUTE_CHUNK] for i in range(0, len(items), NETWORK_RECOMPUTE_CHUNK)]
+        pool = _get_network_pool()
+        futures = {pool.submit(stored_network_features, chunk): chunk for chunk in chunks}
+        done, not_done = wait(futures, timeout=NETWORK_RECOMPUTE_TIMEOUT)
+        # A chunk that already started cannot be cancelled: the workers are recycled instead
+        # of staying stuck and blocking every later run of the job
+        if any(not future.cancel() for future in not_done):
+            _reset_network_pool(pool, kill=True)
+        unfinished = [user_id for future in not_done for user_id, _, _ in futures[future]]
+        results = {}
+        for future in done:
+            try:
+                results.update(zip((user_id for user_id, _, _ in futures[future]), future.result()))
+            except BrokenProcessPool:
+                _reset_network_pool(pool)
+                raise
+
+        finished = [(user, results[str(user['_id'])]) for user in users if str(user['_id']) in results]
+        updates = [UpdateOne({'_id': user['_id']}, {'$set': {**features, 'network_score': network_score(features)}})
+                   for user, features in finished]
+        if updates:
+            users_collection.bulk_write(updates, ordered=False)
+            redis_client.delete(*[f"user_stats:{user['_id']}" for user, _ in finished])
+    except Exception:
+        mark_network_dirty(user_ids)
+        raise
+    if unfinished:
+        mark_network_dirty(unfinished)
+        raise TimeoutError(f"Network features of {len(unfinished)} users not computed within "
+                           f"{NETWORK_RECOMPUTE_TIMEOUT}s")
+    return len(user_ids)
 
 def get_user_stats(user: User):
     cache_key = f"user_stats:{user.id}"
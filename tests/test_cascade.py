@@ -0,0 +1,70 @@
+import io
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+pytest.importorskip('face_recognition')
+pytest.importorskip('dgl')
+Image = pytest.importorskip('PIL.Image')
+nltk = pytest.importorskip('nltk')
+try:
+    nltk.data.find('sentiment/vader_lexicon.zip')
+except LookupError:
+    pytest.skip('NLTK data not downloaded (run download_nltk_data.py)', allow_module_level=True)
+
+from ml_models import cascade, feature_extraction
+from ml_models.face_index import FaceIndex
+from ml_models.feature_vector import FeatureVector
+from ml_models.graph_store import GraphStore
+from ml_models.image_hash_index import ImageHashIndex
+from ml_models.near_duplicate_index import NearDuplicateIndex
+
+class ConfidentModel:
+    # Settles every profile on the cheap features
+    def predict_proba(self, X):
+        return np.tile([0.05, 0.95], (len(X), 1))
+
+def picture_bytes():
+    pixels = np.random.default_rng(0).integers(0, 256, (96, 96, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+PROFILE = {
+    'profile_key': 'alice',
+    'bio': 'photographer and traveller',
+    'posts': ['sunset over the bay', 'morning coffee'],
+    'connections': ['bob', 'carol'],
+    'profile_pictures': [picture_bytes()],
+}
+
+@pytest.fixture
+def stores(monkeypatch, tmp_path):
+    stores = {
+        'graph_store': GraphStore(str(tmp_path / 'graph')),
+        'image_hash_index': ImageHashIndex(str(tmp_path / 'image_hashes')),
+        'face_index': FaceIndex(str(tmp_path / 'faces')),
+        'near_duplicate_index': NearDuplicateIndex(str(tmp_path / 'near_duplicates')),
+    }
+    for name, store in stores.items():
+        monkeypatch.setattr(feature_extraction, name, store)
+    monkeypatch.setattr(cascade, 'extract_cheap_features_many', lambda user_datas: [FeatureVector() for _ in user_datas])
+    return stores
+
+def analyzer():
+    analyzer = cascade.CascadeAnalyzer('missing_cascade_model.joblib')
+    analyzer.model = ConfidentModel()
+    return analyzer
+
+def test_cheap_resolved_profiles_feed_the_graph_and_indexes(stores):
+    result = analyzer().analyze(PROFILE, full_model=None)
+    assert result['stage'] == 'cheap'
+    graph = stores['graph_store']
+    assert graph.num_edges == 2 and graph.node_id('alice') is not None
+    assert len(stores['image_hash_index']) == 1
+    assert stores['near_duplicate_index'].shards
+
+def test_cheap_resolved_profiles_are_not_indexed_without_update_indexes(stores):
+    analyzer().analyze(PROFILE, full_model=None, update_indexes=False)
+    assert stores['graph_store'].num_edges == 0
+    assert len(stores['image_hash_index']) == 0 and not stores['near_duplicate_index'].shards
@@ -0,0 +1,42 @@
+import networkx as nx
+import numpy as np
+import pytest
+from ml_models import centrality
+from ml_models.graph_store import csr_from_edges
+
+def csr_graph(G):
+    edges = np.array(G.edges(), dtype=np.int32).reshape(-1, 2)
+    return csr_from_edges(edges[:, 0], edges[:, 1], G.number_of_nodes())
+
+GRAPHS = [
+    nx.karate_club_graph(),
+    nx.gnp_random_graph(60, 0.08, seed=1),
+    nx.barabasi_albert_graph(80, 2, seed=2),
+    nx.path_graph(6),
+    nx.disjoint_union(nx.cycle_graph(5), nx.complete_graph(4)),
+]
+
+@pytest.mark.parametrize('G', GRAPHS)
+def test_matches_networkx(G):
+    indptr, indices = csr_graph(G)
+    n = G.number_of_nodes()
+    closeness = nx.closeness_centrality(G)
+    clustering = nx.clustering(G)
+    betweenness = nx.betweenness_centrality(G)
+    degree = nx.degree_centrality(G)
+    for node in range(n):
+        assert centrality.degree_centrality(indptr, indices, node) == pytest.approx(degree[node])
+        assert centrality.closeness_centrality(indptr, indices, node) == pytest.approx(closeness[node])
+        assert centrality.clustering_coefficient(indptr, indices, node) == pytest.approx(clustering[node])
+        estimate, error = centrality.betweenness_centrality(indptr, indices, node, pivots=n)
+        assert error == 0.0
+        assert estimate == pytest.approx(betweenness[node], abs=1e-9)
+
+def test_sampled_betweenness_is_within_its_bound():
+    G = nx.barabasi_albert_graph(400, 3, seed=3)
+    indptr, indices = csr_graph(G)
+    exact = nx.betweenness_centrality(G)
+    for node in range(0, 400, 40):
+        estimate, error = centrality.betweenness_centrality(indptr, indices, node, pivots=64, seed=node)
+        assert 0.0 < error < 1.0
+        assert abs(estimate - exact[node]) <= error
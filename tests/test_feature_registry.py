@@ -0,0 +1,37 @@
+from ml_models.feature_registry import FeatureRegistry
+
+def toy_registry():
+    registry = FeatureRegistry()
+    registry.register('text.tfidf', ['tfidf_*'])
+    registry.register('text.sentiment', ['neg', 'neu', 'pos', 'compound'])
+    registry.register('image.count', ['total_images'])
+    registry.register('image.hashes', ['phash_*', 'dhash_*'], requires=['image.count'])
+    registry.register('image.embedding', ['deep_feature_*'], requires=['image.count'])
+    registry.register('image_reuse', ['image_reuse_count', 'min_hamming_distance'], requires=['image.hashes'],
+                      feeds_index=True)
+    return registry
+
+def test_plan_keeps_producers_and_their_requirements():
+    plan = toy_registry().plan(['compound', 'image_reuse_count', 'tfidf_3'])
+    assert plan.steps == {'text.sentiment', 'text.tfidf', 'image_reuse', 'image.hashes', 'image.count'}
+    assert plan.steps_for('text') == {'sentiment', 'tfidf'}
+    assert plan.steps_for('image') == {'hashes', 'count'}
+    assert plan.unmatched == []
+
+def test_unmatched_names_are_listed():
+    plan = toy_registry().plan(['neg', 'legacy_score'])
+    assert plan.steps == {'text.sentiment'}
+    assert plan.unmatched == ['legacy_score']
+
+def test_no_feature_names_means_the_full_plan():
+    registry = toy_registry()
+    assert registry.plan(None).steps == set(registry.producers)
+
+def test_index_steps_are_added_to_a_pruned_plan():
+    registry = toy_registry()
+    plan = registry.plan(['compound'])
+    indexed = registry.with_index_steps(plan)
+    assert indexed.steps == {'text.sentiment', 'image_reuse', 'image.hashes', 'image.count'}
+    assert 'image.embedding' not in indexed
+    full = registry.full_plan()
+    assert registry.with_index_steps(full) is full
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from ml_models.feature_vector import FeatureSchema, FeatureVector
+
+def small_schema(appended=()):
+    return FeatureSchema(['followers_count', 'compound'], [('tfidf', 3)], appended)
+
+def sample_vector(schema):
+    vector = FeatureVector(schema)
+    vector['followers_count'] = 120
+    vector['tfidf'] = [0.5, 0.0, 0.25]
+    vector['camera_make'] = 'Canon'
+    vector['phash_0'] = np.uint64(2 ** 63 + 1)
+    return vector
+
+def test_document_round_trip():
+    schema = small_schema()
+    vector = sample_vector(schema)
+    restored = FeatureVector.from_document(vector.to_document(), schema)
+    assert restored.to_dict() == vector.to_dict()
+    assert 'compound' not in restored
+    np.testing.assert_array_equal(restored.get_block('tfidf'), [0.5, 0.0, 0.25])
+    assert restored['phash_0'] == 2 ** 63 + 1
+
+def test_dict_round_trip():
+    schema = small_schema()
+    vector = sample_vector(schema)
+    restored = FeatureVector.from_dict(vector.to_dict(), schema)
+    assert restored.to_dict() == vector.to_dict()
+    assert restored['followers_count'] == 120.0
+    assert restored['camera_make'] == 'Canon'
+
+def test_legacy_plain_dict_document():
+    schema = small_schema()
+    restored = FeatureVector.from_document({'followers_count': 3, 'tfidf_1': 0.5, 'unknown': 'x'}, schema)
+    assert restored['followers_count'] == 3.0
+    assert restored['tfidf_1'] == 0.5
+    assert restored['unknown'] == 'x'
+    assert restored.get_block('tfidf') is None
+
+def test_document_from_prefix_schema():
+    # A document written before a feature was appended still decodes under the new layout
+    old, new = small_schema(), small_schema(appended=['stage_timed_out'])
+    restored = FeatureVector.from_document(sample_vector(old).to_document(), new)
+    assert restored.to_dict() == sample_vector(old).to_dict()
+    assert 'stage_timed_out' not in restored
+
+def test_document_from_unknown_schema_is_rejected():
+    document = sample_vector(FeatureSchema(['other'], [('tfidf', 3)])).to_document()
+    with pytest.raises(ValueError):
+        FeatureVector.from_document(document, small_schema())
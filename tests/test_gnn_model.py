@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('dgl')
+
+from ml_models.feature_vector import FeatureVector
+from ml_models.gnn_model import GNNModel, GNNScorer, NEW_NODE, predict_node, sample_node_blocks, save_gnn_model
+from ml_models.graph_store import GraphStore
+
+FEATURE_NAMES = ['followers_count', 'following_count', 'compound', 'pos']
+
+def toy_store(tmp_path):
+    # A hub with six leaves, two of which are also linked to each other
+    store = GraphStore(str(tmp_path / 'graph'))
+    store.add_edges('hub', [f'leaf{i}' for i in range(6)])
+    store.add_edges('leaf0', ['leaf1'])
+    return store
+
+def test_fanout_counts_the_self_loop(tmp_path):
+    store = toy_store(tmp_path)
+    hub = store.node_id('hub')
+    input_nodes, blocks = sample_node_blocks(np.array([hub]), fanouts=[3, 3], store=store)
+    assert input_nodes[:2] == [NEW_NODE, hub]
+    # Output block: the new node and its one neighbour fit within the fanout
+    assert blocks[1].num_dst_nodes() == 1 and blocks[1].in_degrees().tolist() == [2]
+    # Outer block: the hub draws 3 of its 6 leaves and itself, never more than the fanout
+    assert blocks[0].in_degrees().tolist() == [2, 3]
+
+def test_small_neighbourhoods_keep_every_edge_and_the_self_loop(tmp_path):
+    store = toy_store(tmp_path)
+    hub = store.node_id('hub')
+    input_nodes, blocks = sample_node_blocks(np.array([hub]), fanouts=[10, 10], store=store)
+    src, dst = blocks[0].edges()
+    hub_sources = {input_nodes[u] for u, v in zip(src.tolist(), dst.tolist()) if v == 1}
+    # The hub's stored neighbours and itself; the new node is not in the store
+    assert hub_sources == {hub} | {store.node_id(f'leaf{i}') for i in range(6)}
+
+def test_predict_node_scores_without_touching_the_store(tmp_path):
+    store = toy_store(tmp_path)
+    torch.manual_seed(0)
+    model = GNNModel(len(FEATURE_NAMES), 16, 2)
+    node_features = np.random.default_rng(0).random((store.num_nodes, len(FEATURE_NAMES)), dtype=np.float32)
+    nodes, edges = store.num_nodes, store.num_edges
+
+    new = predict_node(model, node_features, np.ones(len(FEATURE_NAMES), dtype=np.float32), ['hub', 'leaf3', 'x'],
+                       store, fanouts=[3, 3])
+    known = predict_node(model, node_features, node_features[store.node_id('leaf0')], [], store, fanouts=[3, 3],
+                         key='leaf0')
+    assert 0.0 <= new <= 1.0 and 0.0 <= known <= 1.0
+    assert (store.num_nodes, store.num_edges) == (nodes, edges)
+    assert store.node_id('x') is None
+
+def test_scorer_is_disabled_without_a_model_and_scores_with_one(tmp_path):
+    store = toy_store(tmp_path)
+    path, features_path = str(tmp_path / 'gnn.pt'), str(tmp_path / 'gnn.npy')
+    features = FeatureVector()
+    features['followers_count'] = 3
+    user_data = {'username': 'someone', 'connections': ['hub']}
+    assert GNNScorer(path, features_path, store).score(user_data, features) is None
+
+    model = GNNModel(len(FEATURE_NAMES), 16, 2)
+    save_gnn_model(model, np.zeros((store.num_nodes, len(FEATURE_NAMES))), FEATURE_NAMES, path, features_path)
+    probability = GNNScorer(path, features_path, store).score(user_data, features)
+    assert 0.0 <= probability <= 1.0
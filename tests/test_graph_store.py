@@ -0,0 +1,95 @@
+import numpy as np
+from ml_models.graph_store import GraphStore
+
+def edge_set(store, key):
+    node = store.node_id(key)
+    return {int(neighbor) for neighbor in store.neighbors(node)}
+
+def test_insert_is_undirected_and_deduplicated(tmp_path):
+    store = GraphStore(str(tmp_path))
+    assert store.add_edges('a', ['b', 'c', 'b', 'a']) == 2
+    assert store.add_edges('b', ['a']) == 0
+    assert store.num_nodes == 3 and store.num_edges == 2
+    assert edge_set(store, 'b') == {store.node_id('a')}
+
+def test_add_edges_never_compacts(tmp_path):
+    store = GraphStore(str(tmp_path))
+    store.add_edges('a', [str(i) for i in range(100)])
+    assert store.pending_edges == 100
+    assert len(store.indices) == 0
+
+def test_compact_keeps_node_ids_and_edges(tmp_path):
+    store = GraphStore(str(tmp_path))
+    store.add_edges('a', ['b', 'c'])
+    ids = {key: store.node_id(key) for key in 'abc'}
+    store.compact()
+    assert store.pending_edges == 0 and store.num_edges == 2
+    assert {key: store.node_id(key) for key in 'abc'} == ids
+    store.add_edges('c', ['b'])
+    assert store.add_edges('a', ['b']) == 0  # already in the CSR
+    assert edge_set(store, 'b') == {ids['a'], ids['c']}
+
+def test_save_and_reload_with_log_replay(tmp_path):
+    path = str(tmp_path / 'graph')
+    store = GraphStore(path)
+    store.add_edges('a', ['b', 'c'])
+    store.save()
+    store.add_edges('d', ['a'])  # only in the edge log
+
+    loaded = GraphStore.load(path)
+    assert loaded.num_nodes == 4 and loaded.num_edges == 3
+    assert isinstance(loaded.indptr, np.memmap)
+    assert edge_set(loaded, 'a') == {loaded.node_id(key) for key in 'bcd'}
+
+def test_refresh_follows_another_writer(tmp_path):
+    path = str(tmp_path / 'graph')
+    writer = GraphStore(path)
+    writer.add_edges('a', ['b'])
+    writer.save()
+    reader = GraphStore.load(path)
+    writer.add_edges('b', ['c'])
+    reader.refresh()
+    assert reader.num_edges == 2
+    writer.save()
+    writer.add_edges('c', ['d'])
+    reader.refresh()
+    assert reader.num_edges == 3 and reader.pending_edges == 1
+
+def test_saver_replays_edges_logged_after_its_save(tmp_path):
+    path = str(tmp_path / 'graph')
+    saver = GraphStore(path)
+    saver.add_edges('a', ['b', 'c'])
+    saver.save()
+    GraphStore.load(path).add_edges('d', ['a'])  # another process appends to the truncated log
+    saver.refresh()
+    assert saver.num_edges == 3 and edge_set(saver, 'd') == {saver.node_id('a')}
+
+def test_ego_subgraph_with_extra_neighbors_writes_nothing(tmp_path):
+    store = GraphStore(str(tmp_path))
+    store.add_edges('a', ['b'])
+    store.add_edges('b', ['c'])
+    ego = store.ego_subgraph('new', radius=2, extra_neighbors=['a', 'b', 'unknown'])
+    assert ego.num_nodes == 4 and ego.num_edges == 4
+    assert len(ego.neighbors(0)) == 2
+    assert store.node_id('new') is None and store.num_edges == 2
+    assert store.ego_subgraph('new') is None
+
+    # A stored centre with an extra neighbour that is already linked to it
+    ego = store.ego_subgraph('a', radius=1, extra_neighbors=['b', 'c'])
+    assert ego.num_nodes == 3
+    assert [len(ego.neighbors(i)) for i in range(3)] == [2, 2, 2]
+
+def test_listeners_get_both_endpoints_of_new_edges(tmp_path):
+    store = GraphStore(str(tmp_path))
+    marked = []
+    store.add_listener(marked.append)
+    store.add_edges('a', ['b', 'c'])
+    store.add_edges('a', ['b'])  # nothing new
+    store.add_edges('d', ['a', 'd'])
+    assert [sorted(keys) for keys in marked] == [['a', 'b', 'c'], ['a', 'd']]
+
+def test_failing_listener_does_not_lose_edges(tmp_path):
+    store = GraphStore(str(tmp_path))
+    store.add_listener(lambda keys: 1 / 0)
+    assert store.add_edges('a', ['b']) == 1
+    assert store.num_edges == 1
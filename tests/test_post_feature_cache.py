@@ -0,0 +1,44 @@
+import pickle
+from redis import RedisError
+from ml_models.post_feature_cache import PostFeatureCache
+
+class FakeRedis:
+    # The subset of the redis client the cache uses, backed by a dict
+    def __init__(self, fail=False):
+        self.data = {}
+        self.fail = fail
+
+    def mget(self, keys):
+        if self.fail:
+            raise RedisError('down')
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self, transaction=False):
+        return self
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value.encode('utf-8') if isinstance(value, str) else value
+
+    def execute(self):
+        if self.fail:
+            raise RedisError('down')
+
+ENTRY = {'words': 3, 'sentiment': {'neg': 0.0, 'compound': 0.5}, 'topics': [0.2, 0.8], 'topic_model': 'abc'}
+
+def test_entries_round_trip_through_redis_as_json():
+    redis = FakeRedis()
+    PostFeatureCache(redis).put_many({'k': ENTRY})
+    assert next(iter(redis.data.values())).startswith(b'{')
+    assert PostFeatureCache(redis).get_many(['k']) == {'k': ENTRY}
+
+def test_pickled_or_corrupt_entries_are_misses():
+    redis = FakeRedis()
+    cache = PostFeatureCache(redis)
+    redis.data[cache.prefix + 'pickled'] = pickle.dumps(ENTRY)
+    redis.data[cache.prefix + 'list'] = b'[1, 2]'
+    assert cache.get_many(['pickled', 'list']) == {}
+
+def test_redis_errors_fall_back_to_the_local_cache():
+    cache = PostFeatureCache(FakeRedis(fail=True))
+    cache.put_many({'k': ENTRY})
+    assert cache.get_many(['k', 'other']) == {'k': ENTRY}
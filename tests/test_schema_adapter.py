@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+from ml_models.feature_vector import FeatureVector
+from ml_models.schema_adapter import FOLLOWER_RATIO_CAP, SchemaAdapter, schema_feature_names
+
+def test_missing_features_take_declared_defaults():
+    adapter = SchemaAdapter(['followers_count', 'min_hamming_distance', 'profile_pic_score_3', 'posts_count'])
+    vector = FeatureVector()
+    vector['followers_count'] = 10
+    row = adapter.transform_one(vector)[0]
+    np.testing.assert_array_equal(row, [10.0, 64.0, 0.5, 0.0])
+
+def test_explicit_defaults_override_declared_ones():
+    adapter = SchemaAdapter(['min_hamming_distance'], defaults={'min_hamming_distance': 32.0})
+    assert adapter.transform_one({})[0, 0] == 32.0
+
+def test_nan_and_inf_are_coerced_per_feature():
+    adapter = SchemaAdapter(['follower_following_ratio', 'min_face_distance', 'compound'])
+    rows = adapter.transform([
+        {'follower_following_ratio': float('inf'), 'min_face_distance': float('nan'), 'compound': float('-inf')},
+        {'follower_following_ratio': float('-inf'), 'min_face_distance': float('inf'), 'compound': 0.5},
+    ])
+    np.testing.assert_array_equal(rows, [[FOLLOWER_RATIO_CAP, 1.0, 0.0], [0.0, 1.0, 0.5]])
+    assert np.isfinite(rows).all()
+
+def test_names_outside_the_schema_are_read_from_metadata():
+    adapter = SchemaAdapter(['legacy_score', 'other'])
+    row = adapter.transform_one({'legacy_score': 0.25, 'other': 'text'})[0]
+    np.testing.assert_array_equal(row, [0.25, 0.0])
+
+def test_json_round_trip(tmp_path):
+    adapter = SchemaAdapter(['followers_count', 'follower_following_ratio'], defaults={'followers_count': 5.0},
+                            version=3)
+    path = adapter.save(str(tmp_path / 'schema.json'))
+    loaded = SchemaAdapter.load(path)
+    assert loaded.feature_names == adapter.feature_names
+    assert loaded.version == 3
+    vectors = [{}, {'follower_following_ratio': float('inf')}]
+    np.testing.assert_array_equal(loaded.transform(vectors), adapter.transform(vectors))
+
+def test_schema_feature_names_keep_numeric_schema_columns():
+    frame = pd.DataFrame({'followers_count': [1, 2], 'camera_make': ['a', 'b'], 'phash_0': [3, 4],
+                          'compound': [0.1, 0.2]})
+    assert schema_feature_names(frame) == ['followers_count', 'compound']
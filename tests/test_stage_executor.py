@@ -0,0 +1,58 @@
+import os
+import threading
+import time
+from ml_models.stage_executor import Stage, StageExecutor
+
+def test_results_and_fallback_on_deadline():
+    executor = StageExecutor(thread_workers=4, process_workers=1)
+    release = threading.Event()
+    try:
+        run = executor.run([Stage('fast', lambda: {'a': 1}, deadline=1.0),
+                            Stage('slow', release.wait, (5,), deadline=0.05, fallback={})])
+        assert run.results == {'fast': {'a': 1}, 'slow': {}}
+        assert run.timed_out == ['slow']
+    finally:
+        release.set()
+        executor.close()
+
+def test_thread_stages_of_one_name_are_shed_past_the_bound():
+    executor = StageExecutor(thread_workers=4, process_workers=1, max_inflight=1)
+    release = threading.Event()
+    try:
+        first = executor.run([Stage('stuck', release.wait, (5,), deadline=0.05)])
+        second = executor.run([Stage('stuck', release.wait, (5,), deadline=1.0, fallback='shed')])
+        assert first.timed_out == ['stuck'] and first.shed == []
+        assert second.results == {'stuck': 'shed'} and second.shed == ['stuck']
+        release.set()
+        time.sleep(0.05)
+        third = executor.run([Stage('stuck', release.wait, (5,), deadline=1.0)])
+        assert third.results == {'stuck': True}
+        assert executor.metrics()['stages']['stuck']['shed'] == 1
+    finally:
+        release.set()
+        executor.close()
+
+def test_running_process_stage_is_stopped_and_the_pool_recycled():
+    executor = StageExecutor(thread_workers=2, process_workers=1)
+    try:
+        executor.run([Stage('warm', abs, (-1,), kind='process', deadline=60)])
+        pool = executor._processes
+        workers = list(pool._processes.values())
+        run = executor.run([Stage('hang', time.sleep, (60,), kind='process', deadline=1.0, fallback={})])
+        assert run.results == {'hang': {}} and run.timed_out == ['hang']
+        assert executor._processes is None
+        for worker in workers:
+            worker.join(5)
+            assert not worker.is_alive()
+        assert executor.run([Stage('after', abs, (-2,), kind='process', deadline=60)]).results == {'after': 2}
+    finally:
+        executor.close()
+
+def test_lost_worker_falls_back():
+    executor = StageExecutor(thread_workers=2, process_workers=1)
+    try:
+        run = executor.run([Stage('crash', os._exit, (1,), kind='process', deadline=60, fallback={})])
+        assert run.results == {'crash': {}} and run.timed_out == ['crash']
+        assert executor.run([Stage('after', abs, (-3,), kind='process', deadline=60)]).results == {'after': 3}
+    finally:
+        executor.close()
@@ -0,0 +1,76 @@
+import sys
+import time
+import types
+import pytest
+
+pytest.importorskip('pymongo')
+pytest.importorskip('passlib')
+pytest.importorskip('redis')
+
+from ml_models.process_pool import kill_pool
+
+FEATURES = {name: 0.5 for name in ('follower_following_ratio', 'degree_centrality', 'betweenness_centrality',
+                                   'closeness_centrality', 'clustering_coefficient')}
+
+def network_features_hanging_on(items):
+    # Stands in for stored_network_features in the spawned workers: the 'hung' user never returns
+    if any(user_id == 'hung' for user_id, _, _ in items):
+        time.sleep(600)
+    return [dict(FEATURES) for _ in items]
+
+class FakeRedis:
+    def __init__(self, dirty):
+        self.dirty = set(dirty)
+        self.deleted = []
+
+    def spop(self, key, count):
+        return [self.dirty.pop().encode() for _ in range(min(count, len(self.dirty)))]
+
+    def sadd(self, key, *members):
+        self.dirty.update(members)
+
+    def delete(self, *keys):
+        self.deleted.extend(keys)
+
+class FakeUsers:
+    def __init__(self, user_ids):
+        self.users = [{'_id': user_id, 'followers_count': 1, 'following_count': 2} for user_id in user_ids]
+        self.written = []
+
+    def find(self, query, projection):
+        return [user for user in self.users if user['_id'] in query['_id']['$in']]
+
+    def bulk_write(self, updates, ordered):
+        self.written.extend(update._filter['_id'] for update in updates)
+
+@pytest.fixture
+def user_service(monkeypatch):
+    # The collection is faked below, so the Mongo-backed model module is replaced too;
+    # the workers only import this module, not user_service
+    monkeypatch.setitem(sys.modules, 'backend.models.user', types.SimpleNamespace(User=None, users_collection=None))
+    monkeypatch.delitem(sys.modules, 'services.user_service', raising=False)
+    from services import user_service
+    yield user_service
+    sys.modules.pop('services.user_service', None)
+
+def test_hung_chunk_is_killed_and_its_users_marked_dirty_again(monkeypatch, user_service):
+    redis, users = FakeRedis(['a', 'hung', 'b']), FakeUsers(['a', 'hung', 'b'])
+    monkeypatch.setattr(user_service, 'redis_client', redis)
+    monkeypatch.setattr(user_service, 'users_collection', users)
+    monkeypatch.setattr(user_service, 'stored_network_features', network_features_hanging_on)
+    monkeypatch.setattr(user_service, 'NETWORK_RECOMPUTE_CHUNK', 1)
+    monkeypatch.setattr(user_service, 'NETWORK_RECOMPUTE_WORKERS', 3)
+    monkeypatch.setattr(user_service, 'NETWORK_RECOMPUTE_TIMEOUT', 10.0)
+    monkeypatch.setattr(user_service, '_network_pool', None)
+    killed = []
+    monkeypatch.setattr(user_service, 'kill_pool', lambda pool: (killed.append(pool), kill_pool(pool)))
+
+    pool = user_service._get_network_pool()
+    with pytest.raises(TimeoutError):
+        user_service.recompute_network_features()
+    # The finished chunks are written; the hung one is queued for the next run
+    assert sorted(users.written) == ['a', 'b']
+    assert sorted(redis.deleted) == ['user_stats:a', 'user_stats:b']
+    assert redis.dirty == {'hung'}
+    # Its worker is killed and the next run gets a fresh pool
+    assert killed == [pool] and user_service._network_pool is None
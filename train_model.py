@@ -1,8 +1,12 @@
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
-from ml_models.feature_extraction import extract_features
+from ml_models.feature_extraction import extract_features_many
+from ml_models.feature_vector import feature_dicts
+from ml_models.schema_adapter import save_schema, schema_feature_names
+from ml_models.text_feature_extraction import build_profile_text, fit_text_vectorizer, fit_topic_model
 from ml_models.preprocessing import preprocess_data
+from ml_models.cascade import train_cascade_model
 from ml_models.model_comparison import train_and_evaluate_models, train_ensemble
 from ml_models.model_evaluation import evaluate_model, hyperparameter_tuning, interpret_model
 import joblib
@@ -12,17 +16,28 @@ import shap
 
 # Load and preprocess data
 data = pd.read_csv('user_data.csv')
-features = []
-labels = []
+records = data.to_dict('records')
 
-for _, row in data.iterrows():
-    user_data = row.to_dict()
-    extracted_features = extract_features(user_data)
-    features.append(extracted_features)
-    labels.append(row['is_fake'])
+# Fit the TF-IDF vocabulary once so tfidf_* columns are stable between training and serving
+fit_text_vectorizer([
+    build_profile_text(row.get('bio', ''), row.get('posts', []))
+    for row in records
+])
 
-feature_df = pd.DataFrame(features)
-X, y = preprocess_data(feature_df, labels)
+# Train the LDA topic model offline; feature extraction only runs inference against it
+fit_topic_model([row.get('posts', []) for row in records])
+
+# Read-only against the serving indexes: training rows are neither added to them nor given
+# features that depend on the order they were extracted in
+features = extract_features_many(records, update_indexes=False)
+labels = data['is_fake'].tolist()
+
+feature_df = pd.DataFrame(feature_dicts(features))
+feature_names = schema_feature_names(feature_df)
+X, y = preprocess_data(feature_df[feature_names], labels)
+
+# First-stage cascade model on the cheap feature columns only
+train_cascade_model(feature_df, labels)
 
 # Split the data
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
@@ -59,7 +74,6 @@ best_model_scores = evaluate_model(best_model, X_test, y_test)
 print(f"\nBest {best_model_name} scores:", best_model_scores)
 
 # Model interpretation for the best model
-feature_names = feature_df.columns.tolist()
 shap_values, lime_exp = interpret_model(best_model, X_test, feature_names)
 
 # Plot SHAP summary plot
@@ -69,7 +83,9 @@ plt.title(f"{best_model_name} SHAP Feature Importance")
 plt.tight_layout()
 plt.savefig(f"{best_model_name.lower().replace(' ', '_')}_shap_importance.png")
 
-# Save models
+# Save models with the input schema they were trained on
+best_model.feature_names_ = feature_names
+save_schema(feature_names, version=1)
 joblib.dump(best_model, f'best_{best_model_name.lower().replace(" ", "_")}_model.joblib')
 joblib.dump(results['Voting Classifier']['model'], 'voting_classifier_model.joblib')
 joblib.dump(results['Stacking Classifier']['model'], 'stacking_classifier_model.joblib')